@@ -1,13 +1,14 @@
 from dataclasses import dataclass
-from datetime import datetime
-from typing import Optional
+import bisect
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
 import os
 import shutil
-import nexradaws
-import nexradaws.resources
-import nexradaws.resources.awsnexradfile
 import logging
 
+if TYPE_CHECKING:
+    from nexradaws.resources.awsnexradfile import AwsNexradFile
+
 @dataclass
 class DataType:
     name: str
@@ -15,7 +16,7 @@ class DataType:
     color_relief_file: str
     type_of_level: str
 
-@dataclass
+@dataclass(slots=True)
 class GeoDataFile:
     datetime: datetime
     remote_path: str
@@ -34,7 +35,15 @@ class GeoDataFile:
             logging.info(f'Tried to remove local_path: {self.local_path}, but it does not exist.')
 
     def remove_processed_loc(self):
-        if self.processed_loc and os.path.exists(self.processed_loc):
+        if self.processed_loc and os.path.isfile(self.processed_loc):
+            os.remove(self.processed_loc)
+            # georeferenced images carry a world file alongside them
+            world_file = os.path.splitext(self.processed_loc)[0] + '.pgw'
+            if os.path.exists(world_file):
+                os.remove(world_file)
+            logging.info(f'Removed processed file: {self.processed_loc}')
+            self.processed_loc = ''
+        elif self.processed_loc and os.path.exists(self.processed_loc):
             shutil.rmtree(self.processed_loc)
             logging.info(f'Removed processed dir: {self.processed_loc}')
             self.processed_loc = ''
@@ -47,8 +56,115 @@ class GeoDataFile:
         return self.datetime < other.datetime
 
 
-@dataclass
+@dataclass(slots=True)
 class NexradGeoDataFile(GeoDataFile):
-    scan: nexradaws.resources.awsnexradfile.AwsNexradFile
+    scan: 'AwsNexradFile'
     processed_path: str
-    
\ No newline at end of file
+
+
+class GeoDataFileCatalog:
+    '''
+    Time-ordered collection of processed GeoDataFiles with hash indexes on
+    key and processed_loc. Lookups are O(1), time-window queries and expiry
+    use bisect, and iteration is always oldest first.
+    '''
+    __slots__ = ('_sort_keys', '_files', '_by_key', '_by_processed_loc', '_seq')
+
+    def __init__(self, files: Optional[List[GeoDataFile]] = None):
+        self._sort_keys: List[Tuple[datetime, int]] = []
+        self._files: List[GeoDataFile] = []
+        self._by_key: Dict[str, GeoDataFile] = {}
+        self._by_processed_loc: Dict[str, GeoDataFile] = {}
+        self._seq = 0
+        for file in files or []:
+            self.add(file)
+
+    @staticmethod
+    def _as_utc(value: datetime) -> datetime:
+        # naive datetimes are treated as UTC so everything stays comparable
+        if value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value
+
+    def add(self, file: GeoDataFile) -> bool:
+        '''
+        Adds file unless its key is already catalogued (a key is one frame of
+        a source, even where frames share a processed_loc). Returns True if added.
+        '''
+        if file.datetime is None:
+            logging.error(f'Not cataloguing {file.key}: it has no datetime.')
+            return False
+        if file.key in self._by_key:
+            return False
+
+        file.datetime = self._as_utc(file.datetime)
+        # the sequence number keeps insertion order stable among equal times
+        sort_key = (file.datetime, self._seq)
+        self._seq += 1
+        index = bisect.bisect_right(self._sort_keys, sort_key)
+        self._sort_keys.insert(index, sort_key)
+        self._files.insert(index, file)
+        self._by_key[file.key] = file
+        if file.processed_loc:
+            self._by_processed_loc[file.processed_loc] = file
+        return True
+
+    def _unindex(self, file: GeoDataFile):
+        if self._by_key.get(file.key) is file:
+            del self._by_key[file.key]
+        if self._by_processed_loc.get(file.processed_loc) is file:
+            del self._by_processed_loc[file.processed_loc]
+
+    def remove(self, file: GeoDataFile) -> bool:
+        lo = bisect.bisect_left(self._sort_keys, (file.datetime,))
+        for index in range(lo, len(self._files)):
+            if self._files[index].datetime != file.datetime:
+                break
+            if self._files[index] is file:
+                del self._sort_keys[index]
+                del self._files[index]
+                self._unindex(file)
+                return True
+        return False
+
+    def expire(self, cutoff: datetime) -> List[GeoDataFile]:
+        '''Removes and returns every file at or before cutoff.'''
+        index = bisect.bisect_right(self._sort_keys, (self._as_utc(cutoff), self._seq))
+        expired = self._files[:index]
+        del self._sort_keys[:index]
+        del self._files[:index]
+        for file in expired:
+            self._unindex(file)
+        return expired
+
+    def window(self, start: datetime, end: Optional[datetime] = None) -> List[GeoDataFile]:
+        '''Returns files with start < datetime <= end, oldest first.'''
+        lo = bisect.bisect_right(self._sort_keys, (self._as_utc(start), self._seq))
+        hi = len(self._files) if end is None else \
+            bisect.bisect_right(self._sort_keys, (self._as_utc(end), self._seq))
+        return self._files[lo:hi]
+
+    def get_by_key(self, key: str) -> Optional[GeoDataFile]:
+        return self._by_key.get(key)
+
+    def get_by_processed_loc(self, processed_loc: str) -> Optional[GeoDataFile]:
+        return self._by_processed_loc.get(processed_loc)
+
+    def has_processed_loc(self, processed_loc: str) -> bool:
+        return processed_loc in self._by_processed_loc
+
+    def processed_locs(self) -> List[str]:
+        return [file.processed_loc for file in self._files]
+
+    def __contains__(self, file: GeoDataFile) -> bool:
+        # by key, like add
+        return file.key in self._by_key
+
+    def __iter__(self) -> Iterator[GeoDataFile]:
+        return iter(list(self._files))
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def __getitem__(self, index):
+        return self._files[index]
@@ -1,27 +1,58 @@
 import abc
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from tqdm import tqdm
-from classes import DataType, GeoDataFile
-from typing import List
+from classes import DataType, GeoDataFile, GeoDataFileCatalog
+from utils.downloader import Downloader
+from utils.dynamic_tiles import remove_frame_raster
+from utils.frame_manifest import FrameManifest
+from utils.grid_store import GridFrameSink, GridStore
+from utils.tile_archive import MBTILES_EXT, evict_archive, is_tile_archive
+from utils.tile_store import TILE_INDEX_EXT, is_tile_index, remove_frame, sweep_frames_dir
+from typing import Callable, List, Optional, Tuple
 import logging
 from datetime import datetime, timezone, timedelta
 
 
+# Output formats for tiled frames: 'xyz' is a {z}/{x}/{y}.png directory per
+# frame, 'mbtiles' a single archive file per frame, and 'store' a small index
+# per frame into a deduplicated tile store (both served by the Flask app)
+TILE_FORMAT_EXTENSIONS = {'xyz': '', 'mbtiles': MBTILES_EXT, 'store': TILE_INDEX_EXT}
+
+
 class DataSource(abc.ABC):
     def __init__(
             self, raw_data_folder: str, 
             processed_data_folder:str , 
-            time_delta: timedelta
+            time_delta: timedelta,
+            process_workers: int = 1,
+            manifest: Optional[FrameManifest] = None,
+            tile_format: str = 'xyz',
+            grid_store_dir: Optional[str] = None
         ):
+        if tile_format not in TILE_FORMAT_EXTENSIONS:
+            raise ValueError(f'Unknown tile format: {tile_format}')
         self.raw_data_folder = raw_data_folder
         self.processed_data_folder = processed_data_folder
         self.time_delta = time_delta
+        # > 1 processes downloaded files in a process pool of this size
+        self.process_workers = process_workers
+        # Long-lived pool, created on first use (see get_executor)
+        self.executor: Optional[ProcessPoolExecutor] = None
         if not os.path.exists(raw_data_folder):
             os.makedirs(raw_data_folder)
         if not os.path.exists(processed_data_folder):
             os.makedirs(processed_data_folder)
 
-        self.processed_files: List[GeoDataFile] = []
+        self.processed_files = GeoDataFileCatalog()
+        # Durable record of processed frames, so startup doesn't walk the tiles tree
+        self.manifest = manifest
+        self.manifest_source = self.__class__.__name__
+        self.tile_format = tile_format
+        # Optional store of the decoded float grids, kept as long as the tiles
+        self.grid_store = GridStore(grid_store_dir) if grid_store_dir else None
 
         # Configure logging
         logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -44,27 +75,68 @@ class DataSource(abc.ABC):
     def extract_datetime_from_name(self, name: str):
         raise NotImplementedError
 
-    def sort_processed_files(self, reverse=False):
-        self.processed_files.sort(reverse=reverse)
+    def find_processed_files(self) -> List[GeoDataFile]:
+        '''Frames in self.processed_variable_data_dir, whose names carry their time.'''
+        files: List[GeoDataFile] = []
+        for name in os.listdir(self.processed_variable_data_dir):
+            # skip archives that are still being written, and frame rasters
+            if name.startswith('.'):
+                continue
+            files.append(GeoDataFile(
+                datetime=self.extract_datetime_from_name(name),
+                remote_path='',
+                local_path='',
+                processed_loc=os.path.join(self.processed_variable_data_dir, name),
+                key=name
+            ))
+        return files
+
+    def reconcile_manifest(self, manifest_source: str, on_disk: List[GeoDataFile]) -> List[GeoDataFile]:
+        '''
+        Returns the frames to catalogue at startup, with the manifest brought
+        in line with the disk. Frames still marked 'processing' were
+        interrupted mid-write, so their output is deleted. Rows whose output is
+        gone (e.g. deleted by hand) are dropped, and frames on disk that the
+        manifest lacks (e.g. written before a crash) are recorded.
+        '''
+        unparsed = [file for file in on_disk if file.datetime is None]
+        for file in unparsed:
+            logging.error(f'{manifest_source}: skipping {file.processed_loc}, its name has no datetime.')
+        on_disk = [file for file in on_disk if file.datetime is not None]
+
+        if self.manifest is None:
+            return on_disk
 
-    # Creates geo_data_files for all dirs in self.processed_data_folder
+        interrupted = self.manifest.load(manifest_source, status='processing')
+        interrupted_locs = {file.processed_loc for file in interrupted}
+        for file in interrupted:
+            self.remove_processed_output(file)
+
+        ready = self.manifest.load(manifest_source)
+        gone = [file.processed_loc for file in ready if not os.path.exists(file.processed_loc)]
+        self.manifest.remove(manifest_source, list(interrupted_locs) + gone)
+
+        gone_locs = set(gone)
+        files = [file for file in ready if file.processed_loc not in gone_locs]
+        known_locs = {file.processed_loc for file in files} | interrupted_locs
+        untracked = [file for file in on_disk if file.processed_loc not in known_locs]
+        self.manifest.record(manifest_source, untracked)
+
+        logging.info(
+            f'{manifest_source}: {len(files)} frames from the manifest, {len(untracked)} found on disk, '
+            f'{len(gone)} missing and {len(interrupted)} interrupted frames dropped'
+        )
+        return files + untracked
+
+    # Catalogues the frames in self.processed_variable_data_dir, reconciled with the manifest
     def init_processed_files(self):
         os.makedirs(self.processed_variable_data_dir, exist_ok=True)
         logging.info('Initializing processed_files...')
-        for dir in os.listdir(self.processed_variable_data_dir):
-            datetime = self.extract_datetime_from_name(dir)
-            geo_data_file = GeoDataFile(
-                datetime=datetime,
-                remote_path='',
-                local_path='',
-                processed_loc=os.path.join(
-                    self.processed_variable_data_dir,
-                    dir 
-                ),
-                key=dir
-            )
-
-            self.processed_files.append(geo_data_file)
+        for file in self.reconcile_manifest(self.manifest_source, self.find_processed_files()):
+            self.processed_files.add(file)
+        if self.tile_format == 'store':
+            # nothing is being written yet, so leaked blob references can be recounted
+            sweep_frames_dir(self.processed_variable_data_dir)
         logging.info('processed_files initialized.')
 
     @abc.abstractmethod
@@ -76,13 +148,49 @@ class DataSource(abc.ABC):
     
     def get_processed_loc(self, file: GeoDataFile) -> str:
         file_dir = file.key.split('/')[-1]
-        return os.path.join(self.processed_variable_data_dir, file_dir)
+        return os.path.join(self.processed_variable_data_dir, file_dir) + TILE_FORMAT_EXTENSIONS[self.tile_format]
     
+    def get_grid_sink(self, file: GeoDataFile) -> Optional[GridFrameSink]:
+        if self.grid_store is None:
+            return None
+        return GridFrameSink(self.grid_store.root, file.key, file.datetime)
+
     def get_processed_locs(self) -> List[str]:
-        processed_locs = []
-        for file in self.processed_files:
-            processed_locs.append(file.processed_loc)
-        return processed_locs
+        return self.processed_files.processed_locs()
+
+    def mark_processing(self, files: List[GeoDataFile]):
+        '''
+        Records the frames about to be written as 'processing', so output
+        interrupted mid-write is found (and removed) at the next startup.
+        '''
+        if self.manifest is None:
+            return
+        pending = [
+            GeoDataFile(
+                datetime=file.datetime, remote_path='', local_path='',
+                processed_loc=self.get_processed_loc(file), key=file.key
+            )
+            for file in files if file.datetime is not None
+        ]
+        self.manifest.record(self.manifest_source, pending, status='processing')
+
+    def discard_failed_output(self, file: GeoDataFile):
+        '''Deletes whatever a failed job wrote, so it isn't later taken for a finished frame.'''
+        processed_loc = self.get_processed_loc(file)
+        if self.processed_files.has_processed_loc(processed_loc):
+            return
+        if self.manifest is not None:
+            self.manifest.remove(self.manifest_source, [processed_loc])
+        self.remove_processed_output(GeoDataFile(
+            datetime=file.datetime, remote_path='', local_path='', processed_loc=processed_loc, key=file.key
+        ))
+
+    def add_processed_file(self, file: GeoDataFile) -> bool:
+        added = self.processed_files.add(file)
+        # also when already catalogued, so its 'processing' row is marked ready
+        if self.manifest is not None and self.processed_files.has_processed_loc(file.processed_loc):
+            self.manifest.record(self.manifest_source, [file])
+        return added
     
     def get_processed_locs_with_time(self) -> List[str]:
         processed_locs = []
@@ -103,14 +211,10 @@ class DataSource(abc.ABC):
             else:
                 logging.info(f'{processed_loc} exists, Skipping download of {file.key}...')
                 # check if file that's been processed is in self.processed_files
-                in_processed_files = False
-                for processed_file in self.processed_files:
-                    if (processed_file.processed_loc == processed_loc):
-                        in_processed_files = True
-                if not in_processed_files:
+                if not self.processed_files.has_processed_loc(processed_loc):
                     logging.info(f'{processed_loc} exists, but was not in self.processed_files. adding...')
                     file.processed_loc = processed_loc
-                    self.processed_files.append(file)
+                    self.add_processed_file(file)
         return files_to_download
 
     def remove_downloaded_files(self, downloaded_files: List[GeoDataFile]):
@@ -145,19 +249,28 @@ class DataSource(abc.ABC):
     
     def clean_up_processed_files(self):
         logging.info('Cleaning up processed_files...')
-        self.sort_processed_files(reverse=True)
-        updated_processed_files: List[GeoDataFile] = []
         time_cutoff = datetime.now(timezone.utc) - self.time_delta
-        for processed_file in self.processed_files:
-            if processed_file.datetime > time_cutoff:
-                updated_processed_files.append(processed_file)
-            else:
-                processed_file.remove_processed_loc()
-                if processed_file.local_path != '':
-                    processed_file.remove_local_file()
+        expired_files = self.processed_files.expire(time_cutoff)
+        if self.manifest is not None:
+            self.manifest.remove(self.manifest_source, [file.processed_loc for file in expired_files])
+        if self.grid_store is not None:
+            self.grid_store.expire(time_cutoff)
+        for processed_file in expired_files:
+            self.remove_processed_output(processed_file)
+            if processed_file.local_path != '':
+                processed_file.remove_local_file()
 
-        self.processed_files = updated_processed_files
-        self.sort_processed_files()
+    def remove_processed_output(self, file: GeoDataFile):
+        '''Deletes a frame's output in whichever tile format it was written.'''
+        if file.processed_loc:
+            remove_frame_raster(file.processed_loc)
+        if is_tile_index(file.processed_loc):
+            remove_frame(file.processed_loc)
+            file.processed_loc = ''
+            return
+        if is_tile_archive(file.processed_loc):
+            evict_archive(file.processed_loc)
+        file.remove_processed_loc()
 
     def download_files(self, geo_data_files: List[GeoDataFile]) -> List[GeoDataFile]:
         downloaded_files: List[GeoDataFile] = []
@@ -166,20 +279,101 @@ class DataSource(abc.ABC):
             if downloaded_file:
                 downloaded_files.append(downloaded_file)
         return downloaded_files
+
+    '''
+    Downloads geo_data_files over HTTP(S) concurrently with a pooled Downloader.
+    Returns the files that downloaded successfully, with local_path set.
+    '''
+    def download_files_pooled(self, downloader: Downloader, geo_data_files: List[GeoDataFile]) -> List[GeoDataFile]:
+        jobs = [(file.remote_path, self.get_download_path(file)) for file in geo_data_files]
+        results = downloader.download_many(jobs)
+
+        downloaded_files: List[GeoDataFile] = []
+        for file, result in zip(geo_data_files, results):
+            if result.success:
+                file.local_path = result.path
+                downloaded_files.append(file)
+            else:
+                logging.error(f'Failed to download {result.url}: {result.error}')
+        return downloaded_files
     
     def process_files(self, downloaded_files: List[GeoDataFile]):
+        self.mark_processing(downloaded_files)
+        if self.process_workers > 1 and len(downloaded_files) > 1:
+            return self.process_files_parallel(downloaded_files)
+
         for file in downloaded_files:
             processed_file = self.process_file(file)
 
-            processed_locs = self.get_processed_locs()
+            if processed_file is not None:
+                self.add_processed_file(processed_file)
+            else:
+                self.discard_failed_output(file)
+            file.remove_local_file()
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        '''
+        The source's process pool, kept across updates. Workers are spawned
+        rather than forked: other sources update on background threads, and a
+        fork taken while one holds a GDAL or sqlite lock can deadlock the child.
+        '''
+        if self.executor is None:
+            logging.info(f'Starting {self.__class__.__name__} worker pool with {self.process_workers} workers...')
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.process_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return self.executor
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+    def discard_broken_executor(self):
+        # a broken pool runs nothing more; release what's left of it and
+        # start a fresh one on next use
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def process_files_parallel(self, downloaded_files: List[GeoDataFile]):
+        logging.info(f'Processing {len(downloaded_files)} files with {self.process_workers} workers...')
+        executor = self.get_executor()
+        futures = {}
+        for file in downloaded_files:
+            func, args = self.get_process_job(file)
+            futures[executor.submit(func, *args)] = file
+
+        for future in as_completed(futures):
+            file = futures[future]
+            try:
+                processed_file = future.result()
+            except BrokenProcessPool as e:
+                # a worker died (e.g. OOM); start a fresh pool next run
+                logging.error(f'Worker pool broke while processing {file.local_path}: {e}')
+                self.discard_broken_executor()
+                processed_file = None
+            except Exception as e:
+                logging.error(f'Error processing {file.local_path}: {e}')
+                processed_file = None
 
             if processed_file is not None:
-                if processed_file.processed_loc not in processed_locs:
-                    self.processed_files.append(processed_file)
+                self.add_processed_file(processed_file)
+            else:
+                self.discard_failed_output(file)
             file.remove_local_file()
 
-            
+    def process_file(self, geo_data_file: GeoDataFile) -> GeoDataFile | None:
+        func, args = self.get_process_job(geo_data_file)
+        return func(*args)
 
+    '''
+    Returns (func, args) where func is a module-level (picklable) function
+    that processes the file when called as func(*args).
+    '''
+    def get_process_job(self, geo_data_file: GeoDataFile) -> Tuple[Callable, tuple]:
+        raise NotImplementedError
 
     @abc.abstractmethod
     def download_file(self, geo_data_file: GeoDataFile):
@@ -1,28 +1,36 @@
-from typing import List
+from typing import List, Optional
 from classes import GeoDataFile
 from data_source import DataSource
 from datetime import datetime, timedelta, timezone
 import logging
-import requests
 import re
 import os
 import shutil
 from utils.data_to_tiles import process_tif_to_tiles
+from utils.downloader import Downloader
+from utils.frame_manifest import FrameManifest
+from utils.grid_store import GridFrameSink
 
 class GPMDataSource(DataSource):
     def __init__(
             self, raw_data_folder: str, 
             processed_data_folder: str, 
-            time_delta: timedelta
+            time_delta: timedelta,
+            process_workers: int = 1,
+            manifest: Optional[FrameManifest] = None,
+            tile_format: str = 'xyz',
+            grid_store_dir: Optional[str] = None
         ):
-        super().__init__(raw_data_folder, processed_data_folder, time_delta)
+        super().__init__(
+            raw_data_folder, processed_data_folder, time_delta, process_workers, manifest, tile_format, grid_store_dir
+        )
 
         self.variable_name = 'precip_30mn'
         self.processed_variable_data_dir = os.path.join(processed_data_folder, self.variable_name)
         self.remote_data_loc = 'https://pmmpublisher.pps.eosdis.nasa.gov/products/s3/'
         self.color_relief_file = './assets/color_reliefs/GPM_color_relief.txt'
         self.base_url='https://pmmpublisher.pps.eosdis.nasa.gov/opensearch'
-        self.processed_files: List[GeoDataFile] = []
+        self.downloader = Downloader(max_concurrent=4)
         self.n_files=15
         self.init_processed_files()
         self.clean_up_processed_files()
@@ -49,7 +57,7 @@ class GPMDataSource(DataSource):
                 f'&startTime={yesterday}&endTime={today}'
             
             try:
-                response = requests.get(query)
+                response = self.downloader.get(query)
             except Exception as e:
                 logging.error('Error fetching gpm files:', e, 'With query:', query)
             
@@ -100,33 +108,20 @@ class GPMDataSource(DataSource):
         return os.path.join(self.raw_data_folder,file.key)
     
     def download_files(self, geo_data_files: List[GeoDataFile]) -> List[GeoDataFile]:
-        downloaded_files: List[GeoDataFile] = []
-        for file in geo_data_files:
-            downloaded_file = self.download_file(file)
-            if downloaded_file:
-                downloaded_files.append(downloaded_file)
-        return downloaded_files
+        return self.download_files_pooled(self.downloader, geo_data_files)
 
     
     def download_file(self, geo_data_file: GeoDataFile) -> GeoDataFile | None:
-        # Send a GET request to the URL
         logging.info(f'Downloading {geo_data_file.remote_path}')
-        response = requests.get(geo_data_file.remote_path)
-
         download_path = self.get_download_path(geo_data_file)
-        os.makedirs(os.path.dirname(download_path), exist_ok=True)
-        
-        if response.status_code == 200:
-            # Write the content to a file
-            with open(download_path, 'wb') as file:
-                file.write(response.content)
+
+        result = self.downloader.download(geo_data_file.remote_path, download_path)
+        if result.success:
             logging.info(f"File downloaded successfully: {download_path}")
             geo_data_file.local_path = download_path
-            logging.info('')
             return geo_data_file
         else:
-            logging.error(f"Failed to download file: {response.status_code}")
-        
+            logging.error(f"Failed to download file: {result.error}")
             return None
 
     def extract_datetime_from_path(self, path: str) -> datetime:
@@ -148,25 +143,11 @@ class GPMDataSource(DataSource):
         else:
             raise ValueError("No valid datetime found in the provided path.")
     
-    def process_file(self, geo_data_file: GeoDataFile) -> GeoDataFile | None:
-        logging.info(f'Processing {geo_data_file.local_path}')
+    def get_process_job(self, geo_data_file: GeoDataFile):
         processed_loc = self.get_processed_loc(geo_data_file)
-        try:
-            success = process_tif_to_tiles(geo_data_file.local_path, processed_loc, self.color_relief_file)
-            logging.info(f'{geo_data_file.local_path} processed successfully to tiles.')
-            geo_data_file.processed_loc = processed_loc
-
-            if not success:
-                print(f'file: {geo_data_file.processed_loc} failed. REMOVING.....')
-                geo_data_file.remove_processed_loc()
-                return None
-
-        except Exception as e:
-            logging.error(f'Error processing GPM tif to tiles for {geo_data_file.local_path}:', e)
-            geo_data_file.remove_processed_loc()
-            return None
-
-        return geo_data_file
+        return process_file, (
+            geo_data_file, processed_loc, self.color_relief_file, self.get_grid_sink(geo_data_file)
+        )
 
     
     # ## TODO
@@ -176,4 +157,26 @@ class GPMDataSource(DataSource):
     #     return os.path.join(self.processed_variable_data_dir, file_dir)
 
     # def init_processed_files(self):
-    #     raise NotImplementedError
\ No newline at end of file
+    #     raise NotImplementedError
+
+
+def process_file(
+        geo_data_file: GeoDataFile, processed_loc: str, color_relief_file: str, grid_sink: GridFrameSink | None = None
+) -> GeoDataFile | None:
+    logging.info(f'Processing {geo_data_file.local_path}')
+    try:
+        success = process_tif_to_tiles(geo_data_file.local_path, processed_loc, color_relief_file, grid_sink=grid_sink)
+        logging.info(f'{geo_data_file.local_path} processed successfully to tiles.')
+        geo_data_file.processed_loc = processed_loc
+
+        if not success:
+            print(f'file: {geo_data_file.processed_loc} failed. REMOVING.....')
+            geo_data_file.remove_processed_loc()
+            return None
+
+    except Exception as e:
+        logging.error(f'Error processing GPM tif to tiles for {geo_data_file.local_path}: {e}')
+        geo_data_file.remove_processed_loc()
+        return None
+
+    return geo_data_file
@@ -1,14 +1,15 @@
 import logging
 import os
-from typing import List
-import requests
+from typing import List, Optional
 from bs4 import BeautifulSoup
-from tqdm import tqdm
 from datetime import datetime, timedelta, timezone
 
 from classes import GeoDataFile
 from data_source import DataSource
 from utils.data_to_tiles import process_zipped_grib2_to_tiles
+from utils.downloader import Downloader
+from utils.frame_manifest import FrameManifest
+from utils.grid_store import GridFrameSink
 
 
 class MRMSDataSource(DataSource):
@@ -17,8 +18,14 @@ class MRMSDataSource(DataSource):
             raw_data_folder='./data/raw/mrms', 
             processed_data_folder='../radar-app/public/tiles/mrms',
             time_delta: timedelta = timedelta(hours=1),
+            process_workers: int = 1,
+            manifest: Optional[FrameManifest] = None,
+            tile_format: str = 'xyz',
+            grid_store_dir: Optional[str] = None,
         ):
-        super().__init__(raw_data_folder, processed_data_folder, time_delta)
+        super().__init__(
+            raw_data_folder, processed_data_folder, time_delta, process_workers, manifest, tile_format, grid_store_dir
+        )
         self.processed_data_folder = processed_data_folder
         self.raw_data_folder = raw_data_folder
 
@@ -27,30 +34,9 @@ class MRMSDataSource(DataSource):
         self.variable_url = os.path.join(self.base_url, self.variable_name)
         self.processed_variable_data_dir = os.path.join(processed_data_folder, self.variable_name)
         self.color_relief_file = './assets/color_reliefs/Reflectivity_0C_color_relief.txt'
-        self.processed_files = []
+        self.downloader = Downloader(max_concurrent=8)
         self.init_processed_files()
 
-    # Creates geo_data_files for all dirs in self.processed_data_folder
-    def init_processed_files(self):
-        os.makedirs(self.processed_variable_data_dir, exist_ok=True)
-        
-        logging.info('Initializing processed_files...')
-        for dir in os.listdir(self.processed_variable_data_dir):
-            datetime = self.extract_datetime_from_name(dir)
-            geo_data_file = GeoDataFile(
-                datetime=datetime,
-                remote_path='',
-                local_path='',
-                processed_loc=os.path.join(
-                    self.processed_variable_data_dir,
-                    dir 
-                ),
-                key=dir
-            )
-
-            self.processed_files.append(geo_data_file)
-        logging.info('processed_files initialized.')
-    
     def extract_datetime_from_name(self, name: str):
         try:
             parts = name.split('_')
@@ -64,7 +50,7 @@ class MRMSDataSource(DataSource):
             return datetime.min
 
     def fetch_data_files(self) -> List[GeoDataFile]:
-        response = requests.get(self.variable_url)
+        response = self.downloader.get(self.variable_url)
         if response.status_code != 200:
             raise Exception(f"Failed to retrieve data: {response.status_code}")
 
@@ -89,65 +75,51 @@ class MRMSDataSource(DataSource):
                 except Exception as e:
                     logging.error(f"Error createing Geo Data File date from {href}: {e}")
 
-        self.sort_processed_files()
         # recent_geo_data_files = geo_data_files[-self.n_files:]
 
         return geo_data_files
 
+    def download_files(self, geo_data_files: List[GeoDataFile]) -> List[GeoDataFile]:
+        return self.download_files_pooled(self.downloader, geo_data_files)
+
     def download_file(self, geo_data_file: GeoDataFile) -> GeoDataFile | None:
-        if not os.path.exists(self.processed_data_folder):
-            os.makedirs(self.processed_data_folder)
-        
         download_path = self.get_download_path(geo_data_file)
-
-        os.makedirs(os.path.dirname(download_path), exist_ok=True)
-
         logging.info(f'Downloading {geo_data_file.remote_path} to {download_path}')
 
-
-        response = requests.get(geo_data_file.remote_path, stream=True)
-        if response.status_code == 200:
-            total_size = int(response.headers.get('content-length', 0))
-            with open(download_path, 'wb') as f, tqdm(
-                desc=download_path,
-                total=total_size,
-                unit='iB',
-                unit_scale=True,
-                unit_divisor=1024,
-            ) as bar:
-                for chunk in response.iter_content(chunk_size=1024):
-                    size = f.write(chunk)
-                    bar.update(size)
+        result = self.downloader.download(geo_data_file.remote_path, download_path)
+        if result.success:
             geo_data_file.local_path = download_path
             return geo_data_file
-            
         else:
-            logging.error(f"Failed to download file: {geo_data_file.remote_path}")
+            logging.error(f"Failed to download file: {geo_data_file.remote_path} ({result.error})")
             return None
 
-    def process_file(self, geo_data_file: GeoDataFile) -> GeoDataFile | None:
-
+    def get_process_job(self, geo_data_file: GeoDataFile):
         output_dir = self.get_processed_loc(geo_data_file)
-        os.makedirs(output_dir, exist_ok=True)
-        try:
-            success = process_zipped_grib2_to_tiles(
-                geo_data_file.local_path,
-                'unknown',
-                None,
-                output_tiles=output_dir,
-                color_relief_file=self.color_relief_file,
-                target_crs='EPSG:3857',
-                filter_grib=False
-            )
-            geo_data_file.processed_loc = output_dir
-
-            if not success:
-                geo_data_file.remove_processed_loc()
-                return None
-        except Exception as e:
-            logging.error(f'Error processing {geo_data_file.local_path} to tiles:', e)
+        return process_file, (geo_data_file, output_dir, self.color_relief_file, self.get_grid_sink(geo_data_file))
+
+
+def process_file(
+        geo_data_file: GeoDataFile, output_dir: str, color_relief_file: str, grid_sink: GridFrameSink | None = None
+) -> GeoDataFile | None:
+    try:
+        success = process_zipped_grib2_to_tiles(
+            geo_data_file.local_path,
+            'unknown',
+            None,
+            output_tiles=output_dir,
+            color_relief_file=color_relief_file,
+            target_crs='EPSG:3857',
+            filter_grib=False,
+            grid_sink=grid_sink
+        )
+        geo_data_file.processed_loc = output_dir
+
+        if not success:
+            geo_data_file.remove_processed_loc()
             return None
-        
-        
+    except Exception as e:
+        logging.error(f'Error processing {geo_data_file.local_path} to tiles: {e}')
+        return None
 
-        return geo_data_file
+    return geo_data_file
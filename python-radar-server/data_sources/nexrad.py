@@ -1,31 +1,40 @@
-import gc
-import threading
-from typing import List, Tuple
-from classes import GeoDataFile
-from data_source import DataSource
-import nexradaws
+from typing import Dict, List
+from classes import GeoDataFile, GeoDataFileCatalog
+from data_source import TILE_FORMAT_EXTENSIONS, DataSource
 from datetime import datetime, timedelta, timezone
 import logging
 from classes import NexradGeoDataFile
 from typing import List
 import os
-import pyart
-import cartopy.crs as ccrs
-import cartopy.feature as cfeature
-import matplotlib.pyplot as plt
+import glob
 import json
 from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
-from multiprocessing import Pool
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from utils.data_to_tiles import process_array_to_tiles
+from utils.frame_manifest import FrameManifest
+from utils.nexrad_mosaic import build_mosaic
+from utils.nexrad_worker import init_worker, process_file
+from utils.ppi_rasterizer import set_grid_cache_dir
+from utils.tile_store import sweep_frames_dir
 
 from datetime import datetime, timedelta, timezone
 
 class NexradDataSource(DataSource):
-    def __init__(self, raw_data_folder, processed_data_folder, time_delta):
-        super().__init__(raw_data_folder, processed_data_folder, time_delta)
-
+    def __init__(
+            self, raw_data_folder, processed_data_folder, time_delta,
+            process_workers: int = 7,
+            max_tasks_per_child: int = 200,
+            mosaic_data_folder: str | None = None,
+            mosaic_rule: str = 'max',
+            manifest: FrameManifest | None = None,
+            tile_format: str = 'xyz'
+        ):
+        super().__init__(raw_data_folder, processed_data_folder, time_delta, process_workers, manifest, tile_format)
+
+        import nexradaws
         self.nexrad_interface = nexradaws.NexradAwsInterface()
-        self.processed_files: List[NexradGeoDataFile] = []
 
         file_path = './assets/nexrad_stations.json'
         with open(file_path, 'r') as file:
@@ -38,41 +47,124 @@ class NexradDataSource(DataSource):
         self.time_delta = time_delta
 
         self.variable_name = 'reflectivity'
+        self.color_relief_file = './assets/color_reliefs/nexrad_reflectivity_color_relief.txt'
+
+        # Sites are listed concurrently, each only from its newest processed scan onward
+        self.listing_workers = 16
+        self.site_high_water_marks: Dict[str, datetime] = {}
+        self.bucket = 'noaa-nexrad-level2'
+        self._s3_client = None
+
+        # Long-lived render pool, created on first use. Workers are recycled
+        # after max_tasks_per_child scans to cap memory growth.
+        self.max_tasks_per_child = max_tasks_per_child
+        self.grid_cache_dir = os.path.join(raw_data_folder, 'site_grids')
+
+        # National mosaic: workers save each scan's float sweep under sweep_dir,
+        # and the newest sweep per site is composited and tiled like MRMS.
+        self.mosaic_rule = mosaic_rule
+        self.sweep_dir = os.path.join(raw_data_folder, 'sweeps') if mosaic_data_folder else None
+        self.mosaic_variable_data_dir = (
+            os.path.join(mosaic_data_folder, self.variable_name) if mosaic_data_folder else None
+        )
+        self.mosaic_color_relief_file = './assets/color_reliefs/nexrad_reflectivity_color_relief.txt'
+        self.mosaic_files = GeoDataFileCatalog()
+        self.mosaic_manifest_source = f'{self.manifest_source}Mosaic'
+        if self.sweep_dir is not None:
+            # the mosaic is built in this process, from the same site grid cache as the workers
+            set_grid_cache_dir(self.grid_cache_dir)
+
+        self.init_processed_files()
+        self.init_mosaic_files()
+
+    @property
+    def s3_client(self):
+        # boto3 is slow to import and only needed once we actually list
+        if self._s3_client is None:
+            import boto3
+            from botocore import UNSIGNED
+            from botocore.client import Config
+            self._s3_client = boto3.client(
+                's3', config=Config(signature_version=UNSIGNED, max_pool_connections=self.listing_workers)
+            )
+        return self._s3_client
+
+    def list_site_objects(self, site_code: str, start: datetime, end: datetime) -> List[dict]:
+        '''
+        Lists the site's objects in each UTC day prefix from start to end. Keys
+        sort by scan time within a prefix, so the first day is listed only
+        after the key of a scan at start and older scans are never returned.
+        '''
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        objects = []
+        day = start.date()
+        while day <= end.date():
+            prefix = f'{day:%Y/%m/%d}/{site_code}/'
+            params = {'Bucket': self.bucket, 'Prefix': prefix}
+            if day == start.date():
+                params['StartAfter'] = f'{prefix}{site_code}{start:%Y%m%d_%H%M%S}'
+            for page in paginator.paginate(**params):
+                objects.extend(page.get('Contents', []))
+            day += timedelta(days=1)
+        return objects
+
+    def fetch_site_scans(self, site_code: str, now: datetime) -> List[NexradGeoDataFile]:
+        '''
+        Lists scans for one site newer than both the retention cutoff and the
+        site's high-water mark (the newest scan already processed).
+        '''
+        from nexradaws.resources.awsnexradfile import AwsNexradFile
+
+        cutoff_time = now - self.time_delta
+        high_water_mark = self.site_high_water_marks.get(site_code)
+        start = max(cutoff_time, high_water_mark) if high_water_mark else cutoff_time
+
+        scans = [AwsNexradFile(obj) for obj in self.list_site_objects(site_code, start, now)]
+        if not scans and high_water_mark is None:
+            logging.error(f'Error, nexrad fetch_data_scans for site {site_code} returned no files')
 
-    def fetch_data_files(self) -> List[NexradGeoDataFile]:
         nexrad_geo_data_files: List[NexradGeoDataFile] = []
-        for site_code in tqdm(self.site_codes, desc='fetching NEXRAD site scans'):
-            try:
-                now = datetime.now(timezone.utc)
-                cutoff_time = now - self.time_delta
-                scans = self.nexrad_interface.get_avail_scans_in_range(
-                    now - timedelta(days=1), 
-                    now,
-                    site_code, 
-                )
-                
-                if scans:
-                    for scan in scans:
-                        if scan.scan_time >= cutoff_time:
-                            if 'MDM' not in scan.filename:
-                                nexrad_geo_data_file = NexradGeoDataFile(
-                                    remote_path=scan.key,
-                                    key=scan.key,
-                                    datetime=scan.scan_time,
-                                    scan=scan,
-                                    local_path='',
-                                    processed_loc='',
-                                    processed_path=''
-                                )
-                            nexrad_geo_data_files.append(nexrad_geo_data_file)
-                else:
-                    logging.error(f'Error, nexrad fetch_data_scans for site {site_code} returned no files')
+        for scan in scans:
+            if scan.scan_time is None or scan.scan_time < cutoff_time or 'MDM' in scan.filename:
+                continue
+            # the scan at the high-water mark itself sorts just after StartAfter
+            if high_water_mark and scan.scan_time <= high_water_mark:
+                continue
+            nexrad_geo_data_files.append(NexradGeoDataFile(
+                remote_path=scan.key,
+                key=scan.filename,
+                datetime=scan.scan_time,
+                scan=scan,
+                local_path='',
+                processed_loc='',
+                processed_path=''
+            ))
+        return nexrad_geo_data_files
 
-            
-            except Exception as e:
-                logging.error(f'Error fetching scans at site: {site_code}')
+    def fetch_data_files(self) -> List[NexradGeoDataFile]:
+        now = datetime.now(timezone.utc)
+        nexrad_geo_data_files: List[NexradGeoDataFile] = []
+        with ThreadPoolExecutor(max_workers=self.listing_workers) as executor:
+            futures = {
+                executor.submit(self.fetch_site_scans, site_code, now): site_code
+                for site_code in self.site_codes
+            }
+            for future in tqdm(as_completed(futures), total=len(futures), desc='fetching NEXRAD site scans'):
+                try:
+                    nexrad_geo_data_files.extend(future.result())
+                except Exception as e:
+                    logging.error(f'Error fetching scans at site: {futures[future]}: {e}')
         return nexrad_geo_data_files
 
+    def advance_high_water_marks(self, geo_data_files: List[GeoDataFile]):
+        for file in geo_data_files:
+            if not file.datetime:
+                continue
+            site_code = os.path.basename(file.key)[:4]
+            high_water_mark = self.site_high_water_marks.get(site_code)
+            if high_water_mark is None or file.datetime > high_water_mark:
+                self.site_high_water_marks[site_code] = file.datetime
+
     # def check_if_downloaded(
     #         self, nexrad_geo_data_files: List[NexradGeoDataFile], variable_name: str
     # ) -> List[NexradGeoDataFile]:
@@ -100,6 +192,7 @@ class NexradDataSource(DataSource):
             
             # Parse the combined string into a datetime object
             extracted_datetime = datetime.strptime(datetime_str, "%Y%m%d%H%M%S")
+            extracted_datetime = extracted_datetime.replace(tzinfo=timezone.utc)
             return extracted_datetime
         except (IndexError, ValueError) as e:
             print(f"Error parsing datetime from filename: {e}")
@@ -157,82 +250,154 @@ class NexradDataSource(DataSource):
 
     #     return self.processed_files
 
-    def process_files(self, downloaded_files: List['GeoDataFile'], max_workers: int = 7) -> List['GeoDataFile']:
-        def chunker(seq, size):
-            return (seq[pos:pos + size] for pos in range(0, len(seq), size))
-        
-        for chunk in tqdm(chunker(downloaded_files, max_workers), desc='Processing NEXRAD images...'):
-            with ProcessPoolExecutor(max_workers=max_workers) as executor:
-                futures = {
-                    executor.submit(process_file_wrapper, (file, self.get_processed_loc(file), self.variable_name)): file
-                    for file in chunk
-                }
-                
-                for future in as_completed(futures):
-                    gc.collect()
-                    try:
-                        processed_file = future.result()
-                        if processed_file not in self.processed_files:
-                            self.processed_files.append(processed_file)
-                        else:
-                            print(f'{processed_file} already in self.processed_files, skipping appending.')
-                    except Exception as exc:
-                        file = futures[future]
-                        print(f'{file} generated an exception: {exc}')
-                    finally:
-                        future.cancel()
-                        futures.pop(future)
+    def get_executor(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            logging.info(f'Starting NEXRAD worker pool with {self.process_workers} workers...')
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.process_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_worker,
+                initargs=(self.grid_cache_dir,),
+                max_tasks_per_child=self.max_tasks_per_child,
+            )
+        return self.executor
+
+    def process_files(self, downloaded_files: List['GeoDataFile']) -> List['GeoDataFile']:
+        self.mark_processing(downloaded_files)
+        executor = self.get_executor()
+        # Scans stream through the warm pool without per-chunk barriers
+        futures = {
+            executor.submit(
+                process_file,
+                file, self.get_processed_loc(file), self.variable_name, self.color_relief_file,
+                self.sweep_dir
+            ): file
+            for file in downloaded_files
+        }
+
+        for future in tqdm(as_completed(futures), total=len(futures), desc='Processing NEXRAD images...'):
+            try:
+                processed_file = future.result()
+                if not self.add_processed_file(processed_file):
+                    print(f'{processed_file} already in self.processed_files, skipping appending.')
+            except BrokenProcessPool as exc:
+                # a worker died (e.g. OOM); start a fresh pool next run
+                logging.error(f'NEXRAD worker pool broke while processing {futures[future].key}: {exc}')
+                self.discard_broken_executor()
+                self.discard_failed_output(futures[future])
+            except Exception as exc:
+                file = futures[future]
+                print(f'{file} generated an exception: {exc}')
+                self.discard_failed_output(file)
 
         return self.processed_files
 
-    def process_file(geo_data_file: GeoDataFile, output_path:str, variable_name: str) -> GeoDataFile:
-        
-        # output_path = self.get_processed_loc(geo_data_file)
-        output_dir = os.path.dirname(output_path)
-        print(f'Checking if {output_path} exists...')
-        if not os.path.exists(output_path):
-            print(f'{output_path} does not exist, generating...')
-        
-            radar = pyart.io.read_nexrad_archive(geo_data_file.local_path)
-            fig = plt.figure(figsize=(8, 6))
-            try:
-                display = pyart.graph.RadarMapDisplay(radar)
-
-                ax = plt.subplot(111, projection=ccrs.PlateCarree())
-
-                display.plot_ppi_map(
-                    variable_name,
-                    sweep=0,
-                    ax=ax,
-                    colorbar_label="Equivalent Relectivity ($Z_{e}$) \n (dBZ)",
-                    vmin=-20,
-                    vmax=60,
-                    lat_lines=[],
-                    lon_lines=[]
-                )
+    def clean_up_site_sweeps(self):
+        cutoff_time = datetime.now(timezone.utc) - self.time_delta
+        for path in glob.glob(os.path.join(self.sweep_dir, '*', '*.npz')):
+            scan_time = self.extract_datetime_from_name(os.path.basename(path))
+            if scan_time is None or scan_time <= cutoff_time:
+                os.remove(path)
 
-                # Add coastlines and borders
-                # ax.add_feature(cfeature.COASTLINE)
-                ax.add_feature(cfeature.BORDERS, linestyle=':')
-                ax.add_feature(cfeature.STATES, linestyle=':', edgecolor='gray')
+    def update_mosaic(self) -> GeoDataFile | None:
+        '''Composites the newest sweep of every site and tiles it as one frame.'''
+        if self.sweep_dir is None:
+            return None
+        os.makedirs(self.sweep_dir, exist_ok=True)
+        self.clean_up_site_sweeps()
 
-                os.makedirs(output_dir, exist_ok=True)
-                plt.savefig(output_path)
-            finally:
-                plt.close(fig)  # Close the figure to free up memory
-                plt.clf()       # Clear the current figure
-                plt.close('all')  # Close all figures
-                gc.collect()     # Force garbage collection
+        values, transform, keys = build_mosaic(self.sweep_dir, rule=self.mosaic_rule)
+        if not keys:
+            logging.info('No recent NEXRAD sweeps to composite.')
+            return None
 
-            geo_data_file.processed_loc = output_dir
-        else:
-            print(f'{output_path} exists. Skipping generation...')
-            geo_data_file.processed_loc = output_dir
+        mosaic_time = max(self.extract_datetime_from_name(key) for key in keys)
+        frame_name = f'mosaic_{mosaic_time.strftime("%Y%m%d-%H%M%S")}'
+        processed_loc = os.path.join(self.mosaic_variable_data_dir, frame_name) + TILE_FORMAT_EXTENSIONS[self.tile_format]
+        if self.mosaic_files.get_by_key(frame_name) is not None:
+            return None
 
-        return geo_data_file
+        mosaic_file = GeoDataFile(
+            datetime=mosaic_time,
+            remote_path='',
+            local_path='',
+            processed_loc=processed_loc,
+            key=frame_name
+        )
+        if self.manifest is not None:
+            self.manifest.record(self.mosaic_manifest_source, [mosaic_file], status='processing')
+
+        success = process_array_to_tiles(values, transform, processed_loc, self.mosaic_color_relief_file)
+        if not success:
+            logging.error(f'Failed to tile NEXRAD mosaic {frame_name}')
+            if self.manifest is not None:
+                self.manifest.remove(self.mosaic_manifest_source, [processed_loc])
+            self.remove_processed_output(mosaic_file)
+            return None
 
+        if self.manifest is not None:
+            self.manifest.record(self.mosaic_manifest_source, [mosaic_file])
+        self.mosaic_files.add(mosaic_file)
+        return mosaic_file
+
+    def extract_mosaic_datetime(self, name: str) -> datetime | None:
+        # mosaic_YYYYMMDD-HHMMSS, plus the tile format's extension
+        try:
+            stamp = os.path.splitext(name)[0][len('mosaic_'):]
+            return datetime.strptime(stamp, '%Y%m%d-%H%M%S').replace(tzinfo=timezone.utc)
+        except ValueError:
+            return None
+
+    def find_mosaic_files(self) -> List[GeoDataFile]:
+        '''Mosaic frames in the mosaic dir, whose names carry their time.'''
+        files: List[GeoDataFile] = []
+        for name in os.listdir(self.mosaic_variable_data_dir):
+            mosaic_time = self.extract_mosaic_datetime(name)
+            # skip frames still being written (and hidden files next to frames)
+            if name.startswith('.') or not name.startswith('mosaic_') or mosaic_time is None:
+                continue
+            files.append(GeoDataFile(
+                datetime=mosaic_time,
+                remote_path='',
+                local_path='',
+                processed_loc=os.path.join(self.mosaic_variable_data_dir, name),
+                key=os.path.splitext(name)[0]
+            ))
+        return files
+
+    def init_mosaic_files(self):
+        '''
+        Restores mosaic frames like the scans, so frames from before a
+        restart are served and expired like new ones.
+        '''
+        if self.mosaic_variable_data_dir is None:
+            return
+        os.makedirs(self.mosaic_variable_data_dir, exist_ok=True)
+        self.mosaic_files = GeoDataFileCatalog(
+            self.reconcile_manifest(self.mosaic_manifest_source, self.find_mosaic_files())
+        )
+        if self.tile_format == 'store':
+            sweep_frames_dir(self.mosaic_variable_data_dir)
+        logging.info(f'mosaic_files initialized with {len(self.mosaic_files)} NEXRAD mosaic frames.')
+        self.clean_up_mosaic_files()
+
+    def clean_up_mosaic_files(self):
+        cutoff_time = datetime.now(timezone.utc) - self.time_delta
+        expired_files = self.mosaic_files.expire(cutoff_time)
+        if not expired_files:
+            return
+        if self.manifest is not None:
+            self.manifest.remove(self.mosaic_manifest_source, [file.processed_loc for file in expired_files])
+        for file in expired_files:
+            self.remove_processed_output(file)
+
+    def clean_up_processed_files(self):
+        super().clean_up_processed_files()
+        self.clean_up_mosaic_files()
+
+    def get_mosaic_locs_with_time(self):
+        return [(file.processed_loc, file.datetime.isoformat()) for file in self.mosaic_files]
 
-    
     def get_processed_loc(self, geo_data_file: GeoDataFile) -> str:
         output_path = os.path.join(
             self.processed_data_folder,
@@ -256,14 +421,17 @@ class NexradDataSource(DataSource):
         self.process_files(downloaded_files)
         process_time = datetime.now()
         self.remove_downloaded_files(downloaded_files)
+        self.advance_high_water_marks(self.processed_files)
+        self.update_mosaic()
 
         logging.info(f'Full run finished in: {process_time-start}')
         logging.info(f'Fetch finished in: {fetch_time-start}')
         logging.info(f'Download finished in: {download_time-fetch_time}')
         logging.info(f'Process finished in: {process_time-download_time}')
 
+        self.clean_up_processed_files()
 
-        # self.clean_up_processed_files()
+        return self.get_processed_locs_with_time()
 
     # def update_data(self, site_code: str, variable_name: str) -> str:
     #     recent_data_files = self.fetch_data_files(site_code=site_code)
@@ -286,69 +454,27 @@ class NexradDataSource(DataSource):
     def download_file(self, geo_data_file: GeoDataFile):
         raise NotImplementedError
     
-    def init_processed_files(self):
-        raise NotImplementedError
-        
-
-def process_file_wrapper(args: Tuple[ GeoDataFile, str, str]) -> GeoDataFile:
-    file, output_path, variable_name = args
-    return process_file(file, output_path, variable_name)
-        
-def process_file(geo_data_file: GeoDataFile, output_path:str, variable_name: str) -> GeoDataFile:
-        
-    # output_path = self.get_processed_loc(geo_data_file)
-    output_dir = os.path.dirname(output_path)
-    print(f'Checking if {output_path} exists...')
-    if not os.path.exists(output_path):
-        print(f'{output_path} does not exist, generating...')
-    
-        radar = pyart.io.read_nexrad_archive(geo_data_file.local_path)
-        fig = plt.figure(figsize=(8, 6))
-        try:
-            display = pyart.graph.RadarMapDisplay(radar)
-
-            ax = plt.subplot(111, projection=ccrs.PlateCarree())
-
-            display.plot_ppi_map(
-                variable_name,
-                sweep=0,
-                ax=ax,
-                colorbar_label="Equivalent Relectivity ($Z_{e}$) \n (dBZ)",
-                vmin=-20,
-                vmax=60,
-                lat_lines=[],
-                lon_lines=[]
-            )
-
-            # Add coastlines and borders
-            # ax.add_feature(cfeature.COASTLINE)
-            ax.add_feature(cfeature.BORDERS, linestyle=':')
-            ax.add_feature(cfeature.STATES, linestyle=':', edgecolor='gray')
-
-            os.makedirs(output_dir, exist_ok=True)
-            plt.savefig(output_path)
-        finally:
-            plt.close(fig)  # Close the figure to free up memory
-            plt.clf()       # Clear the current figure
-            plt.close('all')  # Close all figures
-            gc.collect()     # Force garbage collection
-
-        geo_data_file.processed_loc = output_dir
-    else:
-        print(f'{output_path} exists. Skipping generation...')
-        geo_data_file.processed_loc = output_dir
-
-    return geo_data_file
-
-    
-
-
-
+    def find_processed_files(self) -> List[GeoDataFile]:
+        '''Rendered scans under the per-site dirs, named by their scan key.'''
+        files: List[GeoDataFile] = []
+        for path in glob.glob(os.path.join(self.processed_data_folder, self.variable_name, '*', '*.png')):
+            key = os.path.splitext(os.path.basename(path))[0]
+            files.append(GeoDataFile(
+                datetime=self.extract_datetime_from_name(key),
+                remote_path='',
+                local_path='',
+                processed_loc=path,
+                key=key
+            ))
+        return files
 
-
-
-
-
-
-
-    
\ No newline at end of file
+    def init_processed_files(self):
+        '''
+        Catalogues the rendered scans, reconciled with the manifest, and
+        resumes listing after them.
+        '''
+        logging.info('Initializing processed_files...')
+        for file in self.reconcile_manifest(self.manifest_source, self.find_processed_files()):
+            self.processed_files.add(file)
+        self.advance_high_water_marks(self.processed_files)
+        logging.info(f'processed_files initialized with {len(self.processed_files)} NEXRAD scans.')
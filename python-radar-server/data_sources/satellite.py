@@ -5,35 +5,47 @@ from datetime import datetime, timedelta, timezone
 import logging
 import os
 from utils.data_to_tiles import process_grib2_to_tiles, process_netcdf_to_tiles
-import boto3
-from botocore import UNSIGNED
-from botocore.client import Config
+from utils.grid_store import GridFrameSink
+from utils.regrid import set_regrid_cache_dir
 
 class SatDataSource(DataSource):
     def __init__(self, raw_data_folder, processed_data_folder,
-                 time_delta):
+                 time_delta, process_workers=1, manifest=None, tile_format='xyz', grid_store_dir=None):
         
-        super().__init__(raw_data_folder,processed_data_folder,time_delta)
+        super().__init__(
+            raw_data_folder,processed_data_folder,time_delta,process_workers,manifest,tile_format,grid_store_dir
+        )
         
         self.raw_data_folder = raw_data_folder
         self.processed_data_folder = processed_data_folder
         
         self.variable_name = 'GMGSI_SW'
-        self.s3_client = boto3.client('s3', config=Config(signature_version=UNSIGNED))
+        self._s3_client = None
         self.bucket = 'noaa-gmgsi-pds'
 
         self.time_delta = time_delta
 
         self.color_relief_file = './assets/color_reliefs/satellite_color_relief.txt'
+        # regrid weights for the GMGSI grid, shared by workers and restarts
+        self.regrid_cache_dir = os.path.join(raw_data_folder, 'regrid_weights')
 
         self.processed_variable_data_dir = os.path.join(
             self.processed_data_folder,
             self.variable_name
         )
 
-        self.processed_files: List[GeoDataFile] = []
         self.init_processed_files()
 
+    @property
+    def s3_client(self):
+        # boto3 is slow to import and only needed once we actually list or download
+        if self._s3_client is None:
+            import boto3
+            from botocore import UNSIGNED
+            from botocore.client import Config
+            self._s3_client = boto3.client('s3', config=Config(signature_version=UNSIGNED))
+        return self._s3_client
+
     def extract_datetime_from_name(self, name: str):
         # Assuming the filename format is fixed: GLOBCOMPSIR_nc.YYYYMMDDHH
         try:
@@ -98,29 +110,42 @@ class SatDataSource(DataSource):
 
         return geo_data_file
 
-    def process_file(self, file: GeoDataFile) -> GeoDataFile | None:
-        logging.info(f'Processing {file.local_path}')
+    def get_process_job(self, file: GeoDataFile):
         processed_loc = self.get_processed_loc(file)
-        os.makedirs(processed_loc, exist_ok=True)
-        try:
-            success = process_netcdf_to_tiles(
-                file.local_path,
-                'data',
-                processed_loc,
-                self.color_relief_file,
-                satellite=True
-            )
-            logging.info(f'{file.local_path} processed successfully to tiles.')
-            file.processed_loc = processed_loc
-            if not success:
-                file.remove_processed_loc()
-                return None
-        except Exception as e:
-            logging.error(f'Error processing satellite netcdf to tiles for {file.local_path}:', e)
+        return process_file, (
+            file, processed_loc, self.color_relief_file, self.regrid_cache_dir, self.get_grid_sink(file)
+        )
+    
+
+def process_file(
+        file: GeoDataFile,
+        processed_loc: str,
+        color_relief_file: str,
+        regrid_cache_dir: str | None = None,
+        grid_sink: GridFrameSink | None = None
+) -> GeoDataFile | None:
+    logging.info(f'Processing {file.local_path}')
+    if regrid_cache_dir is not None:
+        set_regrid_cache_dir(regrid_cache_dir)
+    try:
+        success = process_netcdf_to_tiles(
+            file.local_path,
+            'data',
+            processed_loc,
+            color_relief_file,
+            satellite=True,
+            grid_sink=grid_sink
+        )
+        logging.info(f'{file.local_path} processed successfully to tiles.')
+        file.processed_loc = processed_loc
+        if not success:
+            file.remove_processed_loc()
             return None
-        
-        return file
+    except Exception as e:
+        logging.error(f'Error processing satellite netcdf to tiles for {file.local_path}: {e}')
+        return None
     
+    return file
 
 def get_recent_sat_mosaic_files(s3_client, bucket, variable_name, delta=timedelta(days=1)):
     end_time = datetime.now(timezone.utc)
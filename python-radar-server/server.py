@@ -1,15 +1,25 @@
-from flask import Flask, jsonify
+from flask import Flask, Response, abort, jsonify, request, send_from_directory
 from flask_cors import CORS
 import os
+import hashlib
 import logging
 import threading
-from datetime import timedelta
-from typing import Tuple, Dict
+from datetime import datetime, timedelta, timezone
+from typing import Tuple, Dict, Optional
 
-from data_sources.mrms import MRMSDataSource
-from data_sources.nexrad import NexradDataSource
-from data_sources.gpm import GPMDataSource
-from data_sources.satellite import SatDataSource
+import numpy as np
+
+from utils.dynamic_tiles import DynamicTileCache
+from utils.frame_manifest import FrameManifest
+from utils.grid_store import GridStore
+from utils.point_query import MAX_BATCH_POINTS, PointSampler, to_json_values
+from utils.scheduler import IngestScheduler
+from utils.station_index import check_lat_lon, isd_index, nexrad_index, radars_covering
+from utils.tile_bundles import TileBundleCache
+from utils.tile_archive import is_tile_archive, read_tile
+from utils.tile_pyramid import empty_tile_png, load_coverage
+from utils.tile_store import is_tile_index, tile_blob_path
+from utils.update_manager import SourceUpdater
 
 app = Flask(__name__)
 CORS(app)
@@ -20,36 +30,132 @@ local_data_folder = './data'
 next_app_public_dir = '../radar-app/public'
 next_tiles_dir = os.path.join(next_app_public_dir, 'tiles')
 
-### Initialize data sources
-# MRMS
-mrms_data_source = MRMSDataSource(
-    raw_data_folder=os.path.join(local_data_folder, 'raw', 'mrms'),
-    processed_data_folder=os.path.join(next_tiles_dir, 'mrms'),
-    time_delta=timedelta(hours=1)
-)
-# NEXRAD
-nexrad_data_source = NexradDataSource(
-    raw_data_folder='./data/raw/nexrad/',
-    processed_data_folder='../radar-app/public/nexrad',
-    time_delta=timedelta(minutes=30)
-)
+# Processed frames of every source, reloaded at startup. Opened on first use,
+# so importing this module (as spawned workers and tooling do) touches no files.
+_frame_manifest: Optional[FrameManifest] = None
+_frame_manifest_lock = threading.Lock()
+
+def get_frame_manifest() -> FrameManifest:
+    global _frame_manifest
+    with _frame_manifest_lock:
+        if _frame_manifest is None:
+            _frame_manifest = FrameManifest(os.path.join(local_data_folder, 'manifest.sqlite3'))
+        return _frame_manifest
+
+# 'xyz' writes a png directory tree per frame; 'mbtiles' one archive file per
+# frame and 'store' a deduplicated tile store, both served by the /tiles route
+# below (the Next app proxies /tiles requests it has no file for to it)
+tile_format = os.environ.get('RADAR_TILE_FORMAT', 'xyz')
 
-# GPM
-gpm_data_source = GPMDataSource(
-    raw_data_folder='./data/raw/gpm/',
-    processed_data_folder='../radar-app/public/tiles/gpm/',
-    time_delta=timedelta(hours=8)
+# Tiles past the pre-rendered zooms, rendered on request from the frame
+# rasters kept under data/frame_rasters with RADAR_DYNAMIC_TILES=1, and kept in memory
+dynamic_tile_cache = DynamicTileCache(
+    max_bytes=int(os.environ.get('RADAR_DYNAMIC_TILE_CACHE_MB', '128')) * 1024 * 1024
 )
 
-# Satellite
-sat_data_source = SatDataSource(
-    raw_data_folder='./data/raw/satellite/',
-    processed_data_folder='../radar-app/public/tiles/satellite',
-    time_delta=timedelta(hours=5)
+# Set RADAR_GRID_STORE=1 to also keep each frame's decoded values (for the
+# retention window) in a per-source grid store under data/grids
+grid_store_root = os.path.join(local_data_folder, 'grids') \
+    if os.environ.get('RADAR_GRID_STORE', '0') == '1' else None
+
+def grid_store_dir(source: str):
+    return os.path.join(grid_store_root, source) if grid_store_root else None
+
+### Data sources
+# Each source is constructed (and its heavy dependencies imported) by its
+# updater on first use, not when this module is imported.
+def make_mrms_data_source():
+    from data_sources.mrms import MRMSDataSource
+    return MRMSDataSource(
+        raw_data_folder=os.path.join(local_data_folder, 'raw', 'mrms'),
+        processed_data_folder=os.path.join(next_tiles_dir, 'mrms'),
+        time_delta=timedelta(hours=1),
+        process_workers=4,
+        manifest=get_frame_manifest(),
+        tile_format=tile_format,
+        grid_store_dir=grid_store_dir('mrms')
+    )
+
+def make_nexrad_data_source():
+    from data_sources.nexrad import NexradDataSource
+    return NexradDataSource(
+        raw_data_folder='./data/raw/nexrad/',
+        processed_data_folder='../radar-app/public/nexrad',
+        time_delta=timedelta(minutes=30),
+        mosaic_data_folder=os.path.join(next_tiles_dir, 'nexrad_mosaic'),
+        manifest=get_frame_manifest(),
+        tile_format=tile_format
+    )
+
+def make_gpm_data_source():
+    from data_sources.gpm import GPMDataSource
+    return GPMDataSource(
+        raw_data_folder='./data/raw/gpm/',
+        processed_data_folder='../radar-app/public/tiles/gpm/',
+        time_delta=timedelta(hours=8),
+        process_workers=4,
+        manifest=get_frame_manifest(),
+        tile_format=tile_format,
+        grid_store_dir=grid_store_dir('gpm')
+    )
+
+def make_sat_data_source():
+    from data_sources.satellite import SatDataSource
+    return SatDataSource(
+        raw_data_folder='./data/raw/satellite/',
+        processed_data_folder='../radar-app/public/tiles/satellite',
+        time_delta=timedelta(hours=5),
+        process_workers=2,
+        manifest=get_frame_manifest(),
+        tile_format=tile_format,
+        grid_store_dir=grid_store_dir('satellite')
+    )
+
+# Each source refreshes under its own lock, so a slow NEXRAD run
+# doesn't hold up MRMS or GPM.
+mrms_updater = SourceUpdater('MRMS', make_mrms_data_source)
+nexrad_updater = SourceUpdater(
+    'NEXRAD', make_nexrad_data_source,
+    publishers={'mosaic': lambda data_source: data_source.get_mosaic_locs_with_time()}
 )
+gpm_updater = SourceUpdater('GPM', make_gpm_data_source)
+sat_updater = SourceUpdater('Satellite', make_sat_data_source)
+updaters = [mrms_updater, nexrad_updater, gpm_updater, sat_updater]
+
+# Background work, started by the first request each serving process handles
+# (under app.run, flask run or a WSGI server alike): every source is built off
+# the request threads, then ingested on a schedule. While ingestion runs the
+# /update-* routes only read the published frames; otherwise, e.g. with
+# RADAR_SCHEDULED_INGEST=0, they refresh on request instead. Run a single
+# process per data directory so sources aren't ingested twice.
+scheduled_ingest = os.environ.get('RADAR_SCHEDULED_INGEST', '1') == '1'
+ingest_scheduler = IngestScheduler()
+ingest_scheduler.add(mrms_updater, interval=timedelta(minutes=2))
+ingest_scheduler.add(nexrad_updater, interval=timedelta(minutes=5))
+ingest_scheduler.add(gpm_updater, interval=timedelta(minutes=15))
+ingest_scheduler.add(sat_updater, interval=timedelta(minutes=15))
+
+background_work_lock = threading.Lock()
+background_work_started = False
 
-# Global lock for synchronizing all data updates
-global_update_lock = threading.Lock()
+@app.before_request
+def start_background_work():
+    global background_work_started
+    if background_work_started:
+        return
+    with background_work_lock:
+        if background_work_started:
+            return
+        for updater in updaters:
+            updater.warm()
+        if scheduled_ingest:
+            ingest_scheduler.start()
+        background_work_started = True
+
+def request_refresh(updater: SourceUpdater):
+    '''Refreshes on request whenever the scheduler isn't ingesting in this process.'''
+    if not ingest_scheduler.is_running():
+        updater.trigger()
 
 def prep_data_source_result(result: Tuple[str, str]) -> Dict[str, str]:
     radar_app_locs = {}
@@ -57,6 +163,20 @@ def prep_data_source_result(result: Tuple[str, str]) -> Dict[str, str]:
         radar_app_locs[time] = os.path.join(*loc.split('/')[4:])
     return radar_app_locs
 
+def refresh_and_respond(updater: SourceUpdater):
+    '''
+    Kicks off a background refresh if none is running (unless the scheduler
+    is ingesting) and immediately returns the frames from the last completed update.
+    '''
+    logging.info(f"Received request to update {updater.name} data")
+    try:
+        request_refresh(updater)
+        radar_app_locs = prep_data_source_result(updater.result)
+        return jsonify({"directories": radar_app_locs, **updater.status()}), 200
+    except Exception as e:
+        logging.error(f"Error: {e}")
+        return jsonify({"error": str(e)}), 500
+
 
 @app.route('/')
 def index():
@@ -64,70 +184,32 @@ def index():
 
 @app.route('/update-gpm-data', methods=['GET'])
 def updateGPMData():
-    logging.info("Received request to update GPM data")
-    with global_update_lock:
-        logging.info("Acquired lock for updating GPM data")
-        try:
-            processed_locs_with_time = gpm_data_source.update_data()
-            radar_app_locs = prep_data_source_result(processed_locs_with_time)
-            logging.info("Processed locations: %s", radar_app_locs)
-            return jsonify({"directories": radar_app_locs}), 200
-        except Exception as e:
-            logging.error(f"Error: {e}")
-            return jsonify({"error": str(e)}), 500
-        finally:
-            logging.info("Released lock for updating GPM data")
+    return refresh_and_respond(gpm_updater)
 
 @app.route('/update-mrms-data', methods=['GET'])
 def updateMRMSData():
-    logging.info("Received request to update MRMS data")
-    with global_update_lock:
-        logging.info("Acquired lock for updating MRMS data")
-        try:
-            processed_locs_with_time = mrms_data_source.update_data()
-            radar_app_locs = prep_data_source_result(processed_locs_with_time)
-            logging.info("Processed locations: %s", radar_app_locs)
-            return jsonify({"directories": radar_app_locs}), 200
-        except Exception as e:
-            logging.error(f"Error: {e}")
-            return jsonify({"error": str(e)}), 500
-        finally:
-            logging.info("Released lock for updating MRMS data")
+    return refresh_and_respond(mrms_updater)
 
 @app.route('/update-satellite-data', methods=['GET'])
 def updateSatelliteData():
-    logging.info("Received request to update Satellite data")
-    with global_update_lock:
-        logging.info("Acquired lock for updating Satellite data")
-        try:
-            processed_locs_with_time = sat_data_source.update_data()
-            radar_app_locs = prep_data_source_result(processed_locs_with_time)
-            logging.info("Processed locations: %s", radar_app_locs)
-            return jsonify({"directories": radar_app_locs}), 200
-        except Exception as e:
-            logging.error(f"Error: {e}")
-            return jsonify({"error": str(e)}), 500
-        finally:
-            logging.info("Released lock for updating Satellite data")
+    return refresh_and_respond(sat_updater)
 
 @app.route('/update-nexrad-data', methods=['GET'])
 def updateNexradData():
     logging.info("Received request to update Nexrad data")
-    with global_update_lock:
-        logging.info("Acquired lock for updating Satellite data")
-        try:
-            processed_locs = nexrad_data_source.update_data()
-            radar_app_locs = []
-            for loc in processed_locs:
-                radar_app_loc = os.path.join(*loc.split('/')[4:])
-                radar_app_locs.append(radar_app_loc)
-            logging.info("Processed locations: %s", radar_app_locs)
-            return jsonify({"success": True}), 200
-        except Exception as e:
-            logging.error(f"Error: {e}")
-            return jsonify({"error": str(e)}), 500
-        finally:
-            logging.info("Released lock for updating Satellite data")
+    request_refresh(nexrad_updater)
+    return jsonify({"success": True, **nexrad_updater.status()}), 200
+
+@app.route('/update-nexrad-mosaic', methods=['GET'])
+def updateNexradMosaic():
+    logging.info("Received request for the NEXRAD mosaic")
+    request_refresh(nexrad_updater)
+    radar_app_locs = prep_data_source_result(nexrad_updater.published('mosaic'))
+    return jsonify({"directories": radar_app_locs, **nexrad_updater.status()}), 200
+
+@app.route('/update-status', methods=['GET'])
+def updateStatus():
+    return jsonify({updater.name: updater.status() for updater in updaters}), 200
 
 
 @app.route('/get-nexrad-site-data/<path:site_code>/<path:variable_name>', methods=['GET'])
@@ -141,24 +223,256 @@ def getNexradSiteData(site_code: str, variable_name: str):
 
 @app.route('/update-nexrad-site/<path:site_code>/<path:variable_name>', methods=['GET'])
 def updateNexradSite(site_code: str, variable_name: str):
-    logging.info("Received request to update NEXRAD site data")
-    with global_update_lock:
-        logging.info("Acquired lock for updating NEXRAD site data")
-        try:
-            processed_file = nexrad_data_source.update_data(site_code=site_code, variable_name=variable_name)
-            processed_file_radar_app_loc = os.path.join(*processed_file.split('/')[4:])
-            logging.info("Processed file location: %s", processed_file_radar_app_loc)
-            return jsonify({'imageUrl': processed_file_radar_app_loc}), 200
-        except Exception as e:
-            logging.error(f"Error in /nexrad-update-data route: {e}")
-            return jsonify({"error": str(e)}), 500
-        finally:
-            logging.info("Released lock for updating NEXRAD site data")
+    '''
+    Newest rendered scan of one site from the last completed NEXRAD update.
+    Every site is rendered by the NEXRAD updater, so like the other routes this
+    only kicks off a refresh instead of processing the site on the request.
+    '''
+    logging.info("Received request for NEXRAD site data")
+    request_refresh(nexrad_updater)
+    site_scans = [
+        (time, loc) for loc, time in nexrad_updater.result or []
+        if loc.split('/')[-3:-1] == [variable_name, site_code]
+    ]
+    if not site_scans:
+        return jsonify({"error": f"No {variable_name} scans for {site_code} yet", **nexrad_updater.status()}), 404
+    _, loc = max(site_scans)
+    return jsonify({'imageUrl': os.path.join(*loc.split('/')[4:]), **nexrad_updater.status()}), 200
+
+@app.route('/tiles/<path:frame>/<int:z>/<int:x>/<int:y>.png', methods=['GET'])
+def getTile(frame: str, z: int, x: int, y: int):
+    '''
+    Serves a tile from a frame under the tiles dir: an .mbtiles archive, a
+    .tiles store index or a png directory. Tiles that were skipped as empty
+    (per the frame's coverage bitmap) get the shared transparent tile, or a
+    204 with ?empty=204. Zooms past the pre-rendered pyramid are rendered on
+    request from the frame's memory-mapped raster and cached.
+    '''
+    tiles_root = os.path.realpath(next_tiles_dir)
+    frame_path = os.path.realpath(os.path.join(tiles_root, frame))
+    if not frame_path.startswith(tiles_root + os.sep) or not os.path.exists(frame_path):
+        abort(404)
+
+    response = None
+    if is_tile_archive(frame_path):
+        png = read_tile(frame_path, z, x, y)
+        if png is not None:
+            response = Response(png, mimetype='image/png')
+    elif is_tile_index(frame_path):
+        blob = tile_blob_path(frame_path, z, x, y)
+        if blob is not None and os.path.exists(blob):
+            response = send_from_directory(os.path.dirname(blob), os.path.basename(blob), mimetype='image/png')
+    elif os.path.exists(os.path.join(frame_path, str(z), str(x), f'{y}.png')):
+        response = send_from_directory(frame_path, os.path.join(str(z), str(x), f'{y}.png'))
+
+    if response is None:
+        coverage = load_coverage(frame_path)
+        if coverage is not None and coverage.covers_zoom(z):
+            if coverage.has_data(z, x, y):
+                abort(404)
+            png = empty_tile_png()
+        else:
+            # deeper than the pyramid: render from the frame's raster
+            png = dynamic_tile_cache.get(frame_path, z, x, y)
+            if png is None:
+                abort(404)
+        if png is empty_tile_png() and request.args.get('empty') == '204':
+            response = Response(status=204)
+        else:
+            response = Response(png, mimetype='image/png')
+
+    # a frame's tiles never change once written
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    return response
+
+# Frame lists (processed_loc, time) of the sources that can be bundled per tile
+tile_bundle_sources = {
+    'mrms': lambda: mrms_updater.result,
+    'gpm': lambda: gpm_updater.result,
+    'satellite': lambda: sat_updater.result,
+    'nexrad-mosaic': lambda: nexrad_updater.published('mosaic'),
+}
+tile_bundle_cache = TileBundleCache(dynamic_tiles=dynamic_tile_cache)
+
+@app.route('/tile-bundle/<source>/<int:z>/<int:x>/<int:y>', methods=['GET'])
+def getTileBundle(source: str, z: int, x: int, y: int):
+    '''
+    Returns every frame of one tile in the current window in a single
+    response, so a loop can be animated with one request per tile instead of
+    one per tile per frame. ?format=strip (default) is a 256*n x 256 PNG with
+    frames side by side; ?format=bundle is the binary RTB1 bundle (see
+    TileBundleCache.bundle). Frame times, oldest first, are in X-Frame-Times.
+    '''
+    if source not in tile_bundle_sources:
+        abort(404)
+    bundle_format = request.args.get('format', 'strip')
+    if bundle_format not in ('strip', 'bundle'):
+        return jsonify({"error": f"Unknown bundle format: {bundle_format}"}), 400
+
+    frames = list(tile_bundle_sources[source]())
+    if bundle_format == 'strip':
+        data, times = tile_bundle_cache.strip(source, frames, z, x, y)
+        response = Response(data, mimetype='image/png')
+    else:
+        data, times = tile_bundle_cache.bundle(source, frames, z, x, y)
+        response = Response(data, mimetype='application/octet-stream')
+
+    response.headers['X-Frame-Times'] = ','.join(times)
+    response.headers['Access-Control-Expose-Headers'] = 'X-Frame-Times, ETag'
+    response.headers['Cache-Control'] = 'no-cache'
+    # from the content: a frame's tile can turn up after the frame is listed
+    response.set_etag(hashlib.md5(data).hexdigest())
+    return response.make_conditional(request)
+
+# Point sampling over the grid store (RADAR_GRID_STORE=1), one sampler per source
+point_sources = ('mrms', 'gpm', 'satellite')
+point_samplers: Dict[str, PointSampler] = {}
+point_samplers_lock = threading.Lock()
+
+def get_point_sampler(source: str) -> Optional[PointSampler]:
+    if source not in point_sources or grid_store_root is None:
+        return None
+    with point_samplers_lock:
+        if source not in point_samplers:
+            point_samplers[source] = PointSampler(GridStore(grid_store_dir(source)))
+        return point_samplers[source]
+
+def point_window_start(minutes) -> Optional[datetime]:
+    if minutes is None:
+        return None
+    return datetime.now(timezone.utc) - timedelta(minutes=float(minutes))
+
+@app.route('/point', methods=['GET'])
+def getPoint():
+    '''
+    Values of a source at one lat/lon across its retained frames, oldest
+    first: /point?source=mrms&lat=35.2&lon=-97.4[&minutes=60]. null where the
+    frame has no data there.
+    '''
+    source = request.args.get('source', '')
+    sampler = get_point_sampler(source)
+    if sampler is None:
+        return jsonify({"error": f"No grid store for source: {source}"}), 404
+    try:
+        lat = float(request.args['lat'])
+        lon = float(request.args['lon'])
+        start = point_window_start(request.args.get('minutes'))
+    except (KeyError, ValueError):
+        return jsonify({"error": "lat and lon are required numbers"}), 400
+
+    times, values = sampler.sample([lat], [lon], start=start)
+    return jsonify({
+        'source': source,
+        'lat': lat,
+        'lon': lon,
+        'times': [time.isoformat() for time in times],
+        'values': to_json_values(values[:, 0]),
+    })
+
+@app.route('/point', methods=['POST'])
+def postPoints():
+    '''
+    Batch variant: {"source": "mrms", "points": [[lat, lon], ...], "minutes": 60}.
+    Returns the frame times and, per point, its values across them.
+    '''
+    body = request.get_json(silent=True) or {}
+    source = body.get('source', '')
+    sampler = get_point_sampler(source)
+    if sampler is None:
+        return jsonify({"error": f"No grid store for source: {source}"}), 404
+    try:
+        points = np.asarray(body['points'], dtype=np.float64).reshape(-1, 2)
+        start = point_window_start(body.get('minutes'))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "points must be a list of [lat, lon] pairs"}), 400
+    if len(points) > MAX_BATCH_POINTS:
+        return jsonify({"error": f"At most {MAX_BATCH_POINTS} points per request"}), 400
+
+    times, values = sampler.sample(points[:, 0], points[:, 1], start=start)
+    return jsonify({
+        'source': source,
+        'times': [time.isoformat() for time in times],
+        'values': to_json_values(values.T),
+    })
+
+# Station lookups over the ISD and NEXRAD assets, parsed once and cached under data/
+station_cache_dir = os.path.join(local_data_folder, 'station_index')
+station_networks = {
+    'isd': lambda: isd_index(station_cache_dir),
+    'nexrad': lambda: nexrad_index(station_cache_dir),
+}
+
+@app.route('/stations/nearest', methods=['GET'])
+def getNearestStations():
+    '''/stations/nearest?lat=&lon=[&k=5][&network=isd|nexrad][&max_distance_m=]'''
+    network = request.args.get('network', 'isd')
+    if network not in station_networks:
+        return jsonify({"error": f"Unknown station network: {network}"}), 404
+    try:
+        lat = float(request.args['lat'])
+        lon = float(request.args['lon'])
+        k = min(max(int(request.args.get('k', 5)), 1), 100)
+        max_distance = request.args.get('max_distance_m')
+        max_distance = float(max_distance) if max_distance is not None else None
+    except (KeyError, ValueError):
+        return jsonify({"error": "lat and lon are required numbers"}), 400
+    try:
+        check_lat_lon(lat, lon)
+        if max_distance is not None and not max_distance >= 0:
+            raise ValueError('max_distance_m must be a non-negative number')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    index = station_networks[network]()
+    distances, indices = index.nearest(lat, lon, k=k, max_distance_m=max_distance)
+    stations = [
+        dict(index.station(i), distance_m=float(distance))
+        for distance, i in zip(np.atleast_1d(distances), np.atleast_1d(indices)) if i < len(index)
+    ]
+    return jsonify({'network': network, 'stations': stations})
+
+@app.route('/stations/bbox', methods=['GET'])
+def getStationsInBbox():
+    '''/stations/bbox?bbox=west,south,east,north[&network=isd|nexrad]'''
+    network = request.args.get('network', 'isd')
+    if network not in station_networks:
+        return jsonify({"error": f"Unknown station network: {network}"}), 404
+    try:
+        west, south, east, north = (float(value) for value in request.args['bbox'].split(','))
+    except (KeyError, ValueError):
+        return jsonify({"error": "bbox must be west,south,east,north"}), 400
+    try:
+        check_lat_lon([south, north], [west, east])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    index = station_networks[network]()
+    return jsonify({'network': network, 'stations': index.stations(index.in_bbox(west, south, east, north))})
+
+@app.route('/radars/covering', methods=['GET'])
+def getRadarsCovering():
+    '''NEXRAD sites whose range covers /radars/covering?lat=&lon=, nearest first.'''
+    try:
+        lat = float(request.args['lat'])
+        lon = float(request.args['lon'])
+    except (KeyError, ValueError):
+        return jsonify({"error": "lat and lon are required numbers"}), 400
+    try:
+        check_lat_lon(lat, lon)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    index = station_networks['nexrad']()
+    distances, indices = radars_covering(lat, lon, cache_dir=station_cache_dir)
+    radars = [dict(index.station(i), distance_m=float(distance)) for distance, i in zip(distances, indices)]
+    return jsonify({'radars': radars})
 
 @app.route('/get-most-recent-mrms')
 def getMostRecentMRMS():
     logging.info("Received request to get most recent MRMS data.")
-    loc = mrms_data_source.get_processed_locs()[-1]
+    if not mrms_updater.result:
+        return jsonify({"error": "No MRMS frames yet", **mrms_updater.status()}), 404
+    loc, _ = mrms_updater.result[-1]
 
     radar_app_loc = os.path.join('tiles',*loc.split('/')[4:])
     
@@ -168,4 +482,6 @@ def getMostRecentMRMS():
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    # background work starts with the first request, so the debug reloader's
+    # watcher process (which never serves one) doesn't ingest too
     app.run(debug=True)
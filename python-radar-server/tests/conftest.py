@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the server's modules import each other from its root (e.g. `from utils.x import ...`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,82 @@
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+
+from utils.color_relief import colorize
+
+
+PALETTE = '''\
+# value  R    G    B    A
+nv       1    2    3    4
+0        0    0    255  255
+10       0    255  0    255
+20       255  0    0    128
+'''
+
+# What `gdaldem color-relief -alpha` gives for each value with PALETTE
+# (GDALColorReliefGetRGBA's default interpolation: clamp to the end entries,
+# otherwise int(0.45 + lower + ratio * (upper - lower)) per channel).
+EXPECTED = [
+    (-5.0, (0, 0, 255, 255)),       # below the first entry: clamped
+    (0.0, (0, 0, 255, 255)),
+    (0.2, (0, 5, 250, 255)),        # G 5.1 + 0.45 truncates down, B 249.9 + 0.45 up
+    (0.5, (0, 13, 242, 255)),       # G 12.75 + 0.45 -> 13, B 242.25 + 0.45 -> 242
+    (1.0, (0, 25, 229, 255)),       # 25.5 + 0.45 still truncates to 25
+    (10.0, (0, 255, 0, 255)),
+    (15.0, (127, 127, 0, 191)),
+    (20.0, (255, 0, 0, 128)),
+    (25.0, (255, 0, 0, 128)),       # past the last entry: clamped
+    (np.nan, (1, 2, 3, 4)),         # nv
+]
+
+
+@pytest.fixture
+def palette(tmp_path):
+    path = tmp_path / 'palette.txt'
+    path.write_text(PALETTE)
+    return str(path)
+
+
+def test_colorize_matches_gdaldem_fixture(palette):
+    values = np.array([[value for value, _ in EXPECTED]], dtype=np.float32)
+    rgba = colorize(values, palette)
+    assert rgba.dtype == np.uint8
+    assert [tuple(int(c) for c in pixel) for pixel in rgba[0]] == [color for _, color in EXPECTED]
+
+
+def test_colorize_masked_values_get_nv_color(palette):
+    values = np.ma.masked_array([[5.0, 5.0]], mask=[[False, True]])
+    rgba = colorize(values, palette)
+    assert tuple(rgba[0, 1]) == (1, 2, 3, 4)
+    assert tuple(rgba[0, 0]) == (0, 127, 127, 255)
+
+
+def test_colorize_without_nv_entry_is_transparent_for_nan(tmp_path):
+    path = tmp_path / 'palette.txt'
+    path.write_text(PALETTE.replace('nv       1    2    3    4\n', ''))
+    rgba = colorize(np.array([[np.nan, 20.0]]), str(path))
+    assert tuple(rgba[0, 0]) == (0, 0, 0, 0)
+    assert tuple(rgba[0, 1]) == (255, 0, 0, 128)
+
+
+@pytest.mark.skipif(shutil.which('gdaldem') is None, reason='gdaldem is not installed')
+def test_colorize_matches_gdaldem(palette, tmp_path):
+    rasterio = pytest.importorskip('rasterio')
+    from rasterio.transform import from_origin
+
+    rng = np.random.default_rng(0)
+    values = rng.uniform(-5, 25, (64, 64)).astype(np.float32)
+    values[rng.random(values.shape) < 0.05] = np.nan
+    source, output = tmp_path / 'values.tif', tmp_path / 'colored.tif'
+    with rasterio.open(
+        source, 'w', driver='GTiff', height=64, width=64, count=1, dtype='float32',
+        crs='EPSG:4326', transform=from_origin(0, 64, 1, 1), nodata=np.nan
+    ) as dst:
+        dst.write(values, 1)
+
+    subprocess.run(['gdaldem', 'color-relief', '-alpha', str(source), palette, str(output)], check=True)
+    with rasterio.open(output) as src:
+        expected = np.moveaxis(src.read(), 0, -1)
+    np.testing.assert_array_equal(colorize(values, palette), expected)
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from utils.regrid import apply_regrid, build_regrid_weights
+
+xr = pytest.importorskip('xarray')
+pytest.importorskip('scipy')
+
+
+def xarray_regrid(values, lat, lon, res):
+    '''The xarray interp the cached weights replace.'''
+    data = xr.DataArray(values, coords={'lat': lat, 'lon': lon}, dims=('lat', 'lon'))
+    target_lon = np.arange(lon.min(), lon.max(), res)
+    target_lat = np.arange(lat.min(), lat.max(), res)[::-1]
+    return data.interp(lat=target_lat, lon=target_lon).values
+
+
+# (source spacing, target res): targets between source coordinates, and
+# targets every other one of which falls exactly on a source coordinate
+@pytest.mark.parametrize('spacing, res', [(0.07, 0.02), (0.04, 0.02)])
+@pytest.mark.parametrize('lat_descending', [False, True])
+def test_regrid_matches_xarray_interp(spacing, res, lat_descending):
+    rng = np.random.default_rng(0)
+    lat = np.round(np.arange(-10, 10, spacing), 6)
+    lon = np.round(np.arange(100, 120, spacing), 6)
+    if lat_descending:
+        lat = lat[::-1]
+    values = rng.random((len(lat), len(lon))).astype(np.float32) * 50
+    # NaNs (e.g. off-disk pixels) must spread to the same targets
+    values[rng.random(values.shape) < 0.05] = np.nan
+
+    ours = apply_regrid(values, build_regrid_weights(lat, lon, res))
+    theirs = xarray_regrid(values, lat, lon, res)
+
+    assert ours.shape == theirs.shape
+    np.testing.assert_array_equal(np.isnan(ours), np.isnan(theirs))
+    np.testing.assert_allclose(ours, theirs, rtol=1e-5, atol=1e-4, equal_nan=True)
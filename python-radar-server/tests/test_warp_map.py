@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+from affine import Affine
+
+from utils.warp_map import build_warp_map, warp
+
+rasterio_warp = pytest.importorskip('rasterio.warp')
+from rasterio.enums import Resampling  # noqa: E402
+
+
+# (height, width, resolution, top, left): up- and downsampled axes, a grid
+# reaching Mercator's latitude limit and one stored as 0..360 like MRMS
+GRIDS = [
+    (300, 600, 0.1, 60, -120),
+    (400, 300, 0.2, 80, -50),
+    (100, 100, 0.01, 30, -90),
+    (170, 360, 1.0, 85, -180),
+    (100, 200, 0.01, 50, 200),
+]
+
+
+def gdalwarp(array, transform, warp_map, resampling):
+    destination = np.zeros((array.shape[2],) + warp_map.dst_shape, dtype=array.dtype)
+    rasterio_warp.reproject(
+        source=np.moveaxis(array, -1, 0),
+        destination=destination,
+        src_transform=transform,
+        src_crs='EPSG:4326',
+        dst_transform=warp_map.dst_transform,
+        dst_crs='EPSG:3857',
+        resampling=Resampling[resampling],
+    )
+    return np.moveaxis(destination, 0, -1)
+
+
+@pytest.mark.parametrize('grid', GRIDS)
+@pytest.mark.parametrize('resampling', ['nearest', 'bilinear'])
+def test_warp_matches_gdalwarp(grid, resampling):
+    height, width, res, top, left = grid
+    # noise, so any difference in which source pixels are used shows up
+    array = np.random.default_rng(0).integers(0, 256, (height, width, 3)).astype(np.uint8)
+    transform = Affine(res, 0, left, 0, -res, top)
+
+    warp_map = build_warp_map(array.shape, transform, 'EPSG:4326', resampling=resampling)
+    ours = warp(array, warp_map).astype(np.int16)
+    theirs = gdalwarp(array, transform, warp_map, resampling).astype(np.int16)
+
+    difference = np.abs(ours - theirs)
+    if resampling == 'nearest':
+        assert difference.max() == 0
+    else:
+        # float accumulation order leaves some values one step apart
+        assert difference.max() <= 1
+        assert (difference == 0).mean() > 0.9
@@ -0,0 +1,122 @@
+import logging
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+# gdaldem accepts whitespace, commas, tabs and colons as separators
+_SEPARATORS = re.compile(r'[\s,:]+')
+
+
+@dataclass(frozen=True)
+class ColorRelief:
+    values: np.ndarray          # (n,) float64, ascending
+    colors: np.ndarray          # (n, 4) float64 RGBA
+    nodata_color: Tuple[int, int, int, int]
+
+
+def parse_color_relief(color_relief_file: str) -> ColorRelief:
+    '''
+    Parses a gdaldem color-relief text file:
+        value  R  G  B  [A]   # optional comment
+    Alpha defaults to 255 and an `nv` entry sets the color used for NaN.
+    '''
+    entries = []
+    nodata_color = (0, 0, 0, 0)
+    with open(color_relief_file, 'r') as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            tokens = [t for t in _SEPARATORS.split(line) if t]
+            if len(tokens) not in (4, 5):
+                raise ValueError(f'Unsupported color relief line in {color_relief_file}: {line}')
+            rgba = [int(t) for t in tokens[1:]]
+            if len(rgba) == 3:
+                rgba.append(255)
+
+            if tokens[0].lower() == 'nv':
+                nodata_color = tuple(rgba)
+            elif tokens[0].endswith('%'):
+                raise ValueError(f'Percentage entries are not supported: {color_relief_file}')
+            else:
+                entries.append((float(tokens[0]), rgba))
+
+    if not entries:
+        raise ValueError(f'No color entries found in {color_relief_file}')
+
+    # gdaldem sorts the entries by value, keeping file order for ties
+    entries.sort(key=lambda entry: entry[0])
+    values = np.array([value for value, _ in entries], dtype=np.float64)
+    colors = np.array([rgba for _, rgba in entries], dtype=np.float64)
+    return ColorRelief(values=values, colors=colors, nodata_color=nodata_color)
+
+
+@lru_cache(maxsize=None)
+def _load_color_relief(abs_path: str, mtime: float) -> ColorRelief:
+    logging.info(f'Compiling color relief {abs_path}')
+    return parse_color_relief(abs_path)
+
+
+def load_color_relief(color_relief_file: str) -> ColorRelief:
+    '''Returns the compiled color relief, parsing each file only once per modification.'''
+    abs_path = os.path.abspath(color_relief_file)
+    return _load_color_relief(abs_path, os.path.getmtime(abs_path))
+
+
+def colorize(
+        data: np.ndarray,
+        color_relief_file: str,
+        out: Optional[np.ndarray] = None,
+        chunk_rows: int = 512
+) -> np.ndarray:
+    '''
+    Maps a 2D grid to an (H, W, 4) uint8 RGBA array the same way
+    `gdaldem color-relief -alpha` does in its default interpolation mode:
+    values outside the table are clamped to the first/last entry and values
+    in between are linearly interpolated and truncated after adding 0.45.
+    NaNs get the `nv` color (transparent black when there is none).
+    '''
+    relief = load_color_relief(color_relief_file)
+    if np.ma.isMaskedArray(data):
+        data = np.ma.filled(data.astype(np.float64), np.nan)
+    data = np.asarray(data)
+
+    if out is None:
+        out = np.empty(data.shape + (4,), dtype=np.uint8)
+
+    # work in row chunks so the float64 temporaries stay small on CONUS grids
+    for row in range(0, data.shape[0], chunk_rows):
+        _colorize_chunk(relief, data[row:row + chunk_rows], out[row:row + chunk_rows])
+    return out
+
+
+def _colorize_chunk(relief: ColorRelief, data: np.ndarray, out: np.ndarray):
+    n = len(relief.values)
+    values = data.astype(np.float64)
+    nan_mask = np.isnan(values)
+    values[nan_mask] = relief.values[0]
+
+    # index of the first entry >= value, as in gdaldem's binary search
+    upper = np.searchsorted(relief.values, values, side='left')
+    np.clip(upper, min(1, n - 1), n - 1, out=upper)
+    lower = np.maximum(upper - 1, 0)
+
+    lower_values = relief.values[lower]
+    span = relief.values[upper] - lower_values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(span > 0, (values - lower_values) / span, 0.0)
+    np.clip(ratio, 0.0, 1.0, out=ratio)
+
+    for band in range(4):
+        lower_colors = relief.colors[lower, band]
+        upper_colors = relief.colors[upper, band]
+        channel = 0.45 + lower_colors + ratio * (upper_colors - lower_colors)
+        np.clip(channel, 0, 255, out=channel)
+        out[..., band] = channel.astype(np.uint8)
+
+    out[nan_mask] = relief.nodata_color
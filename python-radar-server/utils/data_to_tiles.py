@@ -1,16 +1,23 @@
 import logging
-import rasterio
-from rasterio.transform import from_origin, from_bounds
 import subprocess
 import os
-import xarray as xr
 import numpy as np
 from PIL import Image
-from netCDF4 import Dataset
 import gzip
 import shutil
+import tempfile
+from contextlib import contextmanager
+from utils.color_relief import colorize
+from utils.regrid import apply_regrid, get_regrid_weights
+from utils.tile_pyramid import generate_tile_pyramid, to_rgba
+from utils.warp_map import can_use_warp_map, get_warp_map, warp
+
+# rasterio, xarray, pygrib and netCDF4 are imported inside the functions that
+# use them, so importing this module (e.g. from server.py) stays cheap.
 
 def read_netcdf(netcdf_file, variable_name):
+    import xarray as xr
+    from netCDF4 import Dataset
     try:
         print("Reading NetCDF file...")
         # Open the file using netCDF4
@@ -34,49 +41,35 @@ def read_netcdf(netcdf_file, variable_name):
         return False
     return data
 
-def preprocess_satellite_netcdf(data: xr.Dataset, output_tif: str):
+def regrid_satellite(data, res=0.02):
+    '''
+    Interpolates the GMGSI grid onto a regular 0.02 degree lat/lon grid.
+    Returns north-up float values and their geotransform. The bilinear
+    weights depend only on the source grid, so they are computed once and
+    cached (see utils.regrid); each frame is then two gathers.
+    '''
+    lat = data.latitude.values.transpose()[0]
+    lon = data.longitude.values[0]
+    weights = get_regrid_weights(lat, lon, res)
+    return apply_regrid(data.values, weights), weights.transform
+
+def preprocess_satellite_netcdf(data: 'xr.Dataset', output_tif: str):
+    import rasterio
     try:
-        data = xr.Dataset(
-            {'data': (('latitude', 'longitude'), data.values)},
-            coords={'latitude': data.latitude.values.transpose()[0], 'longitude': data.longitude.values[0]},
-            attrs={'units': 'none'}
-        )['data']
-
-        # Extract variables
-        lat = data.latitude.values
-        lon = data.longitude.values
-
-        # Create a meshgrid for the latitude and longitude values
-        lon2d, lat2d = np.meshgrid(lon, lat)
-
-        # Define the bounds of the original data
-        lon_min, lon_max = lon.min(), lon.max()
-        lat_min, lat_max = lat.min(), lat.max()
-
-        # Define the target resolution and grid size
-        res = 0.02  # Adjust the resolution as needed
-        target_lon = np.arange(lon_min, lon_max, res)
-        target_lat = np.arange(lat_min, lat_max, res)
-        target_lon2d, target_lat2d = np.meshgrid(target_lon, target_lat)
-
-        # Interpolate data to the regular grid
-        data_regrid = data.interp(longitude=target_lon, latitude=target_lat, method='linear')
-
-        # Define the transformation for the GeoTIFF
-        transform = from_bounds(lon_min, lat_min, lon_max, lat_max, target_lon2d.shape[1], target_lat2d.shape[0])
+        values, transform = regrid_satellite(data)
 
         # Write the reprojected data to a GeoTIFF
         with rasterio.open(
             output_tif, 'w',
             driver='GTiff',
-            height=target_lat2d.shape[0],
-            width=target_lon2d.shape[1],
+            height=values.shape[0],
+            width=values.shape[1],
             count=1,
-            dtype=data_regrid.dtype,
+            dtype=values.dtype,
             crs='+proj=latlong',
             transform=transform,
         ) as dst:
-            dst.write(data_regrid.values, 1)
+            dst.write(values, 1)
 
         logging.info("GeoTIFF file has been created successfully: %s", output_tif)
 
@@ -89,6 +82,7 @@ def preprocess_satellite_netcdf(data: xr.Dataset, output_tif: str):
     return True
 
 def read_grib2(grib2_file, variable_name, type_of_level, filter_grib=True):
+    import xarray as xr
     print("Reading GRIB2 file...")
     try:
         ds = None
@@ -104,6 +98,47 @@ def read_grib2(grib2_file, variable_name, type_of_level, filter_grib=True):
         return False
     return data
 
+def read_zipped_grib2(gzipped_grib2_file):
+    '''
+    Decodes the first GRIB2 message of a gzipped file entirely in memory.
+    The regular lat/lon axes are built from the grid keys rather than
+    msg.latlons(), which would allocate two full 2D coordinate grids.
+    '''
+    import pygrib
+    import xarray as xr
+    print("Reading gzipped GRIB2 from memory...")
+    try:
+        with gzip.open(gzipped_grib2_file, 'rb') as f:
+            msg = pygrib.fromstring(f.read())
+
+        if msg['gridType'] != 'regular_ll':
+            raise ValueError(f"Unsupported grid type: {msg['gridType']}")
+
+        values = msg.values
+        if np.ma.isMaskedArray(values):
+            values = np.ma.filled(values.astype('float32'), np.nan)
+
+        n_lat, n_lon = msg['Nj'], msg['Ni']
+        lat_step = msg['jDirectionIncrementInDegrees']
+        lon_step = msg['iDirectionIncrementInDegrees']
+        if not msg['jScansPositively']:
+            lat_step = -lat_step
+        if msg['iScansNegatively']:
+            lon_step = -lon_step
+        latitude = msg['latitudeOfFirstGridPointInDegrees'] + np.arange(n_lat) * lat_step
+        longitude = msg['longitudeOfFirstGridPointInDegrees'] + np.arange(n_lon) * lon_step
+
+        data = xr.DataArray(
+            values.astype('float32', copy=False),
+            dims=('latitude', 'longitude'),
+            coords={'latitude': latitude, 'longitude': longitude},
+            attrs={'units': msg['units']} if msg.has_key('units') else {},
+        )
+    except Exception as e:
+        logging.error(f'Error reading gzipped grib {gzipped_grib2_file}: {e}')
+        return False
+    return data
+
 def clip_latitude(data):
     try:
         print("Clipping latitude values to the valid range for Mercator projection...")
@@ -116,33 +151,67 @@ def clip_latitude(data):
         return False
     return data
 
+def clip_latitude_array(values, transform, src_crs):
+    '''
+    clip_latitude for a grid already read into an array: drops the rows of a
+    lat/lon grid whose centres lie beyond Mercator's limit. Returns
+    (values, transform), with values False if no rows are left.
+    '''
+    from affine import Affine
+    from rasterio.crs import CRS
+    if src_crs is not None and not CRS.from_user_input(src_crs).is_geographic:
+        return values, transform
+    if transform.b != 0 or transform.d != 0:
+        logging.error('Cannot clip latitudes of a rotated grid.')
+        return False, transform
+
+    row_lats = transform.f + transform.e * (np.arange(values.shape[0]) + 0.5)
+    rows = np.nonzero((row_lats >= -85.05112878) & (row_lats <= 85.05112878))[0]
+    if len(rows) == 0:
+        logging.error("Clipping resulted in an empty dataset.")
+        return False, transform
+    first, last = rows[0], rows[-1] + 1
+    if first == 0 and last == values.shape[0]:
+        return values, transform
+    print("Clipping latitude values to the valid range for Mercator projection...")
+    return values[first:last], transform * Affine.translation(0, first)
+
+def get_geotransform(data):
+    from rasterio.transform import from_origin
+    if len(data.longitude.shape) == 2:
+        long0 = data.longitude[0][1]
+        long1 = data.longitude[0][2]
+    elif len(data.longitude.shape) == 1:
+        long0 = data.longitude[1]
+        long1 = data.longitude[2]
+
+    long_val = np.abs(long1 - long0).values
+
+    if len(data.longitude.shape) == 2:
+        lat0 = data.latitude[0][0]
+        lat1 = data.latitude[1][0]
+    elif len(data.longitude.shape) == 1:
+        lat0 = data.latitude[0]
+        lat1 = data.latitude[1]
+
+    lat_val = np.abs(lat1 - lat0).values
+
+    return from_origin(data.longitude.min().values, data.latitude.max().values, 
+                       long_val, 
+                       lat_val)
+
+def get_values(data):
+    if 'units' in data.attrs:
+        if data.units == 'K':
+            data.values = data.values - 273.15  # Example conversion if the data is in Kelvin
+    return data.values.astype('float32', copy=False)
+
 def convert_to_geotiff(data, output_tif):
+    import rasterio
     print("Converting to GeoTIFF...")
     try:
-        if len(data.longitude.shape) == 2:
-            long0 = data.longitude[0][1]
-            long1 = data.longitude[0][2]
-        elif len(data.longitude.shape) == 1:
-            long0 = data.longitude[1]
-            long1 = data.longitude[2]
-
-        long_val = np.abs(long1 - long0).values
-
-        if len(data.longitude.shape) == 2:
-            lat0 = data.latitude[0][0]
-            lat1 = data.latitude[1][0]
-        elif len(data.longitude.shape) == 1:
-            lat0 = data.latitude[0]
-            lat1 = data.latitude[1]
-
-        lat_val = np.abs(lat1 - lat0).values
-
-        transform = from_origin(data.longitude.min().values, data.latitude.max().values, 
-                                long_val, 
-                                lat_val)
-        if 'units' in data.attrs:
-            if data.units == 'K':
-                data.values = data.values - 273.15  # Example conversion if the data is in Kelvin
+        transform = get_geotransform(data)
+        values = get_values(data)
 
         print(data.shape)
         print('------')
@@ -153,17 +222,45 @@ def convert_to_geotiff(data, output_tif):
             count=1, dtype='float32',
             crs='+proj=latlong', transform=transform,
         ) as dst:
-            dst.write(data.values, 1)
+            dst.write(values, 1)
     except Exception as e:
         logging.error(f'Error converting to geotiff {output_tif}', e)
         return False
     return True
 
+def write_rgba_geotiff(rgba, output_tif, crs, transform):
+    import rasterio
+    with rasterio.open(
+        output_tif, 'w', driver='GTiff',
+        height=rgba.shape[0], width=rgba.shape[1],
+        count=4, dtype='uint8',
+        crs=crs, transform=transform,
+        photometric='RGB', alpha='YES',
+    ) as dst:
+        dst.write(np.moveaxis(rgba, -1, 0))
+
+def convert_to_colored_geotiff(data, color_relief_file, output_colored_tif):
+    '''
+    Colorizes the decoded grid in memory and writes the RGBA GeoTIFF directly,
+    skipping the float32 GeoTIFF that gdaldem needed as input.
+    '''
+    print("Converting to colored GeoTIFF...")
+    try:
+        transform = get_geotransform(data)
+        rgba = colorize(get_values(data), color_relief_file)
+        write_rgba_geotiff(rgba, output_colored_tif, '+proj=latlong', transform)
+    except Exception as e:
+        logging.error(f'Error converting to colored geotiff {output_colored_tif}: {e}')
+        return False
+    return True
+
 def convert_to_8bit(input_tif, output_8bit_tif):
     print("Converting GeoTIFF to 8-bit format...")
+    # keep the VRT next to the output so concurrent jobs don't share it
+    temp_vrt = os.path.splitext(output_8bit_tif)[0] + '.vrt'
     gdal_translate_command = [
         'gdal_translate', '-of', 'VRT', '-ot', 'Byte', '-scale',
-        input_tif, 'temp.vrt'
+        input_tif, temp_vrt
     ]
     
     try:
@@ -173,7 +270,7 @@ def convert_to_8bit(input_tif, output_8bit_tif):
         return False
 
     gdal_translate_command = [
-        'gdal_translate', '-of', 'GTiff', 'temp.vrt', output_8bit_tif
+        'gdal_translate', '-of', 'GTiff', temp_vrt, output_8bit_tif
     ]
     
     try:
@@ -184,36 +281,74 @@ def convert_to_8bit(input_tif, output_8bit_tif):
 
     return True
 
-def reproject_geotiff(input_tif, reprojected_tif, target_crs):
+def reproject_geotiff(input_tif, reprojected_tif, target_crs, resampling='nearest'):
+    '''
+    Replaces the gdalwarp subprocess: reads the raster, warps it in memory
+    (through a cached warp map for lat/lon grids) and writes it back out.
+    '''
     print(f"Reprojecting GeoTIFF to {target_crs}...")
-    gdalwarp_command = [
-        'gdalwarp', '-t_srs', target_crs, input_tif, reprojected_tif
-    ]
-
+    import rasterio
     try:
-        subprocess.run(gdalwarp_command, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error during gdalwarp: {e}")
+        with rasterio.open(input_tif) as src:
+            profile = src.profile.copy()
+            bands = np.moveaxis(src.read(), 0, -1)
+            warped, transform = reproject_array(bands, src.transform, src.crs, target_crs, resampling)
+
+        profile.update(
+            driver='GTiff', crs=target_crs, transform=transform,
+            height=warped.shape[0], width=warped.shape[1], nodata=profile.get('nodata'),
+        )
+        with rasterio.open(reprojected_tif, 'w', **profile) as dst:
+            dst.write(np.moveaxis(warped, -1, 0))
+    except Exception as e:
+        print(f"Error during reprojection: {e}")
         return False
-    
+
     return True
 
+def read_rgba_3857(input_tif):
+    '''
+    Reads a raster as an (H, W, 4) uint8 array in EPSG:3857, warping in memory
+    when the file is in another CRS (e.g. the lat/lon GPM GeoTIFFs).
+    '''
+    import rasterio
+    with rasterio.open(input_tif) as src:
+        rgba = to_rgba(src.read())
+        if src.crs is not None and src.crs.to_epsg() == 3857:
+            return rgba, src.transform
+        return reproject_array(rgba, src.transform, src.crs, 'EPSG:3857')
+
 def generate_tiles(input_tif, output_tiles, profile='mercator'):
     print(f"Generating map tiles using {profile} profile...")
-    if not os.path.exists(output_tiles):
-        os.makedirs(output_tiles)
+    if profile != 'mercator':
+        print(f"Unsupported tile profile: {profile}")
+        return False
 
-    gdal2tiles_command = ['gdal2tiles.py', '-p', profile, input_tif, output_tiles, '-z', '0-5', '--xyz']
-    
     try:
-        subprocess.run(gdal2tiles_command, check=True)
+        rgba, transform = read_rgba_3857(input_tif)
+        generate_tile_pyramid(rgba, transform, output_tiles)
         print(f"Tiles created successfully in {output_tiles}")
-    except subprocess.CalledProcessError as e:
+    except Exception as e:
         print(f"Error during tile creation: {e}")
         return False
     
     return True
 
+@contextmanager
+def scratch_dir(job_name, keep=False):
+    '''
+    Gives a conversion job its own temporary directory for intermediates so
+    jobs can run concurrently. Removed on success or failure unless keep=True.
+    '''
+    work_dir = tempfile.mkdtemp(prefix=f'{job_name}_')
+    try:
+        yield work_dir
+    finally:
+        if keep:
+            print(f"Keeping intermediate files in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
 def remove_intermediate_files(files):
     print("Removing intermediate files...")
     for file in files:
@@ -226,15 +361,17 @@ def remove_intermediate_files(files):
             print(f"Error removing {file}: {e}")
 
 def apply_color_relief(input_tif, color_relief_file, output_colored_tif):
+    import rasterio
     print("Applying color relief...")
-    gdal_dem_command = [
-        'gdaldem', 'color-relief', '-alpha', input_tif, color_relief_file, output_colored_tif
-    ]
-
     try:
-        subprocess.run(gdal_dem_command, check=True)
+        with rasterio.open(input_tif) as src:
+            data = src.read(1, masked=True)
+            crs = src.crs
+            transform = src.transform
+        rgba = colorize(data, color_relief_file)
+        write_rgba_geotiff(rgba, output_colored_tif, crs, transform)
         print(f"Color relief applied successfully to {output_colored_tif}")
-    except subprocess.CalledProcessError as e:
+    except Exception as e:
         print(f"Error during color relief application: {e}")
         return False
     
@@ -242,6 +379,99 @@ def apply_color_relief(input_tif, color_relief_file, output_colored_tif):
 
 
 
+def reproject_array(array, src_transform, src_crs, target_crs='EPSG:3857', resampling='nearest'):
+    '''
+    Warps an (H, W, C) array to target_crs in memory, nearest by default like
+    gdalwarp. Returns the warped array and its transform. Lat/lon grids going
+    to EPSG:3857 reuse a warp map cached per source grid, so each frame is
+    just a gather; anything else falls back to rasterio's reproject.
+    '''
+    if can_use_warp_map(src_transform, src_crs, target_crs):
+        warp_map = get_warp_map(array.shape, src_transform, src_crs, target_crs, resampling)
+        alpha_band = 3 if array.ndim == 3 and array.shape[2] == 4 else None
+        return warp(array, warp_map, alpha_band=alpha_band), warp_map.dst_transform
+
+    from rasterio.enums import Resampling
+    from rasterio.warp import calculate_default_transform, reproject
+    height, width = array.shape[:2]
+    left, top = src_transform.c, src_transform.f
+    right = left + src_transform.a * width
+    bottom = top + src_transform.e * height
+    dst_transform, dst_width, dst_height = calculate_default_transform(
+        src_crs, target_crs, width, height, left=left, bottom=bottom, right=right, top=top
+    )
+
+    source = np.moveaxis(array, -1, 0)
+    destination = np.zeros((source.shape[0], dst_height, dst_width), dtype=array.dtype)
+    reproject(
+        source=source,
+        destination=destination,
+        src_transform=src_transform,
+        src_crs=src_crs,
+        dst_transform=dst_transform,
+        dst_crs=target_crs,
+        resampling=Resampling[resampling],
+    )
+    return np.ascontiguousarray(np.moveaxis(destination, 0, -1)), dst_transform
+
+def process_array_to_tiles(
+        values,
+        transform,
+        output_tiles,
+        color_relief_file,
+        src_crs='+proj=latlong',
+        target_crs='EPSG:3857',
+        grid_sink=None
+):
+    '''
+    Fused pipeline: colorize -> reproject -> tile, entirely in memory.
+    Only the final PNG tiles are written to disk, plus the decoded values
+    when a grid_sink (utils.grid_store.GridFrameSink) is given.
+    '''
+    try:
+        print("Colorizing in memory...")
+        rgba = colorize(values, color_relief_file)
+        print(f"Reprojecting in memory to {target_crs}...")
+        rgba, tiles_transform = reproject_array(rgba, transform, src_crs, target_crs)
+        print(f"Generating map tiles in {output_tiles}...")
+        generate_tile_pyramid(rgba, tiles_transform, output_tiles)
+    except Exception as e:
+        logging.error(f'Error in fused tile pipeline for {output_tiles}: {e}')
+        return False
+
+    if grid_sink is not None:
+        grid_sink.write(values, transform, src_crs)
+    return True
+
+def process_dataarray_to_tiles(
+        data,
+        output_tiles,
+        color_relief_file,
+        target_crs='EPSG:3857',
+        satellite=False,
+        grid_sink=None
+):
+    '''Clips a decoded DataArray and runs it through the fused pipeline.'''
+    if data is False:
+        return False
+
+    data = clip_latitude(data)
+    if data is False:
+        return False
+
+    try:
+        if satellite:
+            values, transform = regrid_satellite(data)
+        else:
+            values, transform = get_values(data), get_geotransform(data)
+    except Exception as e:
+        logging.error(f'Error preparing grid for {output_tiles}: {e}')
+        return False
+
+    return process_array_to_tiles(
+        values, transform, output_tiles, color_relief_file, target_crs=target_crs, grid_sink=grid_sink
+    )
+
 def process_netcdf_to_tiles(
         netcdf_file, 
         variable_name, 
@@ -249,50 +479,54 @@ def process_netcdf_to_tiles(
         color_relief_file, 
         target_crs='EPSG:3857',
         remove=True,
-        satellite=False
+        satellite=False,
+        in_memory=True,
+        grid_sink=None
 ):
-    
-    base_temp_file_name = os.path.splitext(os.path.basename(netcdf_file))[0]
-    output_tif = base_temp_file_name + '.tif'
-    output_8bit_tif = base_temp_file_name + '_8bit.tif'
-    output_colored_tif = base_temp_file_name + '_colored.tif'
-    reprojected_tif = base_temp_file_name + '_3857.tif'
+    if in_memory:
+        data = read_netcdf(netcdf_file, variable_name)
+        return process_dataarray_to_tiles(
+            data, output_tiles, color_relief_file, target_crs=target_crs, satellite=satellite, grid_sink=grid_sink
+        )
+
+    base_name = os.path.splitext(os.path.basename(netcdf_file))[0]
+    with scratch_dir(base_name, keep=not remove) as work_dir:
+        base_temp_file_name = os.path.join(work_dir, base_name)
+        output_tif = base_temp_file_name + '.tif'
+        output_8bit_tif = base_temp_file_name + '_8bit.tif'
+        output_colored_tif = base_temp_file_name + '_colored.tif'
+        reprojected_tif = base_temp_file_name + '_3857.tif'
     
     
-    data = read_netcdf(netcdf_file, variable_name)
-    
-    data = clip_latitude(data)
-
-    if satellite:
-        geotiff_success = preprocess_satellite_netcdf(data, output_tif)
-    else:
+        data = read_netcdf(netcdf_file, variable_name)
     
-        geotiff_success = convert_to_geotiff(data, output_tif)
-
-    if geotiff_success:
-        color_success = apply_color_relief(output_tif, color_relief_file, output_colored_tif)
-    else:
-        return False
+        data = clip_latitude(data)
+
+        if satellite:
+            geotiff_success = preprocess_satellite_netcdf(data, output_tif)
+            if geotiff_success:
+                color_success = apply_color_relief(output_tif, color_relief_file, output_colored_tif)
+            else:
+                return False
+        else:
+            color_success = convert_to_colored_geotiff(data, color_relief_file, output_colored_tif)
     
-    if color_success:
-        bit_success = convert_to_8bit(output_colored_tif, output_8bit_tif)
-    else:
-        return False
+        if color_success:
+            bit_success = convert_to_8bit(output_colored_tif, output_8bit_tif)
+        else:
+            return False
     
-    if bit_success:
-        reproject_success = reproject_geotiff(output_8bit_tif, reprojected_tif, target_crs)
-    else:
-        return False
+        if bit_success:
+            reproject_success = reproject_geotiff(output_8bit_tif, reprojected_tif, target_crs)
+        else:
+            return False
     
-    if reproject_success:
-        tiles_success = generate_tiles(reprojected_tif, output_tiles, profile='mercator')
-    else:
-        return False
-
-    if remove:
-        remove_intermediate_files([output_tif, output_8bit_tif, reprojected_tif, output_colored_tif, 'temp.vrt'])
+        if reproject_success:
+            tiles_success = generate_tiles(reprojected_tif, output_tiles, profile='mercator')
+        else:
+            return False
 
-    return tiles_success
+        return tiles_success
 
 def process_grib2_to_tiles(
         grib_file, 
@@ -302,71 +536,85 @@ def process_grib2_to_tiles(
         color_relief_file, 
         target_crs='EPSG:3857',
         filter_grib=True,
-        remove=True
+        remove=True,
+        in_memory=True,
+        grid_sink=None
     ):
-
-    base_temp_file_name = os.path.splitext(os.path.basename(grib_file))[0]
-    output_tif = base_temp_file_name + '.tif'
-    output_8bit_tif = base_temp_file_name + '_8bit.tif'
-    output_colored_tif = base_temp_file_name + '_3857.tif'
-    reprojected_tif = base_temp_file_name + '_colored.tif'
-
-    data = read_grib2(grib_file, variable_name, type_of_level, filter_grib=filter_grib)
-    data = clip_latitude(data)
-    geotiff_success = convert_to_geotiff(data, output_tif)
-
-    if geotiff_success:
-        color_success = apply_color_relief(output_tif, color_relief_file, output_colored_tif)
-    else:
-        return False
+    if in_memory:
+        data = read_grib2(grib_file, variable_name, type_of_level, filter_grib=filter_grib)
+        return process_dataarray_to_tiles(
+            data, output_tiles, color_relief_file, target_crs=target_crs, grid_sink=grid_sink
+        )
+
+    base_name = os.path.splitext(os.path.basename(grib_file))[0]
+    with scratch_dir(base_name, keep=not remove) as work_dir:
+        base_temp_file_name = os.path.join(work_dir, base_name)
+        output_tif = base_temp_file_name + '.tif'
+        output_8bit_tif = base_temp_file_name + '_8bit.tif'
+        output_colored_tif = base_temp_file_name + '_3857.tif'
+        reprojected_tif = base_temp_file_name + '_colored.tif'
+
+        data = read_grib2(grib_file, variable_name, type_of_level, filter_grib=filter_grib)
+        data = clip_latitude(data)
+        color_success = convert_to_colored_geotiff(data, color_relief_file, output_colored_tif)
     
-    if color_success:
-        bit_success = convert_to_8bit(output_colored_tif, output_8bit_tif)
-    else:
-        return False
+        if color_success:
+            bit_success = convert_to_8bit(output_colored_tif, output_8bit_tif)
+        else:
+            return False
     
-    if bit_success:
-        reproject_success = reproject_geotiff(output_8bit_tif, reprojected_tif, target_crs)
-    else:
-        return False
+        if bit_success:
+            reproject_success = reproject_geotiff(output_8bit_tif, reprojected_tif, target_crs)
+        else:
+            return False
     
-    if reproject_success:
-        tiles_success = generate_tiles(reprojected_tif, output_tiles, profile='mercator')
-    else:
-        return False
-
-    if remove:
-        remove_intermediate_files([output_tif, output_8bit_tif, reprojected_tif, output_colored_tif, 'temp.vrt'])
+        if reproject_success:
+            tiles_success = generate_tiles(reprojected_tif, output_tiles, profile='mercator')
+        else:
+            return False
 
-    return tiles_success
+        return tiles_success
 
 def process_tif_to_tiles(
         input_tif, 
         output_tiles, 
         color_relief_file,
-        remove=True
+        remove=True,
+        in_memory=True,
+        grid_sink=None
 ):
-    base_temp_file_name = os.path.splitext(os.path.basename(input_tif))[0]
-    output_8bit_tif = base_temp_file_name + '_8bit.tif'
-    output_colored_tif = base_temp_file_name + '_3857.tif'
-    reprojected_tif = base_temp_file_name + '_colored.tif'
-
-    # apply_color_relief(input_tif, color_relief_file, output_colored_tif)
-    # generate_tiles(output_colored_tif, output_tiles, profile='mercator')
-    # remove_intermediate_files([output_8bit_tif, reprojected_tif, output_colored_tif, 'temp.vrt'])
-
-    
-    color_success = apply_color_relief(input_tif, color_relief_file, output_colored_tif)
+    import rasterio
+    if in_memory:
+        try:
+            with rasterio.open(input_tif) as src:
+                values = src.read(1, masked=True)
+                transform = src.transform
+                crs = src.crs
+        except Exception as e:
+            logging.error(f'Error reading {input_tif}: {e}')
+            return False
+        values, transform = clip_latitude_array(values, transform, crs)
+        if values is False:
+            return False
+        return process_array_to_tiles(
+            values, transform, output_tiles, color_relief_file, src_crs=crs, grid_sink=grid_sink
+        )
+
+    base_name = os.path.splitext(os.path.basename(input_tif))[0]
+    with scratch_dir(base_name, keep=not remove) as work_dir:
+        base_temp_file_name = os.path.join(work_dir, base_name)
+        output_8bit_tif = base_temp_file_name + '_8bit.tif'
+        output_colored_tif = base_temp_file_name + '_3857.tif'
+        reprojected_tif = base_temp_file_name + '_colored.tif'
+
+        color_success = apply_color_relief(input_tif, color_relief_file, output_colored_tif)
     
-    if color_success:
-        tiles_success = generate_tiles(output_colored_tif, output_tiles, profile='mercator')
-    else:
-        return False
-
-    if remove:
-        remove_intermediate_files([output_8bit_tif, reprojected_tif, output_colored_tif, 'temp.vrt'])
+        if color_success:
+            tiles_success = generate_tiles(output_colored_tif, output_tiles, profile='mercator')
+        else:
+            return False
 
-    return tiles_success
+        return tiles_success
 
 def process_zipped_grib2_to_tiles(
         gzipped_grib2_file, 
@@ -375,39 +623,41 @@ def process_zipped_grib2_to_tiles(
         output_tiles, 
         color_relief_file, 
         target_crs='EPSG:3857',
-        filter_grib=True
+        filter_grib=True,
+        in_memory=True,
+        grid_sink=None
     ):
     print(f"Processing {gzipped_grib2_file}...")
-    try:
-        # Decompress the gzipped GRIB2 file
-        grib2_file = gzipped_grib2_file.replace('.gz', '')
-        with gzip.open(gzipped_grib2_file, 'rb') as f_in:
-            with open(grib2_file, 'wb') as f_out:
-                shutil.copyfileobj(f_in, f_out)
-    except Exception as e:
-        logging.error(f'Error decompressing {gzipped_grib2_file}:', e)
-
-    # Process the decompressed GRIB2 file as normal
-    success = process_grib2_to_tiles(
-        grib2_file, 
-        variable_name, 
-        type_of_level, 
-        # output_tif, 
-        # output_8bit_tif, 
-        # reprojected_tif, 
-        # output_colored_tif, 
-        output_tiles, 
-        color_relief_file, 
-        target_crs,
-        filter_grib=filter_grib)
+    # Single-message files (MRMS) decode straight from the gzip stream;
+    # filtering by level needs cfgrib, which only reads from a file.
+    if in_memory and not filter_grib:
+        data = read_zipped_grib2(gzipped_grib2_file)
+        return process_dataarray_to_tiles(
+            data, output_tiles, color_relief_file, target_crs=target_crs, grid_sink=grid_sink
+        )
+
+    base_name = os.path.splitext(os.path.basename(gzipped_grib2_file))[0]
+    with scratch_dir(base_name) as work_dir:
+        try:
+            # Decompress the gzipped GRIB2 file into this job's scratch dir
+            grib2_file = os.path.join(work_dir, base_name)
+            with gzip.open(gzipped_grib2_file, 'rb') as f_in:
+                with open(grib2_file, 'wb') as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+        except Exception as e:
+            logging.error(f'Error decompressing {gzipped_grib2_file}: {e}')
+            return False
 
-    # Remove the decompressed GRIB2 file
-    try:
-        os.remove(grib2_file)
-        print(f"Removed {grib2_file}")
-    except FileNotFoundError:
-        print(f"{grib2_file} not found, skipping.")
-    except Exception as e:
-        print(f"Error removing {grib2_file}: {e}")
+        # Process the decompressed GRIB2 file as normal
+        success = process_grib2_to_tiles(
+            grib2_file, 
+            variable_name, 
+            type_of_level, 
+            output_tiles, 
+            color_relief_file, 
+            target_crs,
+            filter_grib=filter_grib,
+            in_memory=in_memory,
+            grid_sink=grid_sink)
 
     return success
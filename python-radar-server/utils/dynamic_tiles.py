@@ -0,0 +1,180 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+from affine import Affine
+
+from utils.tile_pyramid import empty_tile_png, encode_png, render_tile, source_window_is_empty
+
+
+# zooms past the pre-rendered pyramid are rendered on request, up to this one
+MAX_DYNAMIC_ZOOM = 12
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024
+# memory-mapped frame rasters kept open for rendering, oldest evicted first
+MAX_OPEN_RASTERS = 32
+
+
+def dynamic_tiles_enabled() -> bool:
+    '''
+    Deep zooms are opt-in with RADAR_DYNAMIC_TILES=1: each frame then also
+    keeps its full resolution, uncompressed raster (100+ MB for an MRMS frame).
+    '''
+    return os.environ.get('RADAR_DYNAMIC_TILES', '0') == '1'
+
+
+def frame_raster_dir() -> str:
+    # under the server's data dir, not next to the frames in the app's public dir
+    return os.environ.get('RADAR_FRAME_RASTER_DIR', os.path.join('.', 'data', 'frame_rasters'))
+
+
+def raster_path(frame_path: str) -> str:
+    '''Where the frame's EPSG:3857 RGBA raster is kept, named after the frame and its full path.'''
+    frame_path = os.path.realpath(frame_path.rstrip(os.sep))
+    digest = hashlib.blake2b(frame_path.encode(), digest_size=8).hexdigest()
+    return os.path.join(frame_raster_dir(), f'{os.path.basename(frame_path)}-{digest}.raster.npy')
+
+
+def _legacy_raster_path(frame_path: str) -> str:
+    # earlier versions kept the raster next to the frame
+    frame_path = frame_path.rstrip(os.sep)
+    return os.path.join(os.path.dirname(frame_path) or '.', f'.{os.path.basename(frame_path)}.raster.npy')
+
+
+def _transform_path(path: str) -> str:
+    return os.path.splitext(path)[0] + '.json'
+
+
+def save_frame_raster(frame_path: str, rgba: np.ndarray, transform):
+    '''
+    Saves the frame's (H, W, 4) uint8 raster as a plain .npy so the server can
+    memory-map it, plus its transform. Both are written then renamed, the
+    transform last, so a raster is only picked up once it is complete.
+    '''
+    path = raster_path(frame_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(rgba, dtype=np.uint8))
+    os.replace(temp_path, path)
+
+    meta_path = _transform_path(path)
+    temp_meta_path = f'{meta_path}.{os.getpid()}.tmp'
+    with open(temp_meta_path, 'w') as f:
+        json.dump({'transform': list(transform)[:6], 'shape': list(rgba.shape)}, f)
+    os.replace(temp_meta_path, meta_path)
+
+
+_rasters: 'OrderedDict[str, Tuple[Tuple[int, int], np.ndarray, Affine]]' = OrderedDict()
+_rasters_lock = threading.Lock()
+
+
+def load_frame_raster(frame_path: str) -> Optional[Tuple[np.ndarray, Affine]]:
+    '''Returns the frame's memory-mapped raster and transform, or None if it has none.'''
+    path = raster_path(frame_path)
+    meta_path = _transform_path(path)
+    try:
+        stat = os.stat(meta_path)
+    except FileNotFoundError:
+        evict_frame_raster(frame_path)
+        return None
+    version = (stat.st_ino, stat.st_mtime_ns)
+
+    with _rasters_lock:
+        cached = _rasters.get(path)
+        if cached is not None and cached[0] == version:
+            _rasters.move_to_end(path)
+            return cached[1], cached[2]
+
+    try:
+        with open(meta_path) as f:
+            transform = Affine(*json.load(f)['transform'])
+        rgba = np.load(path, mmap_mode='r')
+    except (OSError, ValueError) as e:
+        logging.error(f'Error loading frame raster {path}: {e}')
+        return None
+
+    with _rasters_lock:
+        _rasters[path] = (version, rgba, transform)
+        _rasters.move_to_end(path)
+        while len(_rasters) > MAX_OPEN_RASTERS:
+            _rasters.popitem(last=False)
+    return rgba, transform
+
+
+def evict_frame_raster(frame_path: str):
+    with _rasters_lock:
+        _rasters.pop(raster_path(frame_path), None)
+
+
+def remove_frame_raster(frame_path: str):
+    '''Deletes a frame's raster, e.g. once the frame has expired.'''
+    evict_frame_raster(frame_path)
+    for path in (raster_path(frame_path), _legacy_raster_path(frame_path)):
+        for file_path in (path, _transform_path(path)):
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+
+
+def render_raster_tile(rgba: np.ndarray, transform, z: int, x: int, y: int) -> Optional[bytes]:
+    '''Renders one tile as PNG bytes, or None if it would be fully transparent.'''
+    if source_window_is_empty(rgba, transform, z, x, y):
+        return None
+    # render_tile stops oversampling once tile pixels are smaller than source pixels
+    tile = render_tile(rgba, transform, z, x, y)
+    if not tile[..., 3].any():
+        return None
+    return encode_png(tile)
+
+
+class DynamicTileCache:
+    '''
+    Renders deep-zoom tiles on request from memory-mapped frame rasters and
+    keeps the encoded PNGs in an LRU bounded by total size, so only the
+    tiles people actually look at are ever rendered.
+    '''
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, max_zoom: int = MAX_DYNAMIC_ZOOM):
+        self.max_bytes = max_bytes
+        self.max_zoom = max_zoom
+        self.entries: 'OrderedDict[tuple, bytes]' = OrderedDict()
+        self.lock = threading.Lock()
+        self.nbytes = 0
+
+    def get(self, frame_path: str, z: int, x: int, y: int) -> Optional[bytes]:
+        '''
+        Returns the tile's PNG bytes (the shared empty tile where the frame has
+        no data), or None if the frame has no raster or z is out of range.
+        '''
+        if z > self.max_zoom or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            return None
+        raster = load_frame_raster(frame_path)
+        if raster is None:
+            return None
+        rgba, transform = raster
+
+        # the raster's mtime is in the key so a reprocessed frame isn't served stale
+        try:
+            key = (frame_path, os.stat(raster_path(frame_path)).st_mtime_ns, z, x, y)
+        except FileNotFoundError:
+            return None
+        with self.lock:
+            png = self.entries.get(key)
+            if png is not None:
+                self.entries.move_to_end(key)
+                return png
+
+        png = render_raster_tile(rgba, transform, z, x, y) or empty_tile_png()
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = png
+                self.nbytes += len(png)
+            while self.nbytes > self.max_bytes and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= len(evicted)
+        return png
@@ -0,0 +1,92 @@
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Iterable, List
+
+from classes import GeoDataFile
+
+
+class FrameManifest:
+    '''
+    Durable SQLite record of every processed frame (source, key, timestamp,
+    processed_loc, status). Frames are 'processing' while being written and
+    'ready' once complete. Data sources update it transactionally as frames
+    are added and expired, and load their state from it at startup,
+    reconciled with a listing of their processed dirs (see
+    DataSource.reconcile_manifest) rather than a walk of every tile.
+    '''
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS frames (
+                    source TEXT NOT NULL,
+                    processed_loc TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    datetime TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (source, processed_loc)
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS frames_by_time ON frames (source, datetime)')
+
+    def record(self, source: str, files: Iterable[GeoDataFile], status: str = 'ready'):
+        now = datetime.now(timezone.utc).isoformat()
+        rows = [
+            (source, file.processed_loc, file.key, file.datetime.isoformat(), status, now)
+            # frames without a datetime can't be ordered, so they aren't recorded
+            for file in files if file.processed_loc and file.datetime is not None
+        ]
+        if not rows:
+            return
+        with self.lock, self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO frames '
+                '(source, processed_loc, key, datetime, status, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                rows
+            )
+
+    def remove(self, source: str, processed_locs: Iterable[str]):
+        rows = [(source, processed_loc) for processed_loc in processed_locs if processed_loc]
+        if not rows:
+            return
+        with self.lock, self.conn:
+            self.conn.executemany('DELETE FROM frames WHERE source = ? AND processed_loc = ?', rows)
+
+    def has_source(self, source: str) -> bool:
+        with self.lock:
+            row = self.conn.execute('SELECT 1 FROM frames WHERE source = ? LIMIT 1', (source,)).fetchone()
+        return row is not None
+
+    def load(self, source: str, status: str = 'ready') -> List[GeoDataFile]:
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT key, datetime, processed_loc FROM frames '
+                'WHERE source = ? AND status = ? ORDER BY datetime',
+                (source, status)
+            ).fetchall()
+
+        files = [
+            GeoDataFile(
+                datetime=datetime.fromisoformat(file_datetime),
+                remote_path='',
+                local_path='',
+                processed_loc=processed_loc,
+                key=key
+            )
+            for key, file_datetime, processed_loc in rows
+        ]
+        logging.info(f'Loaded {len(files)} {source} frames from manifest {self.db_path}')
+        return files
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from affine import Affine
+
+
+@dataclass
+class GridSpec:
+    '''Coordinates shared by every frame decoded on the same grid.'''
+    grid_id: str
+    shape: Tuple[int, int]
+    transform: Affine
+    crs: str
+
+
+@dataclass
+class GridFrame:
+    key: str
+    datetime: datetime
+    grid_id: str
+    path: str
+
+
+def grid_id_for(shape, transform, crs) -> str:
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(json.dumps([list(shape[:2]), list(transform)[:6], str(crs)]).encode())
+    return digest.hexdigest()
+
+
+class GridStore:
+    '''
+    Time-indexed store of a source's decoded float32 grids: one plain .npy per
+    frame, so reads are memory-mapped and slicing them copies nothing, plus a
+    SQLite index of frame times and the grids (shape, transform, CRS) they
+    share. Frames are appended by the processing workers and expired with the
+    source's time_delta.
+    '''
+    def __init__(self, root: str):
+        self.root = root
+        self.frames_dir = os.path.join(root, 'frames')
+        os.makedirs(self.frames_dir, exist_ok=True)
+        self.db_path = os.path.join(root, 'index.sqlite3')
+        self._grids: Dict[str, GridSpec] = {}
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS grids (
+                    grid_id TEXT PRIMARY KEY,
+                    shape TEXT NOT NULL,
+                    transform TEXT NOT NULL,
+                    crs TEXT NOT NULL
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS frames (
+                    key TEXT PRIMARY KEY,
+                    datetime TEXT NOT NULL,
+                    grid_id TEXT NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS frames_by_time ON frames (datetime)')
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # short-lived connections: frames are appended from worker processes
+        return sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+
+    def frame_path(self, key: str) -> str:
+        return os.path.join(self.frames_dir, key.replace('/', '_') + '.npy')
+
+    def append(self, key: str, frame_time: datetime, values: np.ndarray, transform, crs='+proj=latlong') -> GridFrame:
+        '''Stores one decoded frame (masked or NaN for no data) on its grid.'''
+        values = np.ma.filled(np.ma.asarray(values, dtype=np.float32), np.nan)
+        grid_id = grid_id_for(values.shape, transform, crs)
+
+        path = self.frame_path(key)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(values))
+        os.replace(temp_path, path)
+
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'INSERT OR IGNORE INTO grids (grid_id, shape, transform, crs) VALUES (?, ?, ?, ?)',
+                (grid_id, json.dumps(list(values.shape)), json.dumps(list(transform)[:6]), str(crs))
+            )
+            conn.execute(
+                'INSERT OR REPLACE INTO frames (key, datetime, grid_id) VALUES (?, ?, ?)',
+                (key, frame_time.isoformat(), grid_id)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return GridFrame(key, frame_time, grid_id, path)
+
+    def frames(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[GridFrame]:
+        '''Frames in [start, end], oldest first.'''
+        query = 'SELECT key, datetime, grid_id FROM frames'
+        clauses, params = [], []
+        if start is not None:
+            clauses.append('datetime >= ?')
+            params.append(start.isoformat())
+        if end is not None:
+            clauses.append('datetime <= ?')
+            params.append(end.isoformat())
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        conn = self._connect()
+        try:
+            rows = conn.execute(query + ' ORDER BY datetime', params).fetchall()
+        finally:
+            conn.close()
+        return [
+            GridFrame(key, datetime.fromisoformat(frame_time), grid_id, self.frame_path(key))
+            for key, frame_time, grid_id in rows
+        ]
+
+    def grid(self, grid_id: str) -> GridSpec:
+        spec = self._grids.get(grid_id)
+        if spec is not None:
+            return spec
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT shape, transform, crs FROM grids WHERE grid_id = ?', (grid_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            raise KeyError(f'Unknown grid {grid_id} in {self.root}')
+        spec = GridSpec(grid_id, tuple(json.loads(row[0])), Affine(*json.loads(row[1])), row[2])
+        self._grids[grid_id] = spec
+        return spec
+
+    def read(self, frame: GridFrame) -> np.ndarray:
+        '''The frame's values, memory-mapped read-only.'''
+        return np.load(frame.path, mmap_mode='r')
+
+    def expire(self, cutoff: datetime) -> int:
+        '''Deletes frames older than cutoff (and grids no frame uses). Returns the number deleted.'''
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            keys = [row[0] for row in conn.execute('SELECT key FROM frames WHERE datetime < ?', (cutoff.isoformat(),))]
+            conn.execute('DELETE FROM frames WHERE datetime < ?', (cutoff.isoformat(),))
+            conn.execute('DELETE FROM grids WHERE grid_id NOT IN (SELECT DISTINCT grid_id FROM frames)')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+        for key in keys:
+            try:
+                os.remove(self.frame_path(key))
+            except FileNotFoundError:
+                pass
+        if keys:
+            logging.info(f'Expired {len(keys)} grids from {self.root}')
+        return len(keys)
+
+
+@dataclass
+class GridFrameSink:
+    '''
+    Picklable handle passed to a processing job so the decoded grid of the
+    frame it is processing is appended to the source's GridStore.
+    '''
+    root: str
+    key: str
+    datetime: datetime
+
+    def write(self, values: np.ndarray, transform, crs='+proj=latlong'):
+        try:
+            GridStore(self.root).append(self.key, self.datetime, values, transform, crs)
+        except Exception as e:
+            # the tiles are still good without it
+            logging.error(f'Error storing grid for {self.key} in {self.root}: {e}')
@@ -0,0 +1,132 @@
+import glob
+import logging
+import os
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from utils.ppi_rasterizer import GRID_RES, MAX_RANGE_M, window_transform, get_site_grid
+
+
+# CONUS mosaic window on the global rasterizer lattice (row 0 at 90N, col 0 at 180W)
+MOSAIC_NORTH, MOSAIC_SOUTH = 55.0, 20.0
+MOSAIC_WEST, MOSAIC_EAST = -130.0, -60.0
+MOSAIC_ROW_OFF = int(round((90.0 - MOSAIC_NORTH) / GRID_RES))
+MOSAIC_COL_OFF = int(round((MOSAIC_WEST + 180.0) / GRID_RES))
+MOSAIC_SHAPE = (
+    int(round((MOSAIC_NORTH - MOSAIC_SOUTH) / GRID_RES)),
+    int(round((MOSAIC_EAST - MOSAIC_WEST) / GRID_RES)),
+)
+
+
+@dataclass
+class SiteSweep:
+    '''The rasterized sweep-0 values of one scan, positioned on the global lattice.'''
+    site_id: str
+    key: str
+    values: np.ndarray
+    row_off: int
+    col_off: int
+    lat: float
+    lon: float
+
+
+def save_site_sweep(grid_dir: str, site_id: str, key: str, values: np.ndarray,
+                    row_off: int, col_off: int, lat: float, lon: float) -> str:
+    site_dir = os.path.join(grid_dir, site_id)
+    os.makedirs(site_dir, exist_ok=True)
+    path = os.path.join(site_dir, f'{key}.npz')
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        np.savez(f, values=values, offsets=np.array([row_off, col_off]), location=np.array([lat, lon]))
+    os.replace(temp_path, path)
+    return path
+
+
+def load_site_sweep(path: str) -> SiteSweep:
+    with np.load(path) as npz:
+        row_off, col_off = (int(v) for v in npz['offsets'])
+        lat, lon = (float(v) for v in npz['location'])
+        key = os.path.splitext(os.path.basename(path))[0]
+        return SiteSweep(key[:4], key, npz['values'], row_off, col_off, lat, lon)
+
+
+def latest_site_sweep_paths(grid_dir: str, prune: bool = True) -> List[str]:
+    '''
+    Returns the newest saved sweep per site. Keys sort by scan time, so the
+    last file name wins; older sweeps are deleted when prune is set.
+    '''
+    latest = []
+    for site_dir in sorted(glob.glob(os.path.join(grid_dir, '*'))):
+        paths = sorted(glob.glob(os.path.join(site_dir, '*.npz')))
+        if not paths:
+            continue
+        latest.append(paths[-1])
+        if prune:
+            for path in paths[:-1]:
+                os.remove(path)
+    return latest
+
+
+def _overlap(sweep: SiteSweep) -> Optional[Tuple[slice, slice, slice, slice]]:
+    '''Returns (mosaic rows, mosaic cols, sweep rows, sweep cols) slices, or None if disjoint.'''
+    height, width = sweep.values.shape
+    top = max(sweep.row_off, MOSAIC_ROW_OFF)
+    bottom = min(sweep.row_off + height, MOSAIC_ROW_OFF + MOSAIC_SHAPE[0])
+    left = max(sweep.col_off, MOSAIC_COL_OFF)
+    right = min(sweep.col_off + width, MOSAIC_COL_OFF + MOSAIC_SHAPE[1])
+    if top >= bottom or left >= right:
+        return None
+    return (
+        slice(top - MOSAIC_ROW_OFF, bottom - MOSAIC_ROW_OFF),
+        slice(left - MOSAIC_COL_OFF, right - MOSAIC_COL_OFF),
+        slice(top - sweep.row_off, bottom - sweep.row_off),
+        slice(left - sweep.col_off, right - sweep.col_off),
+    )
+
+
+def composite(sweeps: List[SiteSweep], rule: str = 'max'):
+    '''
+    Merges site sweeps onto the CONUS mosaic grid. Overlaps take the maximum
+    value ('max') or the value from the closest radar ('nearest').
+    Returns (values, transform) with NaN where no radar has coverage.
+    '''
+    if rule not in ('max', 'nearest'):
+        raise ValueError(f'Unknown mosaic rule: {rule}')
+
+    mosaic = np.full(MOSAIC_SHAPE, np.nan, dtype=np.float32)
+    distance = np.full(MOSAIC_SHAPE, np.inf, dtype=np.float32) if rule == 'nearest' else None
+
+    for sweep in sweeps:
+        overlap = _overlap(sweep)
+        if overlap is None:
+            continue
+        mosaic_rows, mosaic_cols, sweep_rows, sweep_cols = overlap
+        values = sweep.values[sweep_rows, sweep_cols]
+        target = mosaic[mosaic_rows, mosaic_cols]
+
+        if rule == 'max':
+            np.fmax(target, values, out=target)
+        else:
+            site_range = get_site_grid(sweep.site_id, sweep.lat, sweep.lon, MAX_RANGE_M).ground_range
+            site_range = site_range[sweep_rows, sweep_cols]
+            target_distance = distance[mosaic_rows, mosaic_cols]
+            closer = ~np.isnan(values) & (site_range < target_distance)
+            target[closer] = values[closer]
+            target_distance[closer] = site_range[closer]
+
+    return mosaic, window_transform(MOSAIC_ROW_OFF, MOSAIC_COL_OFF)
+
+
+def build_mosaic(grid_dir: str, rule: str = 'max'):
+    '''Composites the newest saved sweep of every site. Returns (values, transform, keys).'''
+    sweeps = []
+    for path in latest_site_sweep_paths(grid_dir):
+        try:
+            sweeps.append(load_site_sweep(path))
+        except Exception as e:
+            logging.error(f'Error loading site sweep {path}: {e}')
+    values, transform = composite(sweeps, rule=rule)
+    logging.info(f'Composited {len(sweeps)} NEXRAD sites into the mosaic')
+    return values, transform, [sweep.key for sweep in sweeps]
@@ -0,0 +1,49 @@
+import logging
+import os
+
+from classes import GeoDataFile
+from utils.nexrad_mosaic import save_site_sweep
+from utils.ppi_rasterizer import preload_site_grids, render_ppi_png, set_grid_cache_dir
+
+
+# Entry points of the NEXRAD render pool. Spawned workers import this module
+# to unpickle their jobs, so it must stay free of import-time side effects.
+
+def init_worker(grid_cache_dir: str):
+    '''Warms a pool worker: heavy imports and the cached site grids, memory-mapped.'''
+    import pyart  # noqa: F401
+    set_grid_cache_dir(grid_cache_dir)
+    loaded = preload_site_grids()
+    logging.info(f'NEXRAD worker {os.getpid()} preloaded {loaded} site grids')
+
+def process_file(
+        geo_data_file: GeoDataFile,
+        output_path: str,
+        variable_name: str,
+        color_relief_file: str,
+        sweep_dir: str | None = None
+) -> GeoDataFile:
+    print(f'Checking if {output_path} exists...')
+    if not os.path.exists(output_path):
+        print(f'{output_path} does not exist, generating...')
+        # already imported by init_worker in pool workers
+        import pyart
+
+        radar = pyart.io.read_nexrad_archive(geo_data_file.local_path)
+        site_id = os.path.basename(geo_data_file.key)[:4]
+        values, site_grid = render_ppi_png(radar, site_id, variable_name, color_relief_file, output_path)
+
+        # keep the float sweep for the national mosaic
+        if sweep_dir is not None:
+            save_site_sweep(
+                sweep_dir, site_id, os.path.basename(geo_data_file.key), values,
+                site_grid.row_off, site_grid.col_off,
+                float(radar.latitude['data'][0]), float(radar.longitude['data'][0])
+            )
+
+        geo_data_file.processed_loc = output_path
+    else:
+        print(f'{output_path} exists. Skipping generation...')
+        geo_data_file.processed_loc = output_path
+
+    return geo_data_file
@@ -0,0 +1,109 @@
+import os
+import threading
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.grid_store import GridFrame, GridSpec, GridStore
+
+
+# largest batch a single request may sample
+MAX_BATCH_POINTS = 100000
+
+
+@lru_cache(maxsize=None)
+def _is_geographic(crs: str) -> bool:
+    from rasterio.crs import CRS
+    return CRS.from_user_input(crs).is_geographic
+
+
+def grid_indices(spec: GridSpec, lat: np.ndarray, lon: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Maps lat/lon points to (rows, cols, valid) on a grid. Longitudes are
+    wrapped into the grid's own range, so 0..360 grids (MRMS) take -180..180
+    input. Points off the grid are not valid.
+    '''
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    transform = spec.transform
+    if _is_geographic(spec.crs):
+        x = transform.c + np.mod(lon - transform.c, 360.0)
+        y = lat
+    else:
+        from rasterio.warp import transform as transform_points
+        x, y = (np.asarray(v) for v in transform_points('EPSG:4326', spec.crs, lon, lat))
+
+    inverse = ~transform
+    cols = np.floor(inverse.a * x + inverse.b * y + inverse.c).astype(np.int64)
+    rows = np.floor(inverse.d * x + inverse.e * y + inverse.f).astype(np.int64)
+    height, width = spec.shape[:2]
+    valid = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width) & np.isfinite(lat) & np.isfinite(lon)
+    return rows, cols, valid
+
+
+class PointSampler:
+    '''
+    Samples the retained frames of a GridStore at many points at once. Point
+    indices are computed once per grid, then each frame is one vectorized
+    gather from its memory-mapped values, so only the pages under the points
+    are ever read.
+    '''
+    def __init__(self, store: GridStore):
+        self.store = store
+        self.lock = threading.Lock()
+        self.open_frames: Dict[str, Tuple[int, np.ndarray]] = {}
+
+    def _open(self, frames: List[GridFrame]) -> List[Optional[np.ndarray]]:
+        with self.lock:
+            # a reprocessed frame is a new file, so reopen it when the mtime changes
+            current = {}
+            for frame in frames:
+                try:
+                    mtime = os.stat(frame.path).st_mtime_ns
+                except FileNotFoundError:
+                    # expired since it was listed
+                    current[frame.path] = (None, None)
+                    continue
+                cached = self.open_frames.get(frame.path)
+                current[frame.path] = cached if cached is not None and cached[0] == mtime \
+                    else (mtime, self.store.read(frame))
+            self.open_frames = current
+            return [current[frame.path][1] for frame in frames]
+
+    def sample(
+            self,
+            lat: np.ndarray,
+            lon: np.ndarray,
+            start: Optional[datetime] = None,
+            end: Optional[datetime] = None
+    ) -> Tuple[List[datetime], np.ndarray]:
+        '''Returns (times, values) with values shaped (frames, points), NaN where there is no data.'''
+        lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+        lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+        frames = self.store.frames(start, end)
+        values = np.full((len(frames), len(lat)), np.nan, dtype=np.float32)
+
+        indices = {}
+        for i, (frame, grid) in enumerate(zip(frames, self._open(frames))):
+            if grid is None:
+                continue
+            if frame.grid_id not in indices:
+                try:
+                    spec = self.store.grid(frame.grid_id)
+                except KeyError:
+                    # its grid was expired along with the frame
+                    continue
+                rows, cols, valid = grid_indices(spec, lat, lon)
+                indices[frame.grid_id] = (rows[valid], cols[valid], valid)
+            rows, cols, valid = indices[frame.grid_id]
+            values[i, valid] = grid[rows, cols]
+        return [frame.datetime for frame in frames], values
+
+
+def to_json_values(values: np.ndarray) -> list:
+    '''Nested lists with None in place of NaN (which JSON can't represent).'''
+    out = values.astype(object)
+    out[np.isnan(values)] = None
+    return out.tolist()
@@ -0,0 +1,260 @@
+import logging
+import math
+import os
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+import numpy as np
+from PIL import Image
+from affine import Affine
+
+from utils.color_relief import colorize
+
+
+# Output pixels lie on a global lat/lon lattice with this spacing (degrees),
+# so per-site images line up with each other pixel for pixel.
+GRID_RES = 0.01
+MAX_RANGE_M = 460_000.0
+EARTH_RADIUS_M = 6_371_000.0
+AZIMUTH_BINS = 720          # 0.5 degree azimuth lookup resolution
+
+
+@dataclass
+class SiteGrid:
+    '''
+    Per-site polar lookup for an output grid around the radar: ground range
+    and azimuth bin of every pixel. Built once per site and reused for every scan.
+    '''
+    site_id: str
+    row_off: int                # offset of the window on the global lattice
+    col_off: int
+    transform: Affine
+    ground_range: np.ndarray    # (H, W) float32 meters
+    azimuth_bin: np.ndarray     # (H, W) uint16, index into AZIMUTH_BINS
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.ground_range.shape
+
+    @property
+    def bounds(self) -> Tuple[float, float, float, float]:
+        height, width = self.shape
+        left, top = self.transform.c, self.transform.f
+        return left, top - height * GRID_RES, left + width * GRID_RES, top
+
+
+_site_grids: Dict[Tuple[str, float, float, float], SiteGrid] = {}
+# When set, site grids are saved here as .npy and memory-mapped on load, so
+# worker processes share one page-cached copy instead of each building their own.
+_grid_cache_dir = None
+
+
+def set_grid_cache_dir(cache_dir: str):
+    global _grid_cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    _grid_cache_dir = cache_dir
+
+
+def site_window(lat: float, lon: float, max_range: float) -> Tuple[int, int, int, int]:
+    '''Returns (row_off, row_end, col_off, col_end) of the site window on the global lattice.'''
+    lat_extent = math.degrees(max_range / EARTH_RADIUS_M)
+    lon_extent = lat_extent / max(math.cos(math.radians(lat)), 0.01)
+
+    # snap the window to the global lattice (row 0 at 90N, col 0 at 180W)
+    row_off = int(math.floor((90.0 - (lat + lat_extent)) / GRID_RES))
+    row_end = int(math.ceil((90.0 - (lat - lat_extent)) / GRID_RES))
+    col_off = int(math.floor((lon - lon_extent + 180.0) / GRID_RES))
+    col_end = int(math.ceil((lon + lon_extent + 180.0) / GRID_RES))
+    return row_off, row_end, col_off, col_end
+
+
+def window_transform(row_off: int, col_off: int) -> Affine:
+    # same as rasterio.transform.from_origin, without importing rasterio in workers
+    return Affine.translation(-180.0 + col_off * GRID_RES, 90.0 - row_off * GRID_RES) * Affine.scale(GRID_RES, -GRID_RES)
+
+
+def build_site_grid(site_id: str, lat: float, lon: float, max_range: float = MAX_RANGE_M) -> SiteGrid:
+    row_off, row_end, col_off, col_end = site_window(lat, lon, max_range)
+
+    lats = 90.0 - (np.arange(row_off, row_end) + 0.5) * GRID_RES
+    lons = -180.0 + (np.arange(col_off, col_end) + 0.5) * GRID_RES
+
+    # great-circle distance and initial bearing from the radar to each pixel center
+    phi1 = math.radians(lat)
+    phi2 = np.radians(lats)[:, None]
+    dlon = np.radians(lons - lon)[None, :]
+    sin_dphi = np.sin((phi2 - phi1) / 2)
+    sin_dlon = np.sin(dlon / 2)
+    a = sin_dphi ** 2 + math.cos(phi1) * np.cos(phi2) * sin_dlon ** 2
+    ground_range = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+    y = np.sin(dlon) * np.cos(phi2)
+    x = math.cos(phi1) * np.sin(phi2) - math.sin(phi1) * np.cos(phi2) * np.cos(dlon)
+    azimuth = np.degrees(np.arctan2(y, x)) % 360.0
+    azimuth_bin = (np.floor(azimuth * AZIMUTH_BINS / 360.0).astype(np.int64) % AZIMUTH_BINS).astype(np.uint16)
+
+    transform = window_transform(row_off, col_off)
+    logging.info(f'Built polar index for {site_id}: {ground_range.shape[1]}x{ground_range.shape[0]} px')
+    return SiteGrid(
+        site_id=site_id,
+        row_off=row_off,
+        col_off=col_off,
+        transform=transform,
+        ground_range=ground_range.astype(np.float32),
+        azimuth_bin=azimuth_bin,
+    )
+
+
+def _grid_from_arrays(site_id, lat, lon, max_range, ground_range, azimuth_bin) -> SiteGrid:
+    row_off, _, col_off, _ = site_window(lat, lon, max_range)
+    return SiteGrid(site_id, row_off, col_off, window_transform(row_off, col_off), ground_range, azimuth_bin)
+
+
+def _load_or_build_site_grid(site_id: str, lat: float, lon: float, max_range: float) -> SiteGrid:
+    if _grid_cache_dir is None:
+        return build_site_grid(site_id, lat, lon, max_range)
+
+    name = f'{site_id}_{lat:.3f}_{lon:.3f}_{int(max_range)}'
+    range_path = os.path.join(_grid_cache_dir, f'{name}_range.npy')
+    azimuth_path = os.path.join(_grid_cache_dir, f'{name}_azimuth.npy')
+    if os.path.exists(range_path) and os.path.exists(azimuth_path):
+        return _grid_from_arrays(
+            site_id, lat, lon, max_range,
+            np.load(range_path, mmap_mode='r'), np.load(azimuth_path, mmap_mode='r')
+        )
+
+    site_grid = build_site_grid(site_id, lat, lon, max_range)
+    # write-then-rename so concurrent workers never read a partial file
+    for path, array in ((range_path, site_grid.ground_range), (azimuth_path, site_grid.azimuth_bin)):
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            np.save(f, array)
+        os.replace(temp_path, path)
+    return site_grid
+
+
+def get_site_grid(site_id: str, lat: float, lon: float, max_range: float = MAX_RANGE_M) -> SiteGrid:
+    lat, lon = round(lat, 3), round(lon, 3)
+    key = (site_id, lat, lon, max_range)
+    if key not in _site_grids:
+        _site_grids[key] = _load_or_build_site_grid(site_id, lat, lon, max_range)
+    return _site_grids[key]
+
+
+def preload_site_grids() -> int:
+    '''
+    Memory-maps every site grid already in the cache dir, keyed as
+    get_site_grid looks them up. Returns the number loaded.
+    '''
+    if _grid_cache_dir is None:
+        return 0
+    loaded = 0
+    for name in os.listdir(_grid_cache_dir):
+        # only complete pairs; a missing half would be rebuilt here
+        azimuth_name = name[:-len('_range.npy')] + '_azimuth.npy'
+        if not name.endswith('_range.npy') or not os.path.exists(os.path.join(_grid_cache_dir, azimuth_name)):
+            continue
+        try:
+            site_id, lat, lon, max_range, _ = name.rsplit('_', 4)
+            lat, lon, max_range = float(lat), float(lon), float(max_range)
+        except ValueError:
+            continue
+        key = (site_id, lat, lon, max_range)
+        if key in _site_grids:
+            continue
+        try:
+            _site_grids[key] = _load_or_build_site_grid(site_id, lat, lon, max_range)
+            loaded += 1
+        except (OSError, ValueError) as e:
+            logging.error(f'Error loading site grid {name}: {e}')
+    return loaded
+
+
+def azimuth_lookup(azimuths: np.ndarray) -> np.ndarray:
+    '''
+    Maps each azimuth bin to the nearest ray of this sweep (-1 where the
+    nearest ray is further than 1.5 ray spacings away, i.e. missing rays).
+    '''
+    order = np.argsort(azimuths)
+    sorted_az = azimuths[order]
+    spacing = 360.0 / len(azimuths)
+    centers = (np.arange(AZIMUTH_BINS) + 0.5) * 360.0 / AZIMUTH_BINS
+
+    # wrap around so bins near 0/360 can match rays on the other side
+    wrapped_az = np.concatenate([sorted_az[-1:] - 360.0, sorted_az, sorted_az[:1] + 360.0])
+    wrapped_order = np.concatenate([order[-1:], order, order[:1]])
+    upper = np.clip(np.searchsorted(wrapped_az, centers), 1, len(wrapped_az) - 1)
+    lower = upper - 1
+    use_upper = (wrapped_az[upper] - centers) < (centers - wrapped_az[lower])
+    nearest = np.where(use_upper, upper, lower)
+
+    lookup = wrapped_order[nearest].astype(np.int64)
+    lookup[np.abs(wrapped_az[nearest] - centers) > 1.5 * spacing] = -1
+    return lookup
+
+
+def rasterize_sweep(
+        site_grid: SiteGrid,
+        field: np.ndarray,
+        azimuths: np.ndarray,
+        first_gate: float,
+        gate_spacing: float,
+        elevation: float
+) -> np.ndarray:
+    '''
+    Maps a (rays, gates) sweep onto the site grid with one gather.
+    Returns float32 values with NaN where there is no valid gate.
+    '''
+    if np.ma.isMaskedArray(field):
+        field = np.ma.filled(field.astype(np.float32), np.nan)
+    field = np.asarray(field, dtype=np.float32)
+    n_gates = field.shape[1]
+
+    slant_range = site_grid.ground_range / np.float32(math.cos(math.radians(elevation)))
+    gate = np.rint((slant_range - first_gate) / gate_spacing).astype(np.int64)
+    ray = azimuth_lookup(np.asarray(azimuths, dtype=np.float64))[site_grid.azimuth_bin]
+
+    valid = (gate >= 0) & (gate < n_gates) & (ray >= 0)
+    values = np.full(site_grid.shape, np.nan, dtype=np.float32)
+    values[valid] = field[ray[valid], gate[valid]]
+    return values
+
+
+def rasterize_radar(radar, site_id: str, variable_name: str, sweep: int = 0) -> Tuple[np.ndarray, SiteGrid]:
+    '''Rasterizes one sweep of a Py-ART radar object onto its site grid.'''
+    lat = float(radar.latitude['data'][0])
+    lon = float(radar.longitude['data'][0])
+    site_grid = get_site_grid(site_id, lat, lon)
+
+    rays = radar.get_slice(sweep)
+    field = radar.fields[variable_name]['data'][rays]
+    azimuths = radar.azimuth['data'][rays]
+    elevation = float(np.mean(radar.elevation['data'][rays]))
+    gate_ranges = radar.range['data']
+    gate_spacing = float(gate_ranges[1] - gate_ranges[0])
+
+    values = rasterize_sweep(site_grid, field, azimuths, float(gate_ranges[0]), gate_spacing, elevation)
+    return values, site_grid
+
+
+def write_georeferenced_png(rgba: np.ndarray, transform: Affine, output_path: str):
+    '''Writes a transparent PNG with a `.pgw` world file next to it.'''
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    Image.fromarray(rgba, 'RGBA').save(output_path, format='PNG')
+
+    # world files reference the center of the top-left pixel
+    world_file = os.path.splitext(output_path)[0] + '.pgw'
+    with open(world_file, 'w') as f:
+        f.write('\n'.join(str(v) for v in (
+            transform.a, transform.d, transform.b, transform.e,
+            transform.c + transform.a / 2, transform.f + transform.e / 2,
+        )) + '\n')
+
+
+def render_ppi_png(
+        radar, site_id: str, variable_name: str, color_relief_file: str, output_path: str
+) -> Tuple[np.ndarray, SiteGrid]:
+    '''Renders sweep 0 to a georeferenced PNG. Returns the rasterized values and their site grid.'''
+    values, site_grid = rasterize_radar(radar, site_id, variable_name)
+    write_georeferenced_png(colorize(values, color_relief_file), site_grid.transform, output_path)
+    return values, site_grid
@@ -0,0 +1,145 @@
+import hashlib
+import logging
+import os
+from dataclasses import dataclass
+from typing import Dict, Tuple
+
+import numpy as np
+from affine import Affine
+
+
+@dataclass
+class AxisWeights:
+    '''Linear interpolation along one axis: out[i] = src[lo[i]] * (1 - w[i]) + src[hi[i]] * w[i].'''
+    lo: np.ndarray      # int32
+    hi: np.ndarray      # int32
+    w: np.ndarray       # float32, NaN where the target is outside the source axis
+
+
+@dataclass
+class RegridWeights:
+    '''Separable bilinear weights from a regular lat/lon source grid to a north-up target grid.'''
+    rows: AxisWeights
+    cols: AxisWeights
+    transform: Affine
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return len(self.rows.w), len(self.cols.w)
+
+
+# bumped whenever the weights computed for a grid change, so cached ones are rebuilt
+WEIGHTS_VERSION = 2
+_weights: Dict[str, RegridWeights] = {}
+# When set, weights are saved here as .npy so every worker (and every restart)
+# computes them once per source grid
+_cache_dir = None
+
+
+def set_regrid_cache_dir(cache_dir: str):
+    global _cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    _cache_dir = cache_dir
+
+
+def axis_weights(source: np.ndarray, target: np.ndarray) -> AxisWeights:
+    '''Interpolation indices and weights of target coordinates on a monotonic source axis.'''
+    source = np.asarray(source, dtype=np.float64)
+    target = np.asarray(target, dtype=np.float64)
+    order = np.argsort(source, kind='stable')
+    ascending = source[order]
+
+    # a target exactly on a source coordinate takes the interval to its left,
+    # as scipy (and so xarray's interp) does, so NaNs spread the same way
+    i = np.clip(np.searchsorted(ascending, target, side='left') - 1, 0, len(ascending) - 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w = (target - ascending[i]) / (ascending[i + 1] - ascending[i])
+    outside = (target < ascending[0]) | (target > ascending[-1])
+    w[outside] = np.nan
+    return AxisWeights(order[i].astype(np.int32), order[i + 1].astype(np.int32), w.astype(np.float32))
+
+
+def grid_signature(lat: np.ndarray, lon: np.ndarray, res: float) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for array in (np.ascontiguousarray(lat, dtype=np.float64), np.ascontiguousarray(lon, dtype=np.float64)):
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    digest.update(repr(float(res)).encode())
+    digest.update(f'v{WEIGHTS_VERSION}'.encode())
+    return digest.hexdigest()
+
+
+def build_regrid_weights(lat: np.ndarray, lon: np.ndarray, res: float) -> RegridWeights:
+    '''
+    Targets the same grid the xarray interp version did: np.arange(min, max, res)
+    on each axis, with rows flipped north-up, and a from_bounds transform over
+    the source extent.
+    '''
+    lon_min, lon_max = float(np.min(lon)), float(np.max(lon))
+    lat_min, lat_max = float(np.min(lat)), float(np.max(lat))
+    target_lon = np.arange(lon_min, lon_max, res)
+    target_lat = np.arange(lat_min, lat_max, res)[::-1]
+
+    height, width = len(target_lat), len(target_lon)
+    transform = Affine.translation(lon_min, lat_max) * \
+        Affine.scale((lon_max - lon_min) / width, (lat_min - lat_max) / height)
+    return RegridWeights(axis_weights(lat, target_lat), axis_weights(lon, target_lon), transform)
+
+
+def _save_weights(path_prefix: str, weights: RegridWeights):
+    arrays = {
+        'rows_index': np.stack([weights.rows.lo, weights.rows.hi]),
+        'rows_weight': weights.rows.w,
+        'cols_index': np.stack([weights.cols.lo, weights.cols.hi]),
+        'cols_weight': weights.cols.w,
+        'transform': np.array(weights.transform[:6], dtype=np.float64),
+    }
+    # write-then-rename so concurrent workers never read a partial file
+    for name, array in arrays.items():
+        path = f'{path_prefix}_{name}.npy'
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            np.save(f, array)
+        os.replace(temp_path, path)
+
+
+def _load_weights(path_prefix: str) -> RegridWeights:
+    def load(name):
+        return np.load(f'{path_prefix}_{name}.npy')
+    rows_index, cols_index = load('rows_index'), load('cols_index')
+    return RegridWeights(
+        AxisWeights(rows_index[0], rows_index[1], load('rows_weight')),
+        AxisWeights(cols_index[0], cols_index[1], load('cols_weight')),
+        Affine(*load('transform')),
+    )
+
+
+def get_regrid_weights(lat: np.ndarray, lon: np.ndarray, res: float) -> RegridWeights:
+    signature = grid_signature(lat, lon, res)
+    if signature in _weights:
+        return _weights[signature]
+
+    weights = None
+    path_prefix = os.path.join(_cache_dir, signature) if _cache_dir else None
+    if path_prefix and os.path.exists(f'{path_prefix}_transform.npy'):
+        try:
+            weights = _load_weights(path_prefix)
+        except Exception as e:
+            logging.error(f'Error loading regrid weights {path_prefix}: {e}')
+
+    if weights is None:
+        weights = build_regrid_weights(lat, lon, res)
+        logging.info(f'Built regrid weights for {len(lat)}x{len(lon)} -> {weights.shape[0]}x{weights.shape[1]} grid')
+        if path_prefix:
+            _save_weights(path_prefix, weights)
+
+    _weights[signature] = weights
+    return weights
+
+
+def apply_regrid(values: np.ndarray, weights: RegridWeights) -> np.ndarray:
+    '''Bilinear regrid as two gathers: along columns, then along rows. Returns float32.'''
+    values = np.asarray(values, dtype=np.float32)
+    cols, rows = weights.cols, weights.rows
+    along_cols = values[:, cols.lo] * (1 - cols.w) + values[:, cols.hi] * cols.w
+    return along_cols[rows.lo] * (1 - rows.w)[:, None] + along_cols[rows.hi] * rows.w[:, None]
@@ -0,0 +1,92 @@
+import logging
+import random
+import threading
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import List, Optional
+
+from utils.update_manager import SourceUpdater
+
+
+@dataclass
+class ScheduledSource:
+    updater: SourceUpdater
+    interval: timedelta
+    jitter: float = 0.1             # fraction of interval, applied +/- to each wait
+    max_backoff: timedelta = timedelta(hours=1)
+
+    def next_delay(self) -> float:
+        '''Seconds to wait before the next run, backing off exponentially after failures.'''
+        seconds = self.interval.total_seconds()
+        if self.updater.consecutive_failures:
+            seconds = min(
+                seconds * 2 ** self.updater.consecutive_failures,
+                max(self.max_backoff.total_seconds(), seconds)
+            )
+        return max(seconds * (1 + random.uniform(-self.jitter, self.jitter)), 1.0)
+
+
+class IngestScheduler:
+    '''
+    Runs each source's update on its own cadence in a background thread.
+    Runs go through SourceUpdater.run, so a refresh that is already in flight
+    (from another trigger) is skipped rather than duplicated.
+    '''
+    def __init__(self):
+        self.sources: List[ScheduledSource] = []
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._start_lock = threading.Lock()
+
+    def add(
+            self,
+            updater: SourceUpdater,
+            interval: timedelta,
+            jitter: float = 0.1,
+            max_backoff: Optional[timedelta] = None
+        ):
+        source = ScheduledSource(updater, interval, jitter)
+        if max_backoff is not None:
+            source.max_backoff = max_backoff
+        self.sources.append(source)
+
+    def start(self):
+        '''Starts the source threads; safe to call repeatedly and from several threads.'''
+        with self._start_lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            for source in self.sources:
+                thread = threading.Thread(
+                    target=self._loop, args=(source,),
+                    name=f'schedule-{source.updater.name}', daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+        logging.info(f'Ingest scheduler started for {len(self.sources)} sources')
+
+    def is_running(self) -> bool:
+        return bool(self._threads) and not self._stop.is_set()
+
+    def stop(self):
+        with self._start_lock:
+            self._stop.set()
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+
+    def _loop(self, source: ScheduledSource):
+        # stagger the first runs so sources don't all start at once
+        delay = random.uniform(0, source.jitter * source.interval.total_seconds())
+        while not self._stop.wait(delay):
+            logging.info(f'Scheduled update for {source.updater.name}')
+            try:
+                source.updater.run()
+            except Exception as e:
+                logging.error(f'Scheduled update for {source.updater.name} failed: {e}')
+            delay = source.next_delay()
+            if source.updater.consecutive_failures:
+                logging.info(
+                    f'{source.updater.name} failed {source.updater.consecutive_failures} time(s) in a row, '
+                    f'next attempt in {delay:.0f}s'
+                )
@@ -0,0 +1,208 @@
+import csv
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils.ppi_rasterizer import EARTH_RADIUS_M, MAX_RANGE_M
+
+
+ISD_HISTORY_FILE = './assets/isd-history.csv'
+NEXRAD_STATIONS_FILE = './assets/nexrad_stations.json'
+
+
+def lat_lon_to_xyz(lat, lon) -> np.ndarray:
+    '''Unit vectors on the sphere, so Euclidean (chord) distance orders points like great-circle distance.'''
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def check_lat_lon(lat, lon):
+    '''Raises ValueError unless every point is a finite latitude in [-90, 90] and longitude in [-180, 180].'''
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    if not (np.isfinite(lat).all() and np.isfinite(lon).all()):
+        raise ValueError('lat and lon must be finite numbers')
+    if (np.abs(lat) > 90).any() or (np.abs(lon) > 180).any():
+        raise ValueError('lat must be within [-90, 90] and lon within [-180, 180]')
+
+
+def chord_to_meters(chord):
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+
+def meters_to_chord(meters):
+    return 2 * np.sin(np.minimum(np.asarray(meters, dtype=np.float64) / EARTH_RADIUS_M, np.pi) / 2)
+
+
+class StationIndex:
+    '''
+    Stations as column arrays (at least id, name, latitude, longitude) with a
+    KD-tree over their positions as 3D unit vectors, which has no trouble at
+    the poles or the antimeridian. Queries return row indices into the columns.
+    '''
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        from scipy.spatial import cKDTree
+        self.columns = columns
+        self.latitude = columns['latitude']
+        self.longitude = columns['longitude']
+        self.tree = cKDTree(lat_lon_to_xyz(self.latitude, self.longitude))
+
+    def __len__(self) -> int:
+        return len(self.latitude)
+
+    def station(self, i: int) -> dict:
+        station = {name: values[i].item() for name, values in self.columns.items()}
+        # missing numbers (e.g. elevation) are NaN in the columns, None here
+        return {name: None if value != value else value for name, value in station.items()}
+
+    def stations(self, indices) -> List[dict]:
+        return [self.station(i) for i in indices]
+
+    def nearest(self, lat, lon, k: int = 1, max_distance_m: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        The k nearest stations to each point, as (distances_m, indices) shaped
+        like cKDTree.query's. Missing neighbours have an infinite distance and
+        index len(self). lat and lon may be scalars or arrays.
+        '''
+        check_lat_lon(lat, lon)
+        if max_distance_m is not None and not max_distance_m >= 0:
+            raise ValueError('max_distance_m must be a non-negative number')
+        upper = meters_to_chord(max_distance_m) if max_distance_m is not None else np.inf
+        chords, indices = self.tree.query(lat_lon_to_xyz(lat, lon), k=k, distance_upper_bound=upper)
+        distances = np.where(np.isinf(chords), np.inf, chord_to_meters(np.where(np.isinf(chords), 0, chords)))
+        return distances, indices
+
+    def within(self, lat: float, lon: float, radius_m: float) -> Tuple[np.ndarray, np.ndarray]:
+        '''Stations within radius_m of a point, nearest first, as (distances_m, indices).'''
+        check_lat_lon(lat, lon)
+        if not radius_m >= 0:
+            raise ValueError('radius_m must be a non-negative number')
+        point = lat_lon_to_xyz(lat, lon)
+        indices = np.asarray(self.tree.query_ball_point(point, meters_to_chord(radius_m)), dtype=np.int64)
+        distances = chord_to_meters(np.linalg.norm(self.tree.data[indices] - point, axis=1))
+        order = np.argsort(distances, kind='stable')
+        return distances[order], indices[order]
+
+    def in_bbox(self, west: float, south: float, east: float, north: float) -> np.ndarray:
+        '''Indices of stations in a lat/lon box; west > east means the box crosses the antimeridian.'''
+        in_lat = (self.latitude >= south) & (self.latitude <= north)
+        if west <= east:
+            in_lon = (self.longitude >= west) & (self.longitude <= east)
+        else:
+            in_lon = (self.longitude >= west) | (self.longitude <= east)
+        return np.nonzero(in_lat & in_lon)[0]
+
+    def save(self, path: str):
+        # write-then-rename so concurrent processes never read a partial file
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(f, **self.columns)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'StationIndex':
+        with np.load(path) as data:
+            return cls({name: data[name] for name in data.files})
+
+
+def read_isd_history(csv_path: str) -> Dict[str, np.ndarray]:
+    '''
+    Parses the ISD station history. Stations without a position, or with the
+    0,0 placeholder some entries use, are left out.
+    '''
+    rows = []
+    with open(csv_path, newline='') as f:
+        for row in csv.DictReader(f):
+            try:
+                lat, lon = float(row['LAT']), float(row['LON'])
+            except ValueError:
+                continue
+            if (lat == 0 and lon == 0) or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+                continue
+            elevation = float(row['ELEV(M)']) if row['ELEV(M)'] else np.nan
+            rows.append((
+                f"{row['USAF']}-{row['WBAN']}", row['STATION NAME'], row['ICAO'], row['CTRY'], row['STATE'],
+                lat, lon, elevation, row['END'],
+            ))
+
+    ids, names, icaos, countries, states, lats, lons, elevations, ends = zip(*rows)
+    return {
+        'id': np.array(ids),
+        'name': np.array(names),
+        'icao': np.array(icaos),
+        'country': np.array(countries),
+        'state': np.array(states),
+        'latitude': np.array(lats, dtype=np.float64),
+        'longitude': np.array(lons, dtype=np.float64),
+        'elevation_m': np.array(elevations, dtype=np.float64),
+        'end': np.array(ends),
+    }
+
+
+def read_nexrad_stations(json_path: str) -> Dict[str, np.ndarray]:
+    with open(json_path) as f:
+        stations = json.load(f)
+    return {
+        'id': np.array([station['id'] for station in stations]),
+        'name': np.array([station['name'] for station in stations]),
+        'latitude': np.array([station['latitude'] for station in stations], dtype=np.float64),
+        'longitude': np.array([station['longitude'] for station in stations], dtype=np.float64),
+    }
+
+
+def _cache_path(cache_dir: str, source_path: str) -> str:
+    # keyed by the source file's size and mtime, so an updated asset is reparsed
+    stat = os.stat(source_path)
+    digest = hashlib.blake2b(f'{stat.st_size}:{stat.st_mtime_ns}'.encode(), digest_size=8).hexdigest()
+    name = os.path.splitext(os.path.basename(source_path))[0]
+    return os.path.join(cache_dir, f'{name}_{digest}.npz')
+
+
+def load_station_index(source_path: str, reader, cache_dir: Optional[str] = None) -> StationIndex:
+    '''Builds an index from source_path with reader, through a parsed .npz cache in cache_dir.'''
+    cache_path = _cache_path(cache_dir, source_path) if cache_dir else None
+    if cache_path and os.path.exists(cache_path):
+        try:
+            return StationIndex.load(cache_path)
+        except Exception as e:
+            logging.error(f'Error loading station index {cache_path}: {e}')
+
+    index = StationIndex(reader(source_path))
+    logging.info(f'Built station index of {len(index)} stations from {source_path}')
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        index.save(cache_path)
+    return index
+
+
+_indexes: Dict[str, StationIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def _get_index(name: str, source_path: str, reader, cache_dir: Optional[str]) -> StationIndex:
+    with _indexes_lock:
+        if name not in _indexes:
+            _indexes[name] = load_station_index(source_path, reader, cache_dir)
+        return _indexes[name]
+
+
+def isd_index(cache_dir: Optional[str] = None, source_path: str = ISD_HISTORY_FILE) -> StationIndex:
+    '''The ISD surface station index, built once per process.'''
+    return _get_index('isd', source_path, read_isd_history, cache_dir)
+
+
+def nexrad_index(cache_dir: Optional[str] = None, source_path: str = NEXRAD_STATIONS_FILE) -> StationIndex:
+    '''The NEXRAD radar site index, built once per process.'''
+    return _get_index('nexrad', source_path, read_nexrad_stations, cache_dir)
+
+
+def radars_covering(lat: float, lon: float, max_range_m: float = MAX_RANGE_M, cache_dir: Optional[str] = None):
+    '''NEXRAD sites whose coverage (max_range_m) includes the point, nearest first, as (distances_m, indices).'''
+    return nexrad_index(cache_dir).within(lat, lon, max_range_m)
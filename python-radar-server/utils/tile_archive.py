@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+
+MBTILES_EXT = '.mbtiles'
+# open read connections kept around for serving, oldest evicted first
+MAX_OPEN_ARCHIVES = 64
+
+
+def is_tile_archive(path: str) -> bool:
+    return path.endswith(MBTILES_EXT)
+
+
+class MBTilesSink:
+    '''
+    Collects the tiles of one frame into a single MBTiles (SQLite) file.
+    Tiles are written to a hidden temp file in one transaction, which is
+    renamed into place on close, so readers never see a partial archive.
+    write() is safe to call from the pyramid's worker threads.
+    '''
+    def __init__(self, path: str, name: Optional[str] = None):
+        self.path = path
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        self.temp_path = os.path.join(directory, f'.{os.path.basename(path)}.{os.getpid()}.part')
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+        self.lock = threading.Lock()
+        self.zooms = set()
+        self.conn = sqlite3.connect(self.temp_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=OFF')
+        self.conn.execute('PRAGMA synchronous=OFF')
+        self.conn.execute('CREATE TABLE metadata (name TEXT, value TEXT)')
+        self.conn.execute(
+            'CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)'
+        )
+        self.conn.execute('BEGIN')
+        self.name = name or os.path.splitext(os.path.basename(path))[0]
+
+    def write(self, z: int, x: int, y: int, png: bytes):
+        # MBTiles rows count from the south (TMS), XYZ from the north
+        tile_row = (1 << z) - 1 - y
+        with self.lock:
+            self.conn.execute(
+                'INSERT INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)',
+                (z, x, tile_row, sqlite3.Binary(png))
+            )
+            self.zooms.add(z)
+
+    def close(self, coverage=None):
+        metadata = [('name', self.name), ('format', 'png'), ('type', 'overlay')]
+        if self.zooms:
+            metadata += [('minzoom', str(min(self.zooms))), ('maxzoom', str(max(self.zooms)))]
+        if coverage is not None:
+            metadata.append(('coverage', json.dumps(coverage.to_dict(), separators=(',', ':'))))
+        with self.lock:
+            self.conn.executemany('INSERT INTO metadata (name, value) VALUES (?, ?)', metadata)
+            self.conn.execute('CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)')
+            self.conn.commit()
+            self.conn.close()
+        os.replace(self.temp_path, self.path)
+
+    def discard(self):
+        with self.lock:
+            self.conn.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+class _ArchiveReader:
+    def __init__(self, path: str):
+        # archives are never modified in place (only replaced or deleted),
+        # so they can be opened immutable and read through mmap without locking
+        uri = f'file:{os.path.abspath(path)}?mode=ro&immutable=1'
+        self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self.conn.execute('PRAGMA mmap_size=268435456')
+        self.lock = threading.Lock()
+
+    def read(self, z: int, x: int, y: int) -> Optional[bytes]:
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?',
+                (z, x, (1 << z) - 1 - y)
+            ).fetchone()
+        return bytes(row[0]) if row else None
+
+    def metadata(self, name: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute('SELECT value FROM metadata WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_readers: 'OrderedDict[str, Tuple[Tuple[int, int], _ArchiveReader]]' = OrderedDict()
+_readers_lock = threading.Lock()
+
+
+def _get_reader(path: str) -> Optional[_ArchiveReader]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        evict_archive(path)
+        return None
+    # a replaced archive has a new inode, so reopen rather than read the old one
+    version = (stat.st_ino, stat.st_mtime_ns)
+
+    with _readers_lock:
+        cached = _readers.get(path)
+        if cached is not None and cached[0] == version:
+            _readers.move_to_end(path)
+            return cached[1]
+        if cached is not None:
+            cached[1].close()
+
+        reader = _ArchiveReader(path)
+        _readers[path] = (version, reader)
+        while len(_readers) > MAX_OPEN_ARCHIVES:
+            _, (_, oldest) = _readers.popitem(last=False)
+            oldest.close()
+        return reader
+
+
+def read_tile(path: str, z: int, x: int, y: int) -> Optional[bytes]:
+    '''Returns the PNG bytes of tile z/x/y (XYZ scheme) from an archive, or None.'''
+    reader = _get_reader(path)
+    if reader is None:
+        return None
+    try:
+        return reader.read(z, x, y)
+    except sqlite3.Error as e:
+        logging.error(f'Error reading tile {z}/{x}/{y} from {path}: {e}')
+        evict_archive(path)
+        return None
+
+
+def read_coverage(path: str) -> Optional[dict]:
+    '''Returns the archive's tile coverage bitmap (see TileCoverage.to_dict), or None.'''
+    reader = _get_reader(path)
+    if reader is None:
+        return None
+    value = reader.metadata('coverage')
+    return json.loads(value) if value else None
+
+
+def evict_archive(path: str):
+    '''Closes the cached reader for path, e.g. once the frame has expired.'''
+    with _readers_lock:
+        cached = _readers.pop(path, None)
+    if cached is not None:
+        cached[1].close()
@@ -0,0 +1,166 @@
+import io
+import json
+import logging
+import os
+import struct
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from utils.dynamic_tiles import DynamicTileCache
+from utils.tile_archive import is_tile_archive, read_tile
+from utils.tile_pyramid import TILE_SIZE, empty_tile_png, load_coverage
+from utils.tile_store import is_tile_index, tile_blob_path
+
+
+BUNDLE_MAGIC = b'RTB1'
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def read_frame_tile(
+        frame_path: str, z: int, x: int, y: int, dynamic_tiles: Optional[DynamicTileCache] = None
+) -> Optional[bytes]:
+    '''
+    Returns the PNG bytes of tile z/x/y of a frame in any tile format. Tiles
+    skipped as empty come back as the shared transparent tile, and zooms past
+    the pyramid are rendered through dynamic_tiles when given; None means the
+    frame has no such tile at all.
+    '''
+    png = None
+    if is_tile_archive(frame_path):
+        png = read_tile(frame_path, z, x, y)
+    elif is_tile_index(frame_path):
+        blob = tile_blob_path(frame_path, z, x, y)
+        if blob is not None and os.path.exists(blob):
+            with open(blob, 'rb') as f:
+                png = f.read()
+    else:
+        tile_path = os.path.join(frame_path, str(z), str(x), f'{y}.png')
+        if os.path.exists(tile_path):
+            with open(tile_path, 'rb') as f:
+                png = f.read()
+
+    if png is None:
+        coverage = load_coverage(frame_path)
+        if coverage is not None and coverage.covers_zoom(z):
+            if not coverage.has_data(z, x, y):
+                png = empty_tile_png()
+        elif dynamic_tiles is not None:
+            png = dynamic_tiles.get(frame_path, z, x, y)
+    return png
+
+
+@dataclass
+class _TileFrames:
+    '''Cached tile of every frame in the window for one z/x/y, plus the last packed outputs.'''
+    pngs: 'OrderedDict[str, Tuple[str, Optional[bytes]]]' = field(default_factory=OrderedDict)
+    packed: Dict[str, Tuple[tuple, bytes]] = field(default_factory=dict)
+
+    @property
+    def nbytes(self) -> int:
+        tiles = sum(len(png) for _, png in self.pngs.values() if png)
+        return tiles + sum(len(data) for _, data in self.packed.values())
+
+
+class TileBundleCache:
+    '''
+    Packs one tile's frames across the animation window into a single
+    response. Entries are updated incrementally: when the frame list changes,
+    only the new frames' tiles are read and expired ones dropped. Entries are
+    evicted least-recently-used once the cache holds more than max_bytes.
+    '''
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES, dynamic_tiles: Optional[DynamicTileCache] = None):
+        self.max_bytes = max_bytes
+        self.dynamic_tiles = dynamic_tiles
+        self.entries: 'OrderedDict[tuple, _TileFrames]' = OrderedDict()
+        self.lock = threading.Lock()
+        self.nbytes = 0
+
+    def _update(self, entry: _TileFrames, frames: List[Tuple[str, str]], z: int, x: int, y: int):
+        pngs = OrderedDict()
+        for processed_loc, time in frames:
+            cached = entry.pngs.get(processed_loc)
+            # only tiles that were found are kept: a read that failed, or found
+            # nothing because the frame isn't fully written yet, is retried
+            if cached is None or cached[1] is None:
+                png = None
+                try:
+                    png = read_frame_tile(processed_loc, z, x, y, self.dynamic_tiles)
+                except Exception as e:
+                    logging.error(f'Error reading tile {z}/{x}/{y} of {processed_loc}: {e}')
+                cached = (time, png)
+            pngs[processed_loc] = cached
+        # frames no longer in the window drop out here
+        entry.pngs = pngs
+
+    def _get(self, kind: str, pack, source: str, frames: List[Tuple[str, str]], z: int, x: int, y: int):
+        key = (source, z, x, y)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.nbytes -= entry.nbytes
+        if entry is None:
+            entry = _TileFrames()
+
+        self._update(entry, frames, z, x, y)
+        # repacked when a frame comes or goes, or a missing tile turns up
+        frames_key = tuple((processed_loc, png is not None) for processed_loc, (_, png) in entry.pngs.items())
+        cached = entry.packed.get(kind)
+        if cached is None or cached[0] != frames_key:
+            cached = (frames_key, pack(entry))
+            entry.packed[kind] = cached
+
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous.nbytes
+            self.entries[key] = entry
+            self.nbytes += entry.nbytes
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return cached[1], [time for time, _ in entry.pngs.values()]
+
+    def bundle(self, source: str, frames: List[Tuple[str, str]], z: int, x: int, y: int) -> Tuple[bytes, List[str]]:
+        '''
+        Returns (bundle, times). The bundle is `RTB1`, a big-endian uint32
+        header length, a JSON header listing each frame's time, offset and
+        length (length 0 for frames without this tile), then the PNGs back to back.
+        '''
+        return self._get(
+            'bundle', lambda entry: pack_bundle(entry.pngs.values(), z, x, y), source, frames, z, x, y
+        )
+
+    def strip(self, source: str, frames: List[Tuple[str, str]], z: int, x: int, y: int) -> Tuple[bytes, List[str]]:
+        '''Returns (png, times): the frames side by side, oldest first, in one 256*n x 256 PNG.'''
+        return self._get(
+            'strip', lambda entry: pack_strip([png for _, png in entry.pngs.values()]), source, frames, z, x, y
+        )
+
+
+def pack_bundle(frames, z: int, x: int, y: int) -> bytes:
+    header_frames = []
+    body = io.BytesIO()
+    for time, png in frames:
+        length = len(png) if png else 0
+        header_frames.append({'time': time, 'offset': body.tell(), 'length': length})
+        if png:
+            body.write(png)
+    header = json.dumps({'z': z, 'x': x, 'y': y, 'frames': header_frames}, separators=(',', ':')).encode()
+    return BUNDLE_MAGIC + struct.pack('>I', len(header)) + header + body.getvalue()
+
+
+def pack_strip(pngs: List[Optional[bytes]], tile_size: int = TILE_SIZE) -> bytes:
+    strip = np.zeros((tile_size, tile_size * max(len(pngs), 1), 4), dtype=np.uint8)
+    for i, png in enumerate(pngs):
+        if not png:
+            continue
+        with Image.open(io.BytesIO(png)) as image:
+            strip[:, i * tile_size:(i + 1) * tile_size] = np.asarray(image.convert('RGBA'))
+    buffer = io.BytesIO()
+    Image.fromarray(strip, 'RGBA').save(buffer, format='PNG')
+    return buffer.getvalue()
@@ -0,0 +1,415 @@
+import base64
+import io
+import json
+import logging
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+TILE_SIZE = 256
+# Half the width of the EPSG:3857 world in meters
+ORIGIN_SHIFT = 2 * math.pi * 6378137 / 2.0
+DEFAULT_ZOOMS = range(0, 6)
+
+
+def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    '''Returns (left, bottom, right, top) in EPSG:3857 meters for an XYZ tile.'''
+    tile_width = 2 * ORIGIN_SHIFT / (2 ** z)
+    left = -ORIGIN_SHIFT + x * tile_width
+    top = ORIGIN_SHIFT - y * tile_width
+    return left, top - tile_width, left + tile_width, top
+
+
+def tile_range(bounds: Tuple[float, float, float, float], z: int) -> Tuple[int, int, int, int]:
+    '''Returns the inclusive (x_min, x_max, y_min, y_max) XYZ tiles covering bounds at zoom z.'''
+    left, bottom, right, top = bounds
+    n = 2 ** z
+    tile_width = 2 * ORIGIN_SHIFT / n
+
+    def to_index(value):
+        return min(max(int(math.floor(value)), 0), n - 1)
+
+    x_min = to_index((left + ORIGIN_SHIFT) / tile_width)
+    x_max = to_index((right + ORIGIN_SHIFT) / tile_width - 1e-9)
+    y_min = to_index((ORIGIN_SHIFT - top) / tile_width)
+    y_max = to_index((ORIGIN_SHIFT - bottom) / tile_width - 1e-9)
+    return x_min, x_max, y_min, y_max
+
+
+def raster_bounds(shape: Tuple[int, int], transform) -> Tuple[float, float, float, float]:
+    height, width = shape[:2]
+    left, top = transform.c, transform.f
+    right = left + transform.a * width
+    bottom = top + transform.e * height
+    return left, bottom, right, top
+
+
+def box_average(tile: np.ndarray, tile_size: int, factor: int) -> np.ndarray:
+    '''
+    Averages factor x factor blocks of an RGBA array down to tile_size,
+    alpha weighted so transparent pixels don't darken edges.
+    '''
+    blocks = tile.reshape(tile_size, factor, tile_size, factor, 4).astype(np.float32)
+    alpha = blocks[..., 3]
+    alpha_sum = alpha.sum(axis=(1, 3))
+    out = np.empty((tile_size, tile_size, 4), dtype=np.float32)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for band in range(3):
+            weighted = (blocks[..., band] * alpha).sum(axis=(1, 3))
+            out[..., band] = np.where(alpha_sum > 0, weighted / alpha_sum, 0)
+    out[..., 3] = alpha_sum / (factor * factor)
+    return np.rint(out).astype(np.uint8)
+
+
+def render_tile(
+        rgba: np.ndarray,
+        transform,
+        z: int, x: int, y: int,
+        tile_size: int = TILE_SIZE,
+        oversample: int = 4
+) -> np.ndarray:
+    '''
+    Renders one tile from a north-up EPSG:3857 RGBA array. Like gdal2tiles,
+    the source is sampled at up to `oversample` times the tile resolution and
+    then box-averaged down. Oversampling is capped at the number of source
+    pixels per tile pixel, since sampling finer than the source adds nothing.
+    '''
+    left, bottom, right, top = tile_bounds(z, x, y)
+    source_res = min(abs(transform.a), abs(transform.e))
+    oversample = max(1, min(oversample, math.ceil((right - left) / tile_size / source_res)))
+    n = tile_size * oversample
+    res = (right - left) / n
+    centers = (np.arange(n) + 0.5) * res
+
+    cols = np.floor((left + centers - transform.c) / transform.a).astype(np.int64)
+    rows = np.floor((top - centers - transform.f) / transform.e).astype(np.int64)
+    valid_cols = (cols >= 0) & (cols < rgba.shape[1])
+    valid_rows = (rows >= 0) & (rows < rgba.shape[0])
+
+    tile = np.zeros((n, n, 4), dtype=np.uint8)
+    if valid_cols.any() and valid_rows.any():
+        row_idx = np.nonzero(valid_rows)[0]
+        col_idx = np.nonzero(valid_cols)[0]
+        tile[row_idx[:, None], col_idx[None, :]] = rgba[rows[row_idx][:, None], cols[col_idx][None, :]]
+
+    if oversample == 1:
+        return tile
+    return box_average(tile, tile_size, oversample)
+
+
+def overview_tile(children, tile_size: int = TILE_SIZE) -> np.ndarray:
+    '''
+    Builds a tile from its four children, given as [top-left, top-right,
+    bottom-left, bottom-right] with None for empty ones, by averaging each
+    2x2 block as gdal2tiles does for its overview levels.
+    '''
+    canvas = np.zeros((2 * tile_size, 2 * tile_size, 4), dtype=np.uint8)
+    for i, child in enumerate(children):
+        if child is not None:
+            row, col = divmod(i, 2)
+            canvas[row * tile_size:(row + 1) * tile_size, col * tile_size:(col + 1) * tile_size] = child
+    return box_average(canvas, tile_size, 2)
+
+
+def encode_png(tile: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(tile, 'RGBA').save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+@lru_cache(maxsize=None)
+def empty_tile_png(tile_size: int = TILE_SIZE) -> bytes:
+    '''The fully transparent tile, encoded once and shared by every frame.'''
+    return encode_png(np.zeros((tile_size, tile_size, 4), dtype=np.uint8))
+
+
+def source_window_is_empty(rgba: np.ndarray, transform, z: int, x: int, y: int) -> bool:
+    '''True if no source pixel under the tile has any alpha, checked before rendering.'''
+    left, bottom, right, top = tile_bounds(z, x, y)
+    col_start = max(int(math.floor((left - transform.c) / transform.a)), 0)
+    col_end = min(int(math.ceil((right - transform.c) / transform.a)), rgba.shape[1])
+    row_start = max(int(math.floor((top - transform.f) / transform.e)), 0)
+    row_end = min(int(math.ceil((bottom - transform.f) / transform.e)), rgba.shape[0])
+    if col_start >= col_end or row_start >= row_end:
+        return True
+    return not rgba[row_start:row_end, col_start:col_end, 3].any()
+
+
+class TileCoverage:
+    '''
+    Per-frame sparse-coverage bitmap: for each zoom, one bit per tile in the
+    pyramid's tile range, set when the tile has data. Tiles without a bit
+    were skipped as fully transparent (or lie outside the raster).
+    '''
+    def __init__(self, ranges: Dict[int, Tuple[int, int, int, int]]):
+        self.ranges = dict(ranges)
+        self.bits = {
+            z: np.zeros((y_max - y_min + 1, x_max - x_min + 1), dtype=bool)
+            for z, (x_min, x_max, y_min, y_max) in self.ranges.items()
+        }
+
+    def mark(self, z: int, x: int, y: int):
+        x_min, _, y_min, _ = self.ranges[z]
+        self.bits[z][y - y_min, x - x_min] = True
+
+    def has_data(self, z: int, x: int, y: int) -> bool:
+        if z not in self.ranges:
+            return False
+        x_min, x_max, y_min, y_max = self.ranges[z]
+        if not (x_min <= x <= x_max and y_min <= y <= y_max):
+            return False
+        return bool(self.bits[z][y - y_min, x - x_min])
+
+    def covers_zoom(self, z: int) -> bool:
+        return z in self.ranges
+
+    def count(self) -> int:
+        return int(sum(bits.sum() for bits in self.bits.values()))
+
+    def to_dict(self) -> dict:
+        return {
+            str(z): {
+                'range': list(self.ranges[z]),
+                'bits': base64.b64encode(np.packbits(bits).tobytes()).decode('ascii'),
+            }
+            for z, bits in self.bits.items()
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'TileCoverage':
+        coverage = cls({int(z): tuple(entry['range']) for z, entry in data.items()})
+        for z, entry in data.items():
+            bits = coverage.bits[int(z)]
+            packed = np.frombuffer(base64.b64decode(entry['bits']), dtype=np.uint8)
+            bits[:] = np.unpackbits(packed, count=bits.size).reshape(bits.shape).astype(bool)
+        return coverage
+
+
+COVERAGE_FILE = 'coverage.json'
+
+
+class DirectoryTileSink:
+    '''Writes tiles as a `{z}/{x}/{y}.png` directory tree.'''
+    def __init__(self, output_tiles: str):
+        self.output_tiles = output_tiles
+        os.makedirs(output_tiles, exist_ok=True)
+
+    def write(self, z: int, x: int, y: int, png: bytes):
+        tile_dir = os.path.join(self.output_tiles, str(z), str(x))
+        os.makedirs(tile_dir, exist_ok=True)
+        with open(os.path.join(tile_dir, f'{y}.png'), 'wb') as f:
+            f.write(png)
+
+    def close(self, coverage: Optional[TileCoverage] = None):
+        if coverage is not None:
+            with open(os.path.join(self.output_tiles, COVERAGE_FILE), 'w') as f:
+                json.dump(coverage.to_dict(), f, separators=(',', ':'))
+
+    def discard(self):
+        pass
+
+
+def open_tile_sink(output_tiles: str):
+    '''
+    Picks the output format from the path: `*.mbtiles` is a single-file
+    archive, `*.tiles` an index into the source's deduplicated tile store,
+    anything else a directory.
+    '''
+    from utils.tile_archive import MBTilesSink, is_tile_archive
+    from utils.tile_store import TileStoreSink, is_tile_index
+    if is_tile_archive(output_tiles):
+        return MBTilesSink(output_tiles)
+    if is_tile_index(output_tiles):
+        return TileStoreSink(output_tiles)
+    return DirectoryTileSink(output_tiles)
+
+
+def _coverage_from_file(path: str) -> TileCoverage:
+    with open(path) as f:
+        return TileCoverage.from_dict(json.load(f))
+
+
+_coverages: Dict[str, Tuple[int, Optional[TileCoverage]]] = {}
+_coverages_lock = threading.Lock()
+
+
+def load_coverage(frame_path: str) -> Optional[TileCoverage]:
+    '''Returns a frame's coverage bitmap (any tile format), or None if it has none.'''
+    from utils.tile_archive import is_tile_archive, read_coverage as read_archive_coverage
+    from utils.tile_store import is_tile_index, read_coverage as read_index_coverage
+
+    if is_tile_archive(frame_path) or is_tile_index(frame_path):
+        stat_path = frame_path
+    else:
+        stat_path = os.path.join(frame_path, COVERAGE_FILE)
+    try:
+        mtime = os.stat(stat_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    with _coverages_lock:
+        cached = _coverages.get(frame_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    if is_tile_archive(frame_path):
+        data = read_archive_coverage(frame_path)
+        coverage = TileCoverage.from_dict(data) if data else None
+    elif is_tile_index(frame_path):
+        data = read_index_coverage(frame_path)
+        coverage = TileCoverage.from_dict(data) if data else None
+    else:
+        coverage = _coverage_from_file(stat_path)
+
+    with _coverages_lock:
+        # frames expire, so drop entries for frames that are gone
+        for path in [path for path in _coverages if not os.path.exists(path)]:
+            del _coverages[path]
+        _coverages[frame_path] = (mtime, coverage)
+    return coverage
+
+
+def _child_tiles(z: int, x: int, y: int):
+    # in overview_tile's order
+    return [(z + 1, 2 * x + dx, 2 * y + dy) for dy in (0, 1) for dx in (0, 1)]
+
+
+def _write_tile(sink, coverage, zooms, z, x, y, tile) -> Optional[np.ndarray]:
+    # fully transparent tiles are neither encoded nor written
+    if tile is None or not tile[..., 3].any():
+        return None
+    if z in zooms:
+        sink.write(z, x, y, encode_png(tile))
+        coverage.mark(z, x, y)
+    return tile
+
+
+def _render_subtree(rgba, transform, sink, coverage, zooms, max_zoom, z, x, y) -> Optional[np.ndarray]:
+    '''
+    Writes tile z/x/y and everything under it down to max_zoom, and returns
+    the tile (None if empty). Only max_zoom is rendered from the source;
+    each level above is built from the four tiles below it.
+    '''
+    # an empty source window means the whole subtree is empty
+    if source_window_is_empty(rgba, transform, z, x, y):
+        return None
+    if z == max_zoom:
+        tile = render_tile(rgba, transform, z, x, y)
+    else:
+        children = [
+            _render_subtree(rgba, transform, sink, coverage, zooms, max_zoom, *child)
+            for child in _child_tiles(z, x, y)
+        ]
+        tile = overview_tile(children) if any(child is not None for child in children) else None
+    return _write_tile(sink, coverage, zooms, z, x, y, tile)
+
+
+def generate_tile_pyramid(
+        rgba: np.ndarray,
+        transform,
+        output_tiles: str,
+        zooms: Iterable[int] = DEFAULT_ZOOMS,
+        max_workers: Optional[int] = None,
+        save_raster: Optional[bool] = None
+) -> int:
+    '''
+    Writes an XYZ pyramid for an (H, W, 4) uint8 EPSG:3857 array with the
+    given affine transform, as `{z}/{x}/{y}.png` files, one `.mbtiles`
+    archive or a `.tiles` tile-store index (see open_tile_sink). As in
+    gdal2tiles, only the deepest zoom is rendered from the raster; each
+    shallower zoom is averaged down from the four tiles below it. Subtrees
+    are rendered and PNG-encoded on a thread pool; NumPy and Pillow's
+    encoder both release the GIL.
+
+    Fully transparent tiles are not encoded or written; the frame gets a
+    TileCoverage bitmap instead, so the server can answer them with one
+    shared empty tile. Returns the number of tiles written.
+
+    With save_raster (by default, when RADAR_DYNAMIC_TILES=1) the EPSG:3857
+    raster is also kept so deeper zooms can be rendered on request (see
+    utils.dynamic_tiles).
+    '''
+    zooms = set(zooms)
+    bounds = raster_bounds(rgba.shape, transform)
+    ranges = {z: tile_range(bounds, z) for z in sorted(zooms)}
+    coverage = TileCoverage(ranges)
+    sink = open_tile_sink(output_tiles)
+    if not zooms:
+        sink.close(coverage)
+        return 0
+
+    min_zoom, max_zoom = min(zooms), max(zooms)
+    max_workers = max_workers or os.cpu_count()
+
+    def tiles_at(z):
+        x_min, x_max, y_min, y_max = tile_range(bounds, z)
+        return [(x, y) for x in range(x_min, x_max + 1) for y in range(y_min, y_max + 1)]
+
+    # subtrees are rendered in parallel from the first zoom with enough of
+    # them to keep the workers busy; the few tiles above are built after
+    split_zoom = next(
+        (z for z in range(min_zoom, max_zoom + 1) if len(tiles_at(z)) >= 4 * max_workers), max_zoom
+    )
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                (x, y): executor.submit(
+                    _render_subtree, rgba, transform, sink, coverage, zooms, max_zoom, split_zoom, x, y
+                )
+                for x, y in tiles_at(split_zoom)
+            }
+            level = {xy: future.result() for xy, future in futures.items()}
+
+        for z in range(split_zoom - 1, min_zoom - 1, -1):
+            parents = {}
+            for x, y in tiles_at(z):
+                children = [level.get((child_x, child_y)) for _, child_x, child_y in _child_tiles(z, x, y)]
+                tile = overview_tile(children) if any(child is not None for child in children) else None
+                parents[(x, y)] = _write_tile(sink, coverage, zooms, z, x, y, tile)
+            level = parents
+        sink.close(coverage)
+    except Exception:
+        sink.discard()
+        raise
+
+    tile_count = sum(
+        (x_max - x_min + 1) * (y_max - y_min + 1) for x_min, x_max, y_min, y_max in ranges.values()
+    )
+    written = coverage.count()
+    logging.info(f'Wrote {written} tiles to {output_tiles} ({tile_count - written} empty tiles skipped)')
+
+    from utils.dynamic_tiles import dynamic_tiles_enabled, save_frame_raster
+    if save_raster is None:
+        save_raster = dynamic_tiles_enabled()
+    if save_raster:
+        try:
+            save_frame_raster(output_tiles, rgba, transform)
+        except Exception as e:
+            # the pre-rendered zooms are still served without it
+            logging.error(f'Error saving frame raster for {output_tiles}: {e}')
+    return written
+
+
+def to_rgba(bands: np.ndarray) -> np.ndarray:
+    '''Converts a (count, H, W) uint8 band stack to an (H, W, 4) RGBA array.'''
+    count = bands.shape[0]
+    if count == 4:
+        return np.ascontiguousarray(np.moveaxis(bands, 0, -1))
+
+    rgba = np.empty(bands.shape[1:] + (4,), dtype=np.uint8)
+    if count == 3:
+        rgba[..., :3] = np.moveaxis(bands, 0, -1)
+        rgba[..., 3] = 255
+    elif count in (1, 2):
+        rgba[..., :3] = bands[0][..., None]
+        rgba[..., 3] = bands[1] if count == 2 else 255
+    else:
+        raise ValueError(f'Unsupported band count for tiling: {count}')
+    return rgba
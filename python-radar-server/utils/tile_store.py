@@ -0,0 +1,277 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+
+TILE_INDEX_EXT = '.tiles'
+BLOB_DIR_NAME = '.blobs'
+# parsed frame indexes kept in memory for serving
+MAX_CACHED_INDEXES = 128
+
+
+def is_tile_index(path: str) -> bool:
+    return path.endswith(TILE_INDEX_EXT)
+
+
+def tile_hash(png: bytes) -> str:
+    return hashlib.blake2b(png, digest_size=16).hexdigest()
+
+
+def store_root_for_index(index_path: str) -> str:
+    '''Frames share the store that sits next to them (hidden, so directory listings skip it).'''
+    return os.path.join(os.path.dirname(index_path) or '.', BLOB_DIR_NAME)
+
+
+def blob_path(store_root: str, digest: str) -> str:
+    return os.path.join(store_root, digest[:2], f'{digest}.png')
+
+
+class TileStore:
+    '''
+    Content-addressed PNG blobs shared by every frame of a source. Each
+    unique tile payload is stored once under `{hash[:2]}/{hash}.png`, with a
+    SQLite table counting how many frame indexes reference it.
+
+    Blob writes and deletes both happen inside an IMMEDIATE transaction on the
+    refcount table, so a frame being committed in one process can never have
+    its blobs garbage collected by an expiry running in another.
+    '''
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.db_path = os.path.join(root, 'refcounts.sqlite3')
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, refcount INTEGER NOT NULL)')
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # short-lived connections: stores are used from worker processes too
+        return sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+
+    def blob_path(self, digest: str) -> str:
+        return blob_path(self.root, digest)
+
+    def _write_blob(self, digest: str, png: bytes):
+        path = self.blob_path(digest)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(png)
+        os.replace(temp_path, path)
+
+    def add_frame(self, blobs: Dict[str, bytes]):
+        '''Takes one reference on each blob (digest -> png), writing any that are missing.'''
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(
+                'INSERT INTO blobs (hash, refcount) VALUES (?, 1) '
+                'ON CONFLICT(hash) DO UPDATE SET refcount = refcount + 1',
+                [(digest,) for digest in blobs]
+            )
+            for digest, png in blobs.items():
+                self._write_blob(digest, png)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+    def release_frame(self, digests) -> int:
+        '''Drops one reference on each blob and deletes unreferenced ones. Returns the number deleted.'''
+        digests = list(set(digests))
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany('UPDATE blobs SET refcount = refcount - 1 WHERE hash = ?', [(d,) for d in digests])
+            unreferenced = [row[0] for row in conn.execute('SELECT hash FROM blobs WHERE refcount <= 0')]
+            for digest in unreferenced:
+                try:
+                    os.remove(self.blob_path(digest))
+                except FileNotFoundError:
+                    pass
+            conn.execute('DELETE FROM blobs WHERE refcount <= 0')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return len(unreferenced)
+
+    def sweep(self, index_paths) -> int:
+        '''
+        Recomputes every refcount from the live frame indexes and deletes the
+        blobs none of them reference, undoing references leaked by a process
+        that died mid-commit. Only safe while no frame is being written to the
+        store, e.g. at startup. Returns the number of blobs deleted.
+        '''
+        refcounts: Dict[str, int] = {}
+        for index_path in index_paths:
+            try:
+                digests = set(read_index(index_path).values())
+            except (OSError, ValueError, KeyError) as e:
+                logging.error(f'Error reading tile index {index_path}: {e}')
+                continue
+            for digest in digests:
+                refcounts[digest] = refcounts.get(digest, 0) + 1
+
+        deleted = 0
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM blobs')
+            conn.executemany('INSERT INTO blobs (hash, refcount) VALUES (?, ?)', refcounts.items())
+            for dirpath, _, names in os.walk(self.root):
+                # the refcount db sits at the root, blobs one level down
+                if dirpath == self.root:
+                    continue
+                for name in names:
+                    if name.endswith('.png') and name[:-len('.png')] in refcounts:
+                        continue
+                    os.remove(os.path.join(dirpath, name))
+                    deleted += 1
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        logging.info(f'Swept tile store {self.root}: {len(refcounts)} blobs referenced, {deleted} files deleted')
+        return deleted
+
+
+def store_for_index(index_path: str) -> TileStore:
+    return TileStore(store_root_for_index(index_path))
+
+
+class TileStoreSink:
+    '''
+    Tile pyramid sink that hashes each encoded tile, stores unique payloads
+    in the frame's TileStore and writes a `{"z/x/y": hash}` index as the frame.
+    '''
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        self.lock = threading.Lock()
+        self.index: Dict[str, str] = {}
+        self.blobs: Dict[str, bytes] = {}
+
+    def write(self, z: int, x: int, y: int, png: bytes):
+        digest = tile_hash(png)
+        with self.lock:
+            self.index[f'{z}/{x}/{y}'] = digest
+            self.blobs.setdefault(digest, png)
+
+    def close(self, coverage=None):
+        store = store_for_index(self.index_path)
+        # re-committing a frame replaces its index, whose references are released below
+        try:
+            previous_digests = set(read_index(self.index_path).values())
+        except (OSError, ValueError, KeyError):
+            previous_digests = None
+        store.add_frame(self.blobs)
+        temp_path = os.path.join(
+            os.path.dirname(self.index_path) or '.', f'.{os.path.basename(self.index_path)}.{os.getpid()}.part'
+        )
+        try:
+            with open(temp_path, 'w') as f:
+                document = {'tiles': self.index}
+                if coverage is not None:
+                    document['coverage'] = coverage.to_dict()
+                json.dump(document, f, separators=(',', ':'))
+            os.replace(temp_path, self.index_path)
+        except Exception:
+            store.release_frame(self.blobs)
+            raise
+        if previous_digests is not None:
+            store.release_frame(previous_digests)
+        logging.info(f'{len(self.index)} tiles stored as {len(self.blobs)} unique blobs for {self.index_path}')
+
+    def discard(self):
+        self.index.clear()
+        self.blobs.clear()
+
+
+def read_index(index_path: str) -> Dict[str, str]:
+    with open(index_path) as f:
+        return json.load(f)['tiles']
+
+
+def read_coverage(index_path: str) -> Optional[dict]:
+    '''Returns the frame's tile coverage bitmap (see TileCoverage.to_dict), or None.'''
+    with open(index_path) as f:
+        return json.load(f).get('coverage')
+
+
+_indexes: 'OrderedDict[str, Tuple[int, Dict[str, str]]]' = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def tile_blob_path(index_path: str, z: int, x: int, y: int) -> Optional[str]:
+    '''Returns the blob file holding tile z/x/y of a frame, or None.'''
+    try:
+        mtime = os.stat(index_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+    with _indexes_lock:
+        cached = _indexes.get(index_path)
+        if cached is not None and cached[0] == mtime:
+            _indexes.move_to_end(index_path)
+            index = cached[1]
+        else:
+            index = None
+
+    if index is None:
+        index = read_index(index_path)
+        with _indexes_lock:
+            _indexes[index_path] = (mtime, index)
+            while len(_indexes) > MAX_CACHED_INDEXES:
+                _indexes.popitem(last=False)
+
+    digest = index.get(f'{z}/{x}/{y}')
+    if digest is None:
+        return None
+    return blob_path(store_root_for_index(index_path), digest)
+
+
+def remove_frame(index_path: str):
+    '''Deletes a frame index and releases its blobs from the store.'''
+    with _indexes_lock:
+        _indexes.pop(index_path, None)
+    try:
+        digests = read_index(index_path).values()
+    except FileNotFoundError:
+        return
+    deleted = store_for_index(index_path).release_frame(digests)
+    os.remove(index_path)
+    logging.info(f'Removed tile index {index_path} ({deleted} blobs freed)')
+
+
+def sweep_frames_dir(frames_dir: str) -> int:
+    '''
+    Sweeps the store shared by the frame indexes in frames_dir (see
+    TileStore.sweep), first deleting indexes a crash left half-written.
+    '''
+    store_root = os.path.join(frames_dir, BLOB_DIR_NAME)
+    if not os.path.isdir(store_root):
+        return 0
+    index_paths = []
+    for name in os.listdir(frames_dir):
+        path = os.path.join(frames_dir, name)
+        if name.startswith('.') and name.endswith('.part') and TILE_INDEX_EXT in name:
+            os.remove(path)
+        elif is_tile_index(name) and not name.startswith('.'):
+            index_paths.append(path)
+    return TileStore(store_root).sweep(index_paths)
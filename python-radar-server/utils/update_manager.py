@@ -0,0 +1,128 @@
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+
+from data_source import DataSource
+
+
+class SourceUpdater:
+    '''
+    Owns the update lock for one data source and runs `update_data` in a
+    background thread, so requests can return the last published frame list
+    immediately (stale-while-revalidate) while different sources refresh in
+    parallel.
+
+    The data source is built by data_source_factory on first use, so
+    importing the server doesn't construct (or import the stack of) every
+    source. Call warm() at startup so that isn't a request thread.
+    '''
+    def __init__(
+            self,
+            name: str,
+            data_source_factory: Callable[[], DataSource],
+            publishers: Optional[Dict[str, Callable[[DataSource], Any]]] = None
+        ):
+        self.name = name
+        self.data_source_factory = data_source_factory
+        # extra named results (e.g. NEXRAD's mosaic frames) published with the frames
+        self.publishers = publishers or {}
+        self._published: Dict[str, Any] = {}
+        self._data_source: Optional[DataSource] = None
+        self._init_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.last_started: Optional[datetime] = None
+        self.last_finished: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+        self.consecutive_failures = 0
+        # Published result of the last completed update. Readers use this
+        # instead of touching processed_files while an update mutates it.
+        self._result: Any = []
+
+    @property
+    def data_source(self) -> DataSource:
+        if self._data_source is None:
+            with self._init_lock:
+                if self._data_source is None:
+                    logging.info(f'Initializing {self.name} data source')
+                    data_source = self.data_source_factory()
+                    self._publish(data_source, data_source.get_processed_locs_with_time())
+                    self._data_source = data_source
+        return self._data_source
+
+    @property
+    def result(self) -> Any:
+        '''The published frames; empty until the data source has been built.'''
+        return self._result
+
+    def published(self, name: str) -> Any:
+        '''One of the publishers' results; empty until the data source has been built.'''
+        return self._published.get(name, [])
+
+    def _publish(self, data_source: DataSource, result: Any):
+        self._published = {name: publish(data_source) for name, publish in self.publishers.items()}
+        self._result = result
+
+    def warm(self):
+        '''Builds the data source in a background thread.'''
+        thread = threading.Thread(target=self._warm, name=f'init-{self.name}', daemon=True)
+        thread.start()
+
+    def _warm(self):
+        try:
+            self.data_source
+        except Exception as e:
+            logging.error(f'Error initializing {self.name} data source: {e}')
+            self.last_error = str(e)
+
+    def is_initialized(self) -> bool:
+        return self._data_source is not None
+
+    def is_refreshing(self) -> bool:
+        return self.lock.locked()
+
+    def trigger(self) -> bool:
+        '''Starts a background refresh unless one is in flight. Returns True if started.'''
+        if not self.lock.acquire(blocking=False):
+            logging.info(f'{self.name} update already in progress')
+            return False
+        thread = threading.Thread(target=self._run_locked, name=f'update-{self.name}', daemon=True)
+        thread.start()
+        return True
+
+    def run(self) -> bool:
+        '''Refreshes in the calling thread unless one is in flight. Returns True on success.'''
+        if not self.lock.acquire(blocking=False):
+            logging.info(f'{self.name} update already in progress')
+            return False
+        return self._run_locked()
+
+    def _run_locked(self) -> bool:
+        logging.info(f'Acquired lock for updating {self.name} data')
+        self.last_started = datetime.now(timezone.utc)
+        try:
+            result = self.data_source.update_data()
+            if result is not None:
+                self._publish(self.data_source, result)
+            self.last_error = None
+            self.consecutive_failures = 0
+            return True
+        except Exception as e:
+            logging.error(f'Error updating {self.name} data: {e}')
+            self.last_error = str(e)
+            self.consecutive_failures += 1
+            return False
+        finally:
+            self.last_finished = datetime.now(timezone.utc)
+            self.lock.release()
+            logging.info(f'Released lock for updating {self.name} data')
+
+    def status(self) -> dict:
+        return {
+            'initialized': self.is_initialized(),
+            'refreshing': self.is_refreshing(),
+            'lastStarted': self.last_started.isoformat() if self.last_started else None,
+            'lastFinished': self.last_finished.isoformat() if self.last_finished else None,
+            'lastError': self.last_error,
+            'consecutiveFailures': self.consecutive_failures,
+        }
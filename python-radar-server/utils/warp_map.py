@@ -0,0 +1,198 @@
+import logging
+import math
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from affine import Affine
+
+
+EARTH_RADIUS_M = 6378137.0
+RESAMPLING_METHODS = ('nearest', 'bilinear')
+
+
+@dataclass
+class AxisMap:
+    '''
+    Destination-to-source mapping along one axis. Nearest uses lo, the
+    source pixel under each destination pixel; bilinear uses weights, a
+    sparse (destination, source) matrix of normalized kernel weights. valid
+    marks destination pixels that fall inside the source.
+    '''
+    lo: Optional[np.ndarray]    # int32
+    weights: Optional[object]   # scipy.sparse.csr_matrix
+    valid: np.ndarray           # bool
+
+
+@dataclass
+class WarpMap:
+    '''
+    Precomputed warp from a north-up geographic grid to EPSG:3857. For such
+    grids the warp is separable: destination columns depend only on longitude
+    and rows only on latitude, so one frame is warped with two gathers.
+    '''
+    dst_transform: Affine
+    dst_shape: Tuple[int, int]
+    rows: AxisMap
+    cols: AxisMap
+    resampling: str
+
+
+_warp_maps: Dict[tuple, WarpMap] = {}
+
+
+def warp_map_key(src_shape, src_transform, src_crs, dst_crs, resampling) -> tuple:
+    return (tuple(src_shape[:2]), tuple(src_transform)[:6], str(src_crs), str(dst_crs), resampling)
+
+
+def can_use_warp_map(src_transform, src_crs, dst_crs) -> bool:
+    '''True for north-up geographic sources warped to EPSG:3857.'''
+    from rasterio.crs import CRS
+    if src_transform.b != 0 or src_transform.d != 0 or src_transform.e >= 0:
+        return False
+    return CRS.from_user_input(src_crs).is_geographic and CRS.from_user_input(dst_crs).to_epsg() == 3857
+
+
+def gdal_kernel_scale(dst_size: int, src_size: int) -> float:
+    '''
+    The scale gdalwarp applies to its resampling kernel along an axis: the
+    destination/source size ratio, snapped to 1/n when within 0.05 of it.
+    '''
+    scale = dst_size / src_size
+    if scale < 1.0:
+        reciprocal = 1.0 / scale
+        if abs(reciprocal - round(reciprocal)) < 0.05:
+            scale = 1.0 / round(reciprocal)
+    return scale
+
+
+def _axis_map(src_coord: np.ndarray, size: int, resampling: str, scale: float = 1.0) -> AxisMap:
+    '''
+    src_coord is the (fractional) source pixel coordinate of each destination
+    pixel center, and scale the destination/source size ratio of the axis.
+    '''
+    valid = (src_coord >= 0) & (src_coord < size)
+    if resampling == 'nearest':
+        lo = np.clip(np.floor(src_coord), 0, size - 1).astype(np.int32)
+        return AxisMap(lo, None, valid)
+
+    import scipy.sparse
+
+    # Like gdalwarp, the bilinear (triangle) kernel is centered between
+    # source pixel centers and, when the axis is downsampled, widened by
+    # 1/scale so every source pixel under a destination pixel contributes.
+    # Source pixels past the edges are left out and the rest renormalized.
+    radius = math.ceil(1.0 / scale) if scale < 1.0 else 1
+    kernel_scale = min(scale, 1.0)
+    dst = np.nonzero(valid)[0]
+    t = src_coord[dst] - 0.5
+    base = np.floor(t)
+    delta = t - base
+
+    dst_idx, src_idx, weights = [], [], []
+    for offset in range(1 - radius, radius + 1):
+        src = base + offset
+        weight = np.maximum(0.0, 1.0 - np.abs((offset - delta) * kernel_scale))
+        keep = (src >= 0) & (src <= size - 1) & (weight > 0)
+        dst_idx.append(dst[keep])
+        src_idx.append(src[keep].astype(np.int64))
+        weights.append(weight[keep])
+    dst_idx, src_idx, weights = np.concatenate(dst_idx), np.concatenate(src_idx), np.concatenate(weights)
+
+    totals = np.bincount(dst_idx, weights=weights, minlength=len(src_coord))
+    matrix = scipy.sparse.csr_matrix(
+        (weights / totals[dst_idx], (dst_idx, src_idx)), shape=(len(src_coord), size)
+    )
+    return AxisMap(None, matrix, valid)
+
+
+def build_warp_map(src_shape, src_transform, src_crs, dst_crs='EPSG:3857', resampling='nearest') -> WarpMap:
+    from rasterio.warp import calculate_default_transform
+
+    if resampling not in RESAMPLING_METHODS:
+        raise ValueError(f'Unsupported resampling: {resampling}')
+    height, width = src_shape[:2]
+
+    # grids stored as 0..360 (e.g. MRMS) are placed in -180..180 for the
+    # destination extent; source columns are found by wrapping longitudes below
+    src_left = src_transform.c
+    shift = -360.0 if src_left >= 180.0 else 0.0
+    left = src_left + shift
+    right = left + src_transform.a * width
+    top = src_transform.f
+    bottom = top + src_transform.e * height
+
+    # the same destination grid gdalwarp would pick
+    dst_transform, dst_width, dst_height = calculate_default_transform(
+        src_crs, dst_crs, width, height, left=left, bottom=bottom, right=right, top=top
+    )
+
+    x = dst_transform.c + (np.arange(dst_width) + 0.5) * dst_transform.a
+    y = dst_transform.f + (np.arange(dst_height) + 0.5) * dst_transform.e
+    lon = np.degrees(x / EARTH_RADIUS_M)
+    lat = np.degrees(2 * np.arctan(np.exp(y / EARTH_RADIUS_M)) - math.pi / 2)
+
+    lon = src_left + np.mod(lon - src_left, 360.0)
+    src_col = (lon - src_left) / src_transform.a
+    src_row = (lat - top) / src_transform.e
+
+    logging.info(f'Built {resampling} warp map {width}x{height} -> {dst_width}x{dst_height}')
+    return WarpMap(
+        dst_transform=dst_transform,
+        dst_shape=(dst_height, dst_width),
+        rows=_axis_map(src_row, height, resampling, gdal_kernel_scale(dst_height, height)),
+        cols=_axis_map(src_col, width, resampling, gdal_kernel_scale(dst_width, width)),
+        resampling=resampling,
+    )
+
+
+def get_warp_map(src_shape, src_transform, src_crs, dst_crs='EPSG:3857', resampling='nearest') -> WarpMap:
+    key = warp_map_key(src_shape, src_transform, src_crs, dst_crs, resampling)
+    if key not in _warp_maps:
+        _warp_maps[key] = build_warp_map(src_shape, src_transform, src_crs, dst_crs, resampling)
+    return _warp_maps[key]
+
+
+def warp(array: np.ndarray, warp_map: WarpMap, nodata=0, alpha_band: Optional[int] = None) -> np.ndarray:
+    '''
+    Warps an (H, W) or (H, W, C) array with a precomputed map. Pixels outside
+    the source are nodata. For bilinear RGBA, pass alpha_band so colors are
+    weighted by alpha and transparent pixels don't bleed into their neighbours.
+    '''
+    rows, cols = warp_map.rows, warp_map.cols
+    out = np.full(warp_map.dst_shape + array.shape[2:], nodata, dtype=array.dtype)
+    row_idx = np.nonzero(rows.valid)[0]
+    col_idx = np.nonzero(cols.valid)[0]
+    if len(row_idx) == 0 or len(col_idx) == 0:
+        return out
+
+    if warp_map.resampling == 'nearest':
+        out[np.ix_(row_idx, col_idx)] = array[np.ix_(rows.lo[row_idx], cols.lo[col_idx])]
+        return out
+
+    source = array.astype(np.float32)
+    if alpha_band is not None:
+        alpha = source[..., alpha_band:alpha_band + 1] / 255.0
+        source = source * alpha
+        source[..., alpha_band] = alpha[..., 0]
+
+    # each axis is one sparse product over the (source axis, everything else) view
+    dst_height, dst_width = warp_map.dst_shape
+    bands = source.shape[2:]
+    along_cols = cols.weights @ np.moveaxis(source, 1, 0).reshape(source.shape[1], -1)
+    along_cols = np.moveaxis(along_cols.reshape((dst_width, source.shape[0]) + bands), 0, 1)
+    values = rows.weights @ along_cols.reshape(source.shape[0], -1)
+    values = values.reshape((dst_height, dst_width) + bands)[np.ix_(row_idx, col_idx)]
+
+    if alpha_band is not None:
+        alpha = values[..., alpha_band:alpha_band + 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = np.where(alpha > 0, values / alpha, 0)
+        values[..., alpha_band] = alpha[..., 0] * 255.0
+
+    if np.issubdtype(array.dtype, np.integer):
+        info = np.iinfo(array.dtype)
+        # rounded half up, as gdalwarp does
+        values = np.clip(np.floor(values + 0.5), info.min, info.max)
+    out[np.ix_(row_idx, col_idx)] = values.astype(array.dtype)
+    return out
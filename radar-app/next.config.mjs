@@ -1,6 +1,19 @@
 /** @type {import('next').NextConfig} */
 const nextConfig = {
   reactStrictMode: true,
+  async rewrites() {
+    return {
+      // Tiles that aren't files under public/tiles (frames in the .mbtiles or
+      // tile store formats, and zooms past the pre-rendered pyramid) are
+      // served by the python server's /tiles route.
+      fallback: [
+        {
+          source: '/tiles/:path*',
+          destination: 'http://127.0.0.1:5000/tiles/:path*',
+        },
+      ],
+    };
+  },
 };
 
 export default nextConfig;
@@ -1,30 +1,80 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import NexradMap from './NexradMap';
 import NexradRegionMap from './NexradRegionMap';
+import { USLoopingTileMap } from './LoopingTileMap';
 import styles from '../styles/NexradPage.module.css';
 
+// nexrad_reflectivity_color_relief.txt, which the mosaic tiles are colored with
+const reflectivityLegendColors = [
+  { value: 5.0, color: 'rgba(4, 233, 231, 1)' },      // Light blue
+  { value: 15.0, color: 'rgba(3, 0, 244, 1)' },       // Dark blue
+  { value: 20.0, color: 'rgba(2, 253, 2, 1)' },       // Green
+  { value: 30.0, color: 'rgba(0, 142, 0, 1)' },       // Dark green
+  { value: 35.0, color: 'rgba(253, 248, 2, 1)' },     // Yellow
+  { value: 45.0, color: 'rgba(253, 149, 0, 1)' },     // Orange
+  { value: 50.0, color: 'rgba(253, 0, 0, 1)' },       // Red
+  { value: 65.0, color: 'rgba(248, 0, 253, 1)' },     // Magenta
+  { value: 75.0, color: 'rgba(253, 253, 253, 1)' }    // White
+];
+
 const NexradPage: React.FC = () => {
-  const [view, setView] = useState<'map' | 'region'>('region');
+  const [view, setView] = useState<'map' | 'region' | 'mosaic'>('region');
   const [siteCode, setSiteCode] = useState<string>('KTLX');
+  const [mosaicDirs, setMosaicDirs] = useState<Record<string, string>>({});
 
   const handleSiteChange = (newSiteCode: string) => {
     setSiteCode(newSiteCode);
     setView('region');
   };
 
+  const updateMosaicData = async () => {
+    const response = await fetch(`/api/updateNexradMosaic`);
+    if (response.ok) {
+      const data = await response.json();
+      if (data.directories) {
+        setMosaicDirs(data.directories);
+      }
+    } else {
+      console.error('/updateNexradMosaic call failed');
+    }
+  };
+
+  useEffect(() => {
+    if (view === 'mosaic') {
+      updateMosaicData();
+    }
+  }, [view]);
+
+  const renderView = () => {
+    switch (view) {
+      case 'region':
+        return <NexradRegionMap site_code={siteCode} interval={1000} />;
+      case 'mosaic':
+        return (
+          <USLoopingTileMap
+            directories={mosaicDirs}
+            interval={500}
+            legendColors={reflectivityLegendColors}
+            maxBounds={[[50, -125], [24, -66.9]]}
+          />
+        );
+      default:
+        return <NexradMap onSelectSite={handleSiteChange} />;
+    }
+  };
+
   return (
     <div className={styles.container}>
       <div className={styles.header}>
-        {view === 'region' && (
+        {view !== 'map' && (
           <button className={styles.button} onClick={() => setView('map')}>Select Site</button>
         )}
+        {view !== 'mosaic' && (
+          <button className={styles.button} onClick={() => setView('mosaic')}>National Mosaic</button>
+        )}
       </div>
       <div className={styles.mapContainer}>
-        {view === 'region' ? (
-          <NexradRegionMap site_code={siteCode} interval={1000} />
-        ) : (
-          <NexradMap onSelectSite={handleSiteChange} />
-        )}
+        {renderView()}
       </div>
     </div>
   );